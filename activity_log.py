@@ -0,0 +1,145 @@
+"""
+Buffered user activity logging into AUDIT.USER_ACTIVITY_LOG
+
+Recording an event (a page view, search, export or edit) only appends it
+to an in-memory buffer; nothing is sent while a page renders. A background
+thread writes the buffer as multi-row INSERTs once it holds FLUSH_ROWS
+events or its oldest event is FLUSH_SECONDS old, whichever comes first,
+and once more when the process exits. Events carry the Streamlit session
+they came from, so one buffer serves every session of the process and a
+busy app still writes few, large batches.
+
+Activity logging is best effort: if a flush fails the events are put back
+and retried with the next flush, and beyond MAX_BUFFERED the oldest are
+dropped rather than letting the buffer grow without bound.
+"""
+
+import atexit
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import batch_writes
+from id_generator import new_id
+
+ACTIVITY_TABLE = "AUDIT.USER_ACTIVITY_LOG"
+
+ACTIVITY_COLUMNS = [
+    "activity_id", "user_name", "activity_type", "activity_description", "study_id",
+    "record_type", "record_id", "activity_timestamp", "session_id", "metadata",
+]
+
+# Activity types, as documented on USER_ACTIVITY_LOG
+VIEW = "VIEW"
+SEARCH = "SEARCH"
+EXPORT = "EXPORT"
+EDIT = "EDIT"
+
+FLUSH_ROWS = 200
+FLUSH_SECONDS = 30
+MAX_BUFFERED = 10_000
+
+
+class ActivityLog(threading.Thread):
+    """Process-wide activity buffer with a background flusher
+
+    execute(query, params) runs one statement and returns its rows;
+    transaction() holds the session for a multi-statement flush (see
+    batch_writes).
+    """
+
+    def __init__(self, execute, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS, max_buffered=MAX_BUFFERED,
+                 transaction=None):
+        super().__init__(name="activity-log-flusher", daemon=True)
+        self.execute = execute
+        self.transaction = transaction
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._events = deque(maxlen=max_buffered)
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self.dropped = 0
+        self.flushed = 0
+        self.last_error = None
+        atexit.register(self._flush_at_exit)
+
+    def record(self, user_name, activity_type, description, study_id=None, record_type=None,
+               record_id=None, session_id=None, metadata=None):
+        """Buffer one event; never touches the warehouse"""
+        event = {
+            "activity_id": new_id("ACT"),
+            "user_name": user_name,
+            "activity_type": activity_type,
+            "activity_description": description,
+            "study_id": study_id,
+            "record_type": record_type,
+            "record_id": record_id,
+            "activity_timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
+            "session_id": session_id,
+            "metadata": json.dumps(metadata, default=str) if metadata else None,
+        }
+        with self._lock:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = len(self._events) >= self.flush_rows
+        if full:
+            self._wake.set()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._events)
+
+    def _due(self):
+        with self._lock:
+            if not self._events:
+                return False
+            return len(self._events) >= self.flush_rows or time.monotonic() - self._oldest >= self.flush_seconds
+
+    def run(self):
+        while True:
+            self._wake.wait(min(self.flush_seconds, 5))
+            self._wake.clear()
+            if self._due():
+                try:
+                    self.flush()
+                except Exception:
+                    # Events are back in the buffer; keep the thread alive
+                    pass
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+    def flush(self):
+        """Write every buffered event; returns the number written"""
+        with self._flush_lock:
+            with self._lock:
+                events = list(self._events)
+                self._events.clear()
+                self._oldest = None
+            if not events:
+                return 0
+            try:
+                batch_writes.insert_rows(self.execute, ACTIVITY_TABLE, ACTIVITY_COLUMNS, events,
+                                         json_columns=("metadata",), transaction=self.transaction)
+            except Exception as e:
+                self.last_error = str(e)
+                with self._lock:
+                    # Put the batch back ahead of newer events, oldest dropped first
+                    room = self._events.maxlen - len(self._events)
+                    self.dropped += max(0, len(events) - room)
+                    self._events.extendleft(reversed(events[-room:] if room else []))
+                    self._oldest = time.monotonic()
+                raise
+            self.last_error = None
+            self.flushed += len(events)
+            return len(events)
@@ -0,0 +1,241 @@
+"""
+Batched writes for bulk data entry
+
+A whole grid of observations is written in one go instead of one INSERT
+per row: small batches as multi-row INSERT ... VALUES statements with
+bind parameters (MAX_ROWS_PER_INSERT rows each, inside one transaction),
+large ones through session.write_pandas, which stages the frame and loads
+it with a single COPY.
+
+Rows are validated before anything is sent, so a batch is either written
+completely or not at all.
+
+Captured records are written with upsert_rows: a MERGE on the record's key
+with the batch as its source, so re-sending the same keys (a Streamlit
+rerun, a double submit, a replayed batch) updates in place instead of
+duplicating rows or failing.
+
+A batch of several statements runs between BEGIN and COMMIT on a session
+that other threads may share. Callers pass transaction, a context manager
+factory held for the whole transaction, so that no other thread's
+statement runs inside it or is undone by its ROLLBACK.
+"""
+
+from contextlib import nullcontext
+from datetime import date
+
+import pandas as pd
+
+import measurements
+
+DATABASE_NAME = "CLINICAL_RESEARCH"
+
+# Snowflake accepts at most 16,384 rows in a VALUES clause; this also keeps
+# the bind count of an 11-column insert well under SQLite's limit
+MAX_ROWS_PER_INSERT = 1000
+
+# From this size the stage-and-COPY path of write_pandas is cheaper
+WRITE_PANDAS_MIN_ROWS = 5000
+
+OBSERVATION_COLUMNS = [
+    "observation_id", "study_id", "participant_id", "observation_date", "visit_number",
+    "observation_type", "measurement_name", "measurement_value", "measurement_unit",
+    "created_by", "created_date",
+] + measurements.TYPED_COLUMNS
+
+# Column widths from sql/02_create_tables.sql
+_MAX_LENGTHS = {"measurement_name": 255, "measurement_value": 500, "measurement_unit": 50}
+
+
+def _blank(value):
+    return value is None or (not isinstance(value, str) and pd.isna(value)) or str(value).strip() == ""
+
+
+def validate_observations(grid, participant_ids):
+    """Check an observation grid before writing it
+
+    grid has PARTICIPANT, MEASUREMENT, VALUE and UNIT columns;
+    participant_ids maps participant numbers to participant IDs. Rows
+    without a value are skipped, so a prefilled grid can be left partly
+    empty. Returns (rows, errors): rows is a list of dicts for the rows to
+    write, errors a list of "Row n: message" strings.
+    """
+    rows, errors = [], []
+    for number, record in enumerate(grid.to_dict("records"), start=1):
+        participant = record.get("PARTICIPANT")
+        measurement = record.get("MEASUREMENT")
+        value = record.get("VALUE")
+        unit = record.get("UNIT")
+        if _blank(value):
+            continue
+        if _blank(participant):
+            errors.append(f"Row {number}: participant is required")
+        elif str(participant) not in participant_ids:
+            errors.append(f"Row {number}: participant {participant} is not enrolled in this study")
+        if _blank(measurement):
+            errors.append(f"Row {number}: measurement name is required")
+        row = {
+            "participant_id": participant_ids.get(str(participant)),
+            "measurement_name": None if _blank(measurement) else str(measurement).strip(),
+            "measurement_value": str(value).strip(),
+            "measurement_unit": None if _blank(unit) else str(unit).strip(),
+        }
+        for column, limit in _MAX_LENGTHS.items():
+            if row[column] is not None and len(row[column]) > limit:
+                errors.append(f"Row {number}: {column.replace('_', ' ')} is longer than {limit} characters")
+        rows.append(row)
+    return rows, errors
+
+
+def validate_visit(observation_date, visit_number):
+    """Errors for the date and visit number shared by every row of a grid"""
+    errors = []
+    if observation_date > date.today():
+        errors.append("Observation date cannot be in the future")
+    if visit_number < 0:
+        errors.append("Visit number cannot be negative")
+    return errors
+
+
+def _source(columns, row_count, json_columns=()):
+    """SELECT over a VALUES list of row_count rows of bind parameters
+
+    Columns in json_columns take a JSON string and are loaded into VARIANT
+    with PARSE_JSON; Snowflake does not allow that inside VALUES, so it
+    wraps the VALUES columns instead.
+    """
+    projection = ", ".join(
+        f"PARSE_JSON(column{i}) as {c}" if c in json_columns else f"column{i} as {c}"
+        for i, c in enumerate(columns, start=1)
+    )
+    placeholders = "(" + ", ".join("?" for _ in columns) + ")"
+    return f"SELECT {projection} FROM (VALUES {', '.join(placeholders for _ in range(row_count))})"
+
+
+def insert_statements(table, columns, rows, chunk_size=MAX_ROWS_PER_INSERT, json_columns=()):
+    """Yield (query, params) multi-row INSERT statements covering rows
+
+    With json_columns the statements are INSERT ... SELECT over VALUES
+    (see _source), otherwise plain INSERT ... VALUES.
+    """
+    placeholders = "(" + ", ".join("?" for _ in columns) + ")"
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        if json_columns:
+            values = _source(columns, len(chunk), json_columns)
+        else:
+            values = "VALUES " + ", ".join(placeholders for _ in chunk)
+        query = f"INSERT INTO {DATABASE_NAME}.{table} ({', '.join(columns)}) {values}"
+        yield query, [row[column] for row in chunk for column in columns]
+
+
+def merge_statements(table, columns, rows, key_columns, update_columns=None,
+                     chunk_size=MAX_ROWS_PER_INSERT, json_columns=()):
+    """Yield (query, params) MERGE statements upserting rows on key_columns
+
+    update_columns are overwritten when a key already exists: None means
+    every non-key column, an empty tuple makes the MERGE insert-only.
+    Rows repeating a key are collapsed (last one wins), since a MERGE
+    source must not match one target row twice.
+    """
+    unique = {}
+    for row in rows:
+        unique[tuple(row[key] for key in key_columns)] = row
+    rows = list(unique.values())
+    if update_columns is None:
+        update_columns = [column for column in columns if column not in key_columns]
+    on = " AND ".join(f"t.{key} = s.{key}" for key in key_columns)
+    matched = ""
+    if update_columns:
+        matched = " WHEN MATCHED THEN UPDATE SET " + ", ".join(f"{c} = s.{c}" for c in update_columns)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        query = (
+            f"MERGE INTO {DATABASE_NAME}.{table} t USING ({_source(columns, len(chunk), json_columns)}) s"
+            f" ON {on}{matched}"
+            f" WHEN NOT MATCHED THEN INSERT ({', '.join(columns)})"
+            f" VALUES ({', '.join(f's.{c}' for c in columns)})"
+        )
+        yield query, [row[column] for row in chunk for column in columns]
+
+
+def _in_transaction(execute, statements, run, transaction):
+    """Run statements between BEGIN and COMMIT, rolling back if one fails"""
+    with (transaction or nullcontext)():
+        execute("BEGIN")
+        try:
+            for query, params in statements:
+                run(query, params)
+        except Exception:
+            execute("ROLLBACK")
+            raise
+        execute("COMMIT")
+
+
+def run_in_transaction(execute, statements, transaction=None):
+    """Run (query, params) statements in one transaction, inside transaction() if given"""
+    _in_transaction(execute, statements, execute, transaction)
+
+
+def upsert_rows(execute, table, columns, rows, key_columns, update_columns=None,
+                json_columns=(), chunk_size=MAX_ROWS_PER_INSERT, transaction=None):
+    """Idempotently write rows with MERGE statements (see merge_statements)
+
+    Batches of keys go in one statement per chunk, all chunks in one
+    transaction, run inside transaction() if given. Returns (rows
+    inserted, rows updated).
+    """
+    statements = list(merge_statements(table, columns, rows, key_columns, update_columns,
+                                       chunk_size, json_columns))
+    inserted = updated = 0
+
+    def run(query, params):
+        nonlocal inserted, updated
+        result = execute(query, params)
+        counts = result[0].as_dict() if result else {}
+        inserted += counts.get("number of rows inserted", 0)
+        updated += counts.get("number of rows updated", 0)
+
+    if len(statements) == 1:
+        run(*statements[0])
+        return inserted, updated
+    _in_transaction(execute, statements, run, transaction)
+    return inserted, updated
+
+
+def _executor(session):
+    return lambda query, params=None: session.sql(query, params=params).collect()
+
+
+def insert_rows(execute, table, columns, rows, chunk_size=MAX_ROWS_PER_INSERT, json_columns=(),
+                transaction=None):
+    """Write rows (dicts keyed by column) with multi-row INSERTs in one transaction
+
+    execute(query, params) runs one statement; table is schema-qualified,
+    e.g. RESEARCH_DATA.OBSERVATIONS. The transaction runs inside
+    transaction() if given. Returns the number of statements issued. See
+    insert_statements for json_columns.
+    """
+    statements = list(insert_statements(table, columns, rows, chunk_size, json_columns))
+    if len(statements) == 1:
+        execute(*statements[0])
+        return 1
+    _in_transaction(execute, statements, execute, transaction)
+    return len(statements)
+
+
+def write_rows(session, table, columns, rows, execute=None, json_columns=(), transaction=None):
+    """Write rows with the cheapest path for the batch size
+
+    execute defaults to running statements directly on session. Returns the
+    number of statements issued (1 for write_pandas).
+    """
+    if len(rows) >= WRITE_PANDAS_MIN_ROWS and not json_columns:
+        schema, name = table.split(".")
+        frame = pd.DataFrame([[row[column] for column in columns] for row in rows],
+                             columns=[column.upper() for column in columns])
+        session.write_pandas(frame, name, database=DATABASE_NAME, schema=schema,
+                             auto_create_table=False, overwrite=False)
+        return 1
+    return insert_rows(execute or _executor(session), table, columns, rows, json_columns=json_columns,
+                       transaction=transaction)
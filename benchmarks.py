@@ -0,0 +1,394 @@
+"""
+Page latency benchmarks for clinical_research_app.py against the local backend
+
+Runs every page of the app headlessly with Streamlit's AppTest on the SQLite
+stand-in from local_backend.py, after seeding it with synthetic studies,
+participants, observations, notes and findings.
+
+Usage:
+    python benchmarks.py [--runs 20] [--studies 20] [--participants 50] [--latency-ms 0]
+                         [--bulk-rows 10000] [--import-rows 500000] [--search-notes 1000000]
+
+--latency-ms adds a simulated warehouse round trip to every local query, so
+round-trip savings (fewer or concurrent queries) show up in the timings.
+--bulk-rows also times writing that many observations one INSERT per row,
+as multi-row INSERTs, as MERGE upserts and through write_pandas.
+--import-rows times a streaming spreadsheet import of an xlsx workbook
+with that many observation rows.
+--search-notes adds that many notes with a skewed vocabulary and times
+ranked full-text note search against the LIKE filter it replaced, deep
+pages of browsing those notes with keyset against OFFSET paging, and tag
+filters on the NOTE_TAGS index against ARRAY_CONTAINS on the tags column.
+"""
+
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+
+os.environ["CLINICAL_RESEARCH_BACKEND"] = "local"
+
+import batch_writes
+import keyset
+import local_backend
+import measurements
+import note_tags
+import record_search
+import spreadsheet_import
+from id_generator import new_id
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clinical_research_app.py")
+PAGES = ["Dashboard", "Studies", "Data Entry", "Search", "Reports", "Admin"]
+
+
+def seed(session, studies=20, participants=50, rows_per_participant=5):
+    """Load synthetic research data into a local session"""
+    rng = random.Random(42)
+    today = date.today()
+    conn = session._conn
+    with session._lock:
+        for s in range(studies):
+            study_id = f"STD_BENCH_{s:04d}"
+            conn.execute(
+                "INSERT INTO RESEARCH_DATA.STUDIES (study_id, study_name, study_number, principal_investigator,"
+                " study_phase, study_type, target_enrollment, current_enrollment, study_status)"
+                " VALUES (?, ?, ?, ?, 'Active', 'Observational Study', ?, ?, 'ACTIVE')",
+                (study_id, f"Benchmark Study {s}", f"IRB-{s:05d}", f"Dr. PI {s}", participants * 2, participants),
+            )
+            for p in range(participants):
+                participant_id = f"PART_{study_id}_{p:04d}"
+                conn.execute(
+                    "INSERT INTO RESEARCH_DATA.PARTICIPANTS (participant_id, study_id, participant_number,"
+                    " enrollment_date, consent_date, participant_status) VALUES (?, ?, ?, ?, ?, 'ACTIVE')",
+                    (participant_id, study_id, f"{p:04d}", today.isoformat(), today.isoformat()),
+                )
+                for r in range(rows_per_participant):
+                    day = (today - timedelta(days=rng.randint(0, 60))).isoformat()
+                    suffix = f"{s:04d}_{p:04d}_{r:02d}"
+                    conn.execute(
+                        "INSERT INTO RESEARCH_DATA.OBSERVATIONS (observation_id, study_id, participant_id,"
+                        " observation_date, visit_number, measurement_name, measurement_value, measurement_unit)"
+                        " VALUES (?, ?, ?, ?, ?, 'Heart Rate', ?, 'bpm')",
+                        (f"OBS_{suffix}", study_id, participant_id, day, r, str(rng.randint(50, 120))),
+                    )
+                    conn.execute(
+                        "INSERT INTO RESEARCH_DATA.RESEARCH_NOTES (note_id, study_id, participant_id, note_type,"
+                        " note_title, note_text, note_date) VALUES (?, ?, ?, 'Progress Note', ?, ?, ?)",
+                        (f"NOTE_{suffix}", study_id, participant_id, f"Visit {r} note",
+                         f"Participant {p} visit {r}: vitals stable, no adverse events", day),
+                    )
+                if p % 10 == 0:
+                    conn.execute(
+                        "INSERT INTO RESEARCH_DATA.FINDINGS (finding_id, study_id, participant_id, finding_type,"
+                        " finding_description, severity, sae_reported) VALUES (?, ?, ?, 'Adverse Event', ?, ?, FALSE)",
+                        (f"FND_{s:04d}_{p:04d}", study_id, participant_id, "Mild headache after dosing",
+                         rng.choice(["Mild", "Moderate", "Severe"])),
+                    )
+    # Rows went in through the raw connection, so bring derived tables up to date
+    session.refresh_dynamic_tables()
+    session.sql(measurements.BACKFILL_STATEMENT).collect()
+
+
+def run_page(session, page, study_id):
+    """Render one page from a fresh session; return elapsed seconds and queries issued"""
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.session_state.current_study = study_id
+    at.run()
+    queries_before = session.query_count
+    started = time.perf_counter()
+    if page == "Dashboard":
+        at.run()
+    else:
+        at.sidebar.radio[0].set_value(page).run()
+    elapsed = time.perf_counter() - started
+    if at.exception:
+        raise RuntimeError(f"{page} raised: {at.exception[0].value}")
+    return elapsed, session.query_count - queries_before
+
+
+def observation_rows(count, study_id="STD_BENCH_0000", participants=50):
+    """Synthetic observation rows for the bulk write benchmark"""
+    today = date.today().isoformat()
+    return measurements.add_typed_values([
+        {
+            "observation_id": new_id("OBS"), "study_id": study_id,
+            "participant_id": f"PART_{study_id}_{i % participants:04d}", "observation_date": today,
+            "visit_number": 1, "observation_type": "Vital Signs", "measurement_name": "Heart Rate",
+            "measurement_value": str(60 + i % 40), "measurement_unit": "bpm",
+            "created_by": "BENCHMARK", "created_date": today,
+        }
+        for i in range(count)
+    ], {})
+
+
+def run_bulk_writes(session, count):
+    """Time one bulk observation batch per write path; return {path: (seconds, statements)}"""
+    table = "RESEARCH_DATA.OBSERVATIONS"
+    columns = batch_writes.OBSERVATION_COLUMNS
+    execute = lambda query, params=None: session.sql(query, params=params).collect()
+    paths = {
+        "row by row": lambda rows: batch_writes.insert_rows(execute, table, columns, rows, chunk_size=1),
+        "multi-row": lambda rows: batch_writes.insert_rows(execute, table, columns, rows),
+        "merge": lambda rows: batch_writes.upsert_rows(execute, table, columns, rows, columns[:1]),
+    }
+    if count >= batch_writes.WRITE_PANDAS_MIN_ROWS:
+        paths["write_pandas"] = lambda rows: batch_writes.write_rows(session, table, columns, rows)
+    results = {}
+    for name, write in paths.items():
+        rows = observation_rows(count)
+        queries_before = session.query_count
+        started = time.perf_counter()
+        write(rows)
+        results[name] = (time.perf_counter() - started, session.query_count - queries_before)
+    return results
+
+
+def observation_workbook(count, participants=50):
+    """xlsx bytes of one sheet with count observation rows, as a legacy study workbook
+
+    Every row is distinct (each participant's visits count up), so none is
+    collapsed as a repeat by the import.
+    """
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Observations")
+    sheet.append(["Subject ID", "Visit Date", "Visit", "Test", "Result", "Units"])
+    for i in range(count):
+        sheet.append([f"{i % participants:04d}", datetime(2024, 1, 1) + timedelta(days=i % 60), 1 + i // participants,
+                      "Heart Rate", 60 + i % 40, "bpm"])
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def run_sheet_import(session, count, study_id="STD_BENCH_0000", participants=50):
+    """Time a streaming import of a count-row workbook; return (seconds, result)"""
+    data = observation_workbook(count, participants)
+    target = spreadsheet_import.TARGETS["Observations"]
+    mapping = spreadsheet_import.suggest_mapping(target, spreadsheet_import.read_header("bench.xlsx", data))
+    participant_ids = {f"{p:04d}": f"PART_{study_id}_{p:04d}" for p in range(participants)}
+    execute = lambda query, params=None: session.sql(query, params=params).collect()
+    started = time.perf_counter()
+    result = spreadsheet_import.import_sheet(session, execute, target, study_id, "bench.xlsx", data, mapping,
+                                             "BENCHMARK", participant_ids)
+    return time.perf_counter() - started, result
+
+
+# The Search Notes filter before the full-text index
+LIKE_SEARCH_QUERY = """
+    SELECT n.note_title, s.study_name, n.note_type, n.note_date, n.created_by
+    FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES n
+    JOIN CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES s ON n.study_id = s.study_id
+    WHERE n.note_date >= ?
+    AND (? = '' OR UPPER(n.note_title) LIKE ? OR UPPER(n.note_text) LIKE ?)
+    ORDER BY n.note_date DESC
+    LIMIT 100
+"""
+
+NOTE_WORDS = [
+    "participant", "reported", "mild", "moderate", "severe", "headache", "nausea", "fatigue", "dizziness",
+    "rash", "fever", "cough", "insomnia", "vitals", "stable", "dose", "adjusted", "visit", "missed",
+    "consent", "reviewed", "labs", "pending", "elevated", "normal", "follow", "up", "scheduled", "protocol",
+    "deviation", "resolved", "ongoing", "medication", "compliance", "good", "poor", "weight", "blood",
+    "pressure", "glucose", "ecg", "unremarkable", "hospitalized", "discharged", "improved", "worsened",
+]
+
+
+TAG_COUNT = 200
+
+
+def seed_search_notes(session, count, studies=20, seed_value=7):
+    """Add count synthetic notes over the past year; word and tag frequencies follow a Zipf-like curve"""
+    rng = random.Random(seed_value)
+    words = NOTE_WORDS + [f"term{i}" for i in range(5000)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    tags = [f"tag{i}" for i in range(TAG_COUNT)]
+    tag_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(TAG_COUNT)))
+    today = date.today()
+    conn = session._conn
+    with session._lock:
+        conn.execute("BEGIN")
+        for start in range(0, count, 10000):
+            batch = []
+            for i in range(start, min(start + 10000, count)):
+                text = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(8, 40)))
+                picked = list(dict.fromkeys(rng.choices(tags, cum_weights=tag_weights, k=rng.randint(0, 3))))
+                batch.append((f"NOTE_SEARCH_{i:08d}", f"STD_BENCH_{i % studies:04d}",
+                              " ".join(rng.choices(words, cum_weights=cum_weights, k=3)).capitalize(), text,
+                              (today - timedelta(days=rng.randint(0, 364))).isoformat(),
+                              json.dumps(picked) if picked else None))
+            conn.executemany(
+                "INSERT INTO RESEARCH_DATA.RESEARCH_NOTES (note_id, study_id, note_type, note_title, note_text,"
+                " note_date, tags) VALUES (?, ?, 'Progress Note', ?, ?, ?, ?)",
+                batch,
+            )
+        conn.execute("COMMIT")
+    session.refresh_dynamic_tables()
+
+
+def run_note_search(session, runs=5):
+    """Time LIKE and ranked search per term and window; return [(term, days, like ms, ranked ms, matches)]"""
+    results = []
+    for term in ["hospitalized", "term40", "term4000", "headache nausea"]:
+        for days in (30, 365):
+            date_from = date.today() - timedelta(days=days)
+            like_term = term.split()[0].upper()
+            like_params = [date_from.isoformat(), like_term, f"%{like_term}%", f"%{like_term}%"]
+            terms = record_search.search_terms(term)
+            timings = {"like": [], "ranked": []}
+            for _ in range(runs):
+                started = time.perf_counter()
+                session.sql(LIKE_SEARCH_QUERY, params=like_params).collect()
+                timings["like"].append(time.perf_counter() - started)
+                started = time.perf_counter()
+                query, seek_params = keyset.page_query(record_search.SEARCH_QUERY, record_search.KEYS, None, 100)
+                params = record_search.search_params(terms, date_from, ("NOTE",)) + seek_params
+                rows = session.sql(query, params=params).collect()
+                timings["ranked"].append(time.perf_counter() - started)
+            results.append((term, days, statistics.median(timings["like"]) * 1000,
+                            statistics.median(timings["ranked"]) * 1000, len(rows)))
+    return results
+
+
+BROWSE_NOTES_QUERY = """
+    SELECT note_id, study_id, note_type, note_title, note_date, created_by
+    FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES
+"""
+
+
+def run_browse_paging(session, pages=(1, 10, 100, 1000, 4000), rows_per_page=25, runs=5):
+    """Time fetching a page chunk by keyset and by OFFSET; return [(page, offset ms, keyset ms)]"""
+    keys = ("note_date", "note_id")
+    limit = keyset.chunk_size(rows_per_page)
+    ordered = f"{BROWSE_NOTES_QUERY} ORDER BY {keyset.order_by(keys)}"
+    results = []
+    for page in pages:
+        skipped = (page - 1) * rows_per_page
+        cursor = None
+        if skipped:
+            # The cursor the previous page would have handed over
+            row = session.sql(f"{ordered} LIMIT 1 OFFSET {skipped - 1}").collect()[0]
+            cursor = (row["NOTE_DATE"], row["NOTE_ID"])
+        query, params = keyset.page_query(BROWSE_NOTES_QUERY, keys, cursor, limit)
+        timings = {"offset": [], "keyset": []}
+        for _ in range(runs):
+            started = time.perf_counter()
+            session.sql(f"{ordered} LIMIT {limit} OFFSET {skipped}").collect()
+            timings["offset"].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            session.sql(query, params=params).collect()
+            timings["keyset"].append(time.perf_counter() - started)
+        results.append((page, statistics.median(timings["offset"]) * 1000, statistics.median(timings["keyset"]) * 1000))
+    return results
+
+
+# Tag filter on the tags column, before the NOTE_TAGS index
+ARRAY_TAG_QUERY = """
+    SELECT n.note_id, n.note_title, n.note_date
+    FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES n
+    WHERE n.note_date >= ?
+    AND ARRAY_CONTAINS(TO_VARIANT(?), n.tags)
+    AND (? IS NULL OR ARRAY_CONTAINS(TO_VARIANT(?), n.tags))
+    ORDER BY n.note_date DESC, n.note_id DESC
+    LIMIT 51
+"""
+
+
+def run_tag_filter(session, runs=5):
+    """Time a tag filter page by ARRAY_CONTAINS and by NOTE_TAGS, and the facet counts beside it
+
+    Returns [(tags, days, array ms, index ms, facets ms, notes)].
+    """
+    results = []
+    for tags in [("tag0",), ("tag150",), ("tag0", "tag1"), ("tag3", "tag40")]:
+        for days in (30, 365):
+            date_from = date.today() - timedelta(days=days)
+            second = tags[1] if len(tags) > 1 else None
+            array_params = [date_from.isoformat(), tags[0], second, second]
+            query, seek_params = keyset.page_query(note_tags.TAGGED_NOTES_QUERY, note_tags.KEYS, None, 51)
+            params = note_tags.tagged_notes_params(tags, date_from) + seek_params
+            facet_query, facet_params = note_tags.facet_query(tags, date_from)
+            timings = {"array": [], "index": [], "facets": []}
+            for _ in range(runs):
+                started = time.perf_counter()
+                session.sql(ARRAY_TAG_QUERY, params=array_params).collect()
+                timings["array"].append(time.perf_counter() - started)
+                started = time.perf_counter()
+                rows = session.sql(query, params=params).collect()
+                timings["index"].append(time.perf_counter() - started)
+                started = time.perf_counter()
+                session.sql(facet_query, params=facet_params).collect()
+                timings["facets"].append(time.perf_counter() - started)
+            results.append((" ".join(tags), days, statistics.median(timings["array"]) * 1000,
+                            statistics.median(timings["index"]) * 1000,
+                            statistics.median(timings["facets"]) * 1000, len(rows)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--studies", type=int, default=20)
+    parser.add_argument("--participants", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--bulk-rows", type=int, default=0)
+    parser.add_argument("--import-rows", type=int, default=0)
+    parser.add_argument("--search-notes", type=int, default=0)
+    args = parser.parse_args()
+
+    session = local_backend.shared_session()
+    seed(session, studies=args.studies, participants=args.participants)
+    session.latency = args.latency_ms / 1000
+
+    print(f"{'page':<12} {'median ms':>10} {'p95 ms':>10} {'queries/run':>12}")
+    for page in PAGES:
+        timings, queries = [], []
+        for _ in range(args.runs):
+            elapsed, issued = run_page(session, page, "STD_BENCH_0000")
+            timings.append(elapsed * 1000)
+            queries.append(issued)
+        p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+        print(f"{page:<12} {statistics.median(timings):>10.1f} {p95:>10.1f} {statistics.mean(queries):>12.1f}")
+
+    if args.bulk_rows:
+        print()
+        print(f"{'bulk write':<14} {'rows':>7} {'ms':>10} {'rows/s':>10} {'statements':>11}")
+        for name, (elapsed, statements) in run_bulk_writes(session, args.bulk_rows).items():
+            print(f"{name:<14} {args.bulk_rows:>7} {elapsed * 1000:>10.1f} "
+                  f"{args.bulk_rows / elapsed:>10.0f} {statements:>11}")
+
+    if args.import_rows:
+        elapsed, result = run_sheet_import(session, args.import_rows, participants=args.participants)
+        print()
+        print(f"{'sheet import':<14} {'rows':>7} {'s':>10} {'rows/s':>10} {'chunks':>11}")
+        print(f"{'xlsx':<14} {result.rows_loaded:>7} {elapsed:>10.1f} {result.rows_read / elapsed:>10.0f} "
+              f"{result.files:>11}")
+
+    if args.search_notes:
+        started = time.perf_counter()
+        seed_search_notes(session, args.search_notes, studies=args.studies)
+        print()
+        print(f"note search over {args.search_notes:,} added notes (loaded and indexed in "
+              f"{time.perf_counter() - started:.1f}s)")
+        print(f"{'terms':<18} {'days':>5} {'LIKE ms':>10} {'ranked ms':>10} {'results':>8}")
+        for term, days, like_ms, ranked_ms, matches in run_note_search(session):
+            print(f"{term:<18} {days:>5} {like_ms:>10.1f} {ranked_ms:>10.1f} {matches:>8}")
+        print()
+        print(f"{'browse notes page':<18} {'OFFSET ms':>10} {'keyset ms':>10}")
+        for page, offset_ms, keyset_ms in run_browse_paging(session):
+            print(f"{page:<18} {offset_ms:>10.1f} {keyset_ms:>10.1f}")
+        print()
+        print(f"{'tags':<18} {'days':>5} {'ARRAY ms':>10} {'index ms':>10} {'facets ms':>10} {'notes':>6}")
+        for tags, days, array_ms, index_ms, facets_ms, notes in run_tag_filter(session):
+            print(f"{tags:<18} {days:>5} {array_ms:>10.1f} {index_ms:>10.1f} {facets_ms:>10.1f} {notes:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,28 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta, date
-import snowflake.snowpark.context as snowpark_context
-
-# Initialize Snowflake session for Streamlit in Snowflake
-session = snowpark_context.get_active_session()
+import os
+import io
+import json
+import hashlib
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import reference_data
+from id_generator import new_id
+import batch_writes
+import form_engine
+import write_behind
+import participant_import
+import spreadsheet_import
+import measurements
+import activity_log
+import record_search
+import note_tags
+import keyset
 
 # Page configuration
 st.set_page_config(
@@ -16,11 +34,172 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+def get_session():
+    """Get the session for the configured backend (CLINICAL_RESEARCH_BACKEND)"""
+    backend = os.environ.get("CLINICAL_RESEARCH_BACKEND", "snowflake").lower()
+    if backend == "local":
+        # SQLite stand-in loaded from sql/*.sql, for offline runs and benchmarks
+        import local_backend
+        return local_backend.shared_session()
+    
+    # Initialize Snowflake session for Streamlit in Snowflake
+    import snowflake.snowpark.context as snowpark_context
+    return snowpark_context.get_active_session()
+
+session = get_session()
+
+# Query layer - all statements take bind parameters so the query text stays
+# constant per call site and Snowflake can reuse compiled plans and results
+class QueryStats:
+    """Counts of the query texts issued by the app, shared across sessions"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = Counter()
+    
+    def record(self, query):
+        with self._lock:
+            self.counts[" ".join(query.split())] += 1
+    
+    def distinct_texts(self):
+        return len(self.counts)
+    
+    def total(self):
+        return sum(self.counts.values())
+
+@st.cache_resource
+def get_query_stats():
+    """Get the process-wide query text statistics"""
+    return QueryStats()
+
+# Every script run, query worker and background writer shares the one session,
+# and a transaction belongs to the session, not the thread: a statement from
+# another thread between BEGIN and COMMIT would join it, and its ROLLBACK
+# would undo that statement too. Statements run side by side; a transaction
+# waits for the running ones and holds off the rest until it ends.
+class SessionGate:
+    """Shared access to the session for statements, exclusive for transactions"""
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._owner = None
+        self._depth = 0
+        self._running = 0
+    
+    @contextmanager
+    def statement(self):
+        me = threading.get_ident()
+        with self._condition:
+            self._condition.wait_for(lambda: self._owner in (None, me))
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
+    
+    @contextmanager
+    def transaction(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._owner != me:
+                self._condition.wait_for(lambda: self._owner is None)
+                self._owner = me
+                self._condition.wait_for(lambda: self._running == 0)
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._depth -= 1
+                if not self._depth:
+                    self._owner = None
+                    self._condition.notify_all()
+
+@st.cache_resource
+def get_session_gate():
+    """Get the process-wide gate in front of the shared session"""
+    return SessionGate()
+
+def run_query(query, params=None):
+    """Run a SELECT with bind parameters and return a DataFrame"""
+    get_query_stats().record(query)
+    with get_session_gate().statement():
+        return session.sql(query, params=params).to_pandas()
+
+def run_statement(query, params=None):
+    """Run a DML statement with bind parameters and return the result rows"""
+    get_query_stats().record(query)
+    with get_session_gate().statement():
+        return session.sql(query, params=params).collect()
+
+def upsert_rows(table, columns, rows, key_columns=None, update_columns=None, json_columns=()):
+    """Upsert rows on their key (default: the first column); returns (inserted, updated)"""
+    return batch_writes.upsert_rows(run_statement, table, columns, rows, key_columns or columns[:1],
+                                    update_columns, json_columns, transaction=get_session_gate().transaction)
+
+# Session context - user, role, database, study access and page size fetched
+# in one round trip per Streamlit session and refreshed only when the study changes
+DEFAULT_ROWS_PER_PAGE = 25
+
+class SessionContext:
+    """Snapshot of the session's identity, database and study access"""
+    def __init__(self, row, study_id):
+        self.user = row['USER_NAME']
+        self.role = row['ROLE_NAME']
+        self.database = row['DATABASE_NAME']
+        self.schema = row['SCHEMA_NAME']
+        studies = row['ACCESSIBLE_STUDIES']
+        self.accessible_studies = tuple(sorted(json.loads(studies) if isinstance(studies, str) else studies or []))
+        self.study_id = study_id
+        self.study_name = row['CURRENT_STUDY_NAME']
+        self.rows_per_page = int(row['ROWS_PER_PAGE'] or DEFAULT_ROWS_PER_PAGE)
+
+def fetch_session_context(study_id):
+    """Fetch the session context in a single query"""
+    rows = run_statement("""
+        SELECT 
+            CURRENT_USER() as user_name,
+            CURRENT_ROLE() as role_name,
+            CURRENT_DATABASE() as database_name,
+            CURRENT_SCHEMA() as schema_name,
+            (SELECT ARRAY_AGG(study_id) FROM CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES) as accessible_studies,
+            (SELECT study_name FROM CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES WHERE study_id = ?) as current_study_name,
+            (SELECT rows_per_page FROM CLINICAL_RESEARCH.REFERENCE_DATA.USER_PREFERENCES
+             WHERE user_name = CURRENT_USER()) as rows_per_page
+    """, [study_id])
+    return SessionContext(rows[0], study_id)
+
+def get_session_context():
+    """Get the session context, refetching only when the current study changes"""
+    context = st.session_state.get('session_context')
+    if context is None or context.study_id != st.session_state.current_study:
+        context = fetch_session_context(st.session_state.current_study)
+        st.session_state.session_context = context
+    return context
+
+def invalidate_session_context():
+    """Drop the cached session context so the next rerun refetches it"""
+    st.session_state.session_context = None
+
+def study_filter(column, accessible_studies):
+    """SQL condition and bind parameters limiting column to the accessible studies"""
+    if not accessible_studies:
+        return "1 = 0", []
+    return f"{column} IN ({', '.join('?' for _ in accessible_studies)})", list(accessible_studies)
+
+# Initialize session state
+if 'current_study' not in st.session_state:
+    st.session_state.current_study = None
+if 'write_behind' not in st.session_state:
+    st.session_state.write_behind = os.environ.get("CLINICAL_RESEARCH_WRITE_BEHIND") == "1"
+if 'queued_saves' not in st.session_state:
+    st.session_state.queued_saves = []
+
 # Verify database exists
 try:
-    test_query = session.sql("SELECT CURRENT_DATABASE(), CURRENT_SCHEMA()").collect()
-    current_db = test_query[0][0]
-    current_schema = test_query[0][1]
+    context = get_session_context()
+    current_db = context.database
+    current_schema = context.schema
     
     if current_db != 'CLINICAL_RESEARCH':
         st.error(f"⚠️ Wrong database! Current: {current_db}. Please set to CLINICAL_RESEARCH")
@@ -60,70 +239,533 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Initialize session state
-if 'current_study' not in st.session_state:
-    st.session_state.current_study = None
+# Cache dependencies - each cached reader lists the tables it reads and takes
+# a version key built from them, so a write only invalidates the caches that
+# depend on the written table (and, for study-scoped readers, that study)
+CACHE_DEPENDENCIES = {
+    'dashboard_metrics': ('DASHBOARD_METRICS', 'STUDIES', 'PARTICIPANTS', 'RESEARCH_NOTES', 'FINDINGS'),
+    'active_studies': ('STUDIES', 'PARTICIPANTS', 'STUDY_ENROLLMENT'),
+    'recent_notes': ('RESEARCH_NOTES', 'STUDIES'),
+    'recent_findings': ('FINDINGS', 'STUDIES'),
+    'study_participants': ('PARTICIPANTS',),
+    'record_search': ('SEARCH_DOCUMENTS', 'RESEARCH_NOTES', 'FINDINGS', 'OBSERVATIONS', 'COMMENTS', 'STUDIES'),
+    'note_tags': ('NOTE_TAGS', 'RESEARCH_NOTES', 'STUDIES'),
+    'browse_studies': ('STUDIES',),
+    'browse_participants': ('PARTICIPANTS',),
+    'browse_observations': ('OBSERVATIONS',),
+    'browse_notes': ('RESEARCH_NOTES',),
+    'browse_findings': ('FINDINGS',),
+    'reference_data': tuple(reference_data.REFERENCE_TABLES),
+}
+
+# Seconds between LAST_ALTERED checks, which pick up changes made outside this
+# app (other instances, tasks, loads); all sessions share one check
+VERSION_CHECK_SECONDS = 10
 
-# Helper functions with caching
-@st.cache_data
-def get_dashboard_metrics():
+class TableVersions:
+    """LAST_ALTERED per table, checked once per VERSION_CHECK_SECONDS"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.last_altered = {}
+        self.checked_at = None
+    
+    def current(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.checked_at is None or now - self.checked_at >= VERSION_CHECK_SECONDS:
+                self.checked_at = now
+                try:
+                    rows = run_statement("""
+                        SELECT table_name, last_altered
+                        FROM CLINICAL_RESEARCH.INFORMATION_SCHEMA.TABLES
+                        WHERE table_schema IN ('RESEARCH_DATA', 'REFERENCE_DATA')
+                    """)
+                    self.last_altered = {row['TABLE_NAME']: str(row['LAST_ALTERED']) for row in rows}
+                except Exception:
+                    # Keep the last known versions; local write counters still apply
+                    pass
+            return self.last_altered
+
+@st.cache_resource
+def get_table_versions():
+    """Get the process-wide LAST_ALTERED tracker"""
+    return TableVersions()
+
+class DataVersions:
+    """Write counters per table, globally and per study, shared across sessions"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.versions = Counter()
+    
+    def bump(self, table, study_id=None):
+        with self._lock:
+            self.versions[(table, None)] += 1
+            if study_id is not None:
+                self.versions[(table, study_id)] += 1
+    
+    def key(self, tables, study_id=None):
+        with self._lock:
+            return tuple(self.versions[(table, study_id)] for table in tables)
+
+@st.cache_resource
+def get_data_versions():
+    """Get the process-wide table version counters"""
+    return DataVersions()
+
+def cache_key(name, study_id=None):
+    """Build the version key of a cached reader"""
+    tables = CACHE_DEPENDENCIES[name]
+    last_altered = get_table_versions().current()
+    stamps = tuple(last_altered.get(table) for table in tables)
+    return stamps + get_data_versions().key(tables, study_id)
+
+def invalidate(table, study_id=None):
+    """Invalidate the cached readers that depend on a table (and study)"""
+    get_data_versions().bump(table, study_id)
+
+# Dashboard metrics older than this are refreshed even without a data change,
+# because the 7-day windows move with the clock
+METRICS_MAX_AGE_SECONDS = 300
+
+class StaleWhileRevalidate:
+    """Serve the last value while a background thread refreshes it"""
+    def __init__(self, load, max_age):
+        self._load = load
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self.value = None
+        self.version = None
+        self.as_of = None
+        self.refreshed_at = None
+        self.refreshing = False
+        self.error = None
+    
+    def _is_stale(self, version):
+        return version != self.version or time.monotonic() - self.refreshed_at >= self._max_age
+    
+    def _refresh(self, version):
+        try:
+            value = self._load()
+        except Exception as e:
+            with self._lock:
+                self.error = e
+                self.refreshing = False
+            return
+        with self._lock:
+            self.value = value
+            self.version = version
+            self.as_of = datetime.now()
+            self.refreshed_at = time.monotonic()
+            self.error = None
+            self.refreshing = False
+    
+    def get(self, version):
+        with self._lock:
+            if self.value is None:
+                loaded = False
+            else:
+                loaded = True
+                if not self.refreshing and self._is_stale(version):
+                    self.refreshing = True
+                    threading.Thread(target=self._refresh, args=(version,), daemon=True).start()
+        if not loaded:
+            # Nothing to serve yet, so the first caller waits for the query
+            self._refresh(version)
+            if self.value is None:
+                raise self.error
+        return self.value, self.as_of, self.refreshing
+
+def load_dashboard_metrics(accessible_studies):
+    """Load dashboard metrics from DASHBOARD_METRICS"""
+    condition, params = study_filter("study_id", accessible_studies)
+    query = f"""
+    SELECT 
+        COALESCE(SUM(CASE WHEN metric_name = 'ACTIVE_STUDIES' THEN metric_value END), 0) as active_studies,
+        COALESCE(SUM(CASE WHEN metric_name = 'ACTIVE_PARTICIPANTS' THEN metric_value END), 0) as active_participants,
+        COALESCE(SUM(CASE WHEN metric_name = 'NOTES' THEN metric_value END), 0) as recent_notes,
+        COALESCE(SUM(CASE WHEN metric_name = 'FINDINGS' THEN metric_value END), 0) as recent_findings
+    FROM CLINICAL_RESEARCH.RESEARCH_DATA.DASHBOARD_METRICS
+    WHERE {condition}
+    AND (metric_date IS NULL OR metric_date >= DATEADD(day, -7, CURRENT_DATE()))
+    """
+    return run_query(query, params)
+
+@st.cache_resource(max_entries=200)
+def get_metrics_cache(accessible_studies):
+    """Get the dashboard metrics cache of a study set"""
+    return StaleWhileRevalidate(lambda: load_dashboard_metrics(accessible_studies), METRICS_MAX_AGE_SECONDS)
+
+def get_dashboard_metrics(accessible_studies, data_version):
     """Get dashboard metrics"""
     try:
-        query = """
-        SELECT 
-            (SELECT COUNT(*) FROM CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES WHERE study_status = 'ACTIVE') as active_studies,
-            (SELECT COUNT(*) FROM CLINICAL_RESEARCH.RESEARCH_DATA.PARTICIPANTS WHERE participant_status = 'ACTIVE') as active_participants,
-            (SELECT COUNT(*) FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES WHERE note_date >= DATEADD(day, -7, CURRENT_DATE())) as recent_notes,
-            (SELECT COUNT(*) FROM CLINICAL_RESEARCH.RESEARCH_DATA.FINDINGS WHERE created_date >= DATEADD(day, -7, CURRENT_TIMESTAMP())) as recent_findings
-        """
-        df = session.sql(query).to_pandas()
-        return df
+        return get_metrics_cache(accessible_studies).get(data_version)
     except Exception as e:
         st.error(f"Error loading metrics: {str(e)}")
-        return pd.DataFrame()
+        return pd.DataFrame(), None, False
 
-@st.cache_data(ttl=60)
-def get_active_studies():
+@st.cache_data(max_entries=8)
+def get_active_studies(data_version):
     """Get list of active studies"""
     try:
+        # Enrollment comes from the STUDY_ENROLLMENT dynamic table over PARTICIPANTS
         query = """
-        SELECT study_id, study_name, study_number, principal_investigator,
-               study_phase, current_enrollment, target_enrollment, study_start_date
-        FROM CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES
-        WHERE study_status = 'ACTIVE'
-        ORDER BY created_date DESC
+        SELECT s.study_id, s.study_name, s.study_number, s.principal_investigator,
+               s.study_phase, COALESCE(e.enrolled_count, 0) as current_enrollment,
+               s.target_enrollment, s.study_start_date
+        FROM CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES s
+        LEFT JOIN CLINICAL_RESEARCH.RESEARCH_DATA.STUDY_ENROLLMENT e ON s.study_id = e.study_id
+        WHERE s.study_status = 'ACTIVE'
+        ORDER BY s.created_date DESC
         """
-        return session.sql(query).to_pandas()
+        return run_query(query)
     except Exception as e:
         st.error(f"Error loading studies: {str(e)}")
         return pd.DataFrame()
 
-@st.cache_data(ttl=300)
+# Readers cached for every session take the accessible study set as both key
+# and filter, so sessions only share rows they are all allowed to see
+@st.cache_data(max_entries=200)
+def get_recent_notes(accessible_studies, data_version):
+    """Get recent notes"""
+    condition, params = study_filter("n.study_id", accessible_studies)
+    return run_query(f"""
+        SELECT n.note_title, s.study_name, n.note_type, n.created_date
+        FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES n
+        JOIN CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES s ON n.study_id = s.study_id
+        WHERE {condition}
+        ORDER BY n.created_date DESC LIMIT 10
+    """, params)
+
+@st.cache_data(max_entries=200)
+def get_recent_findings(accessible_studies, data_version):
+    """Get recent findings"""
+    condition, params = study_filter("f.study_id", accessible_studies)
+    return run_query(f"""
+        SELECT f.finding_type, s.study_name, f.severity, f.created_date
+        FROM CLINICAL_RESEARCH.RESEARCH_DATA.FINDINGS f
+        JOIN CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES s ON f.study_id = s.study_id
+        WHERE {condition}
+        ORDER BY f.created_date DESC LIMIT 10
+    """, params)
+
+@st.cache_data(max_entries=500)
+def get_study_participants(study_id, data_version):
+    """Get the active participants of a study"""
+    return run_query("""
+        SELECT participant_id, participant_number 
+        FROM CLINICAL_RESEARCH.RESEARCH_DATA.PARTICIPANTS
+        WHERE study_id = ? 
+        AND participant_status = 'ACTIVE'
+        ORDER BY participant_number
+    """, [study_id])
+
+@st.cache_data(max_entries=500)
+def get_participant_numbers(study_id, data_version):
+    """Get the participant numbers of a study, whatever the participant's status"""
+    return run_query("""
+        SELECT participant_number
+        FROM CLINICAL_RESEARCH.RESEARCH_DATA.PARTICIPANTS
+        WHERE study_id = ?
+    """, [study_id])
+
+# Search box record types -> SEARCH_DOCUMENTS doc_type
+SEARCH_TYPES = {'Notes': 'NOTE', 'Findings': 'FINDING', 'Observations': 'OBSERVATION', 'Comments': 'COMMENT'}
+
+@st.cache_data(max_entries=200)
+def search_records(terms, date_from, doc_types, accessible_studies, data_version, cursor, limit):
+    """Search records, ranked by relevance, or newest first without terms"""
+    if terms:
+        query, seek_params = keyset.page_query(record_search.SEARCH_QUERY, record_search.KEYS, cursor, limit)
+        return run_query(query, record_search.search_params(list(terms), date_from, doc_types) + seek_params)
+    query, seek_params = keyset.page_query(record_search.LATEST_QUERY, record_search.LATEST_KEYS, cursor, limit)
+    return run_query(query, record_search.latest_params(date_from, doc_types) + seek_params)
+
+@st.cache_data(max_entries=200)
+def get_tag_facets(tags, date_from, accessible_studies, data_version):
+    """Get note counts per tag among the notes having all of tags"""
+    query, params = note_tags.facet_query(list(tags), date_from)
+    return run_query(query, params)
+
+@st.cache_data(max_entries=200)
+def tagged_notes(tags, date_from, accessible_studies, data_version, cursor, limit):
+    """Get a page of the notes having all of tags"""
+    query, seek_params = keyset.page_query(note_tags.TAGGED_NOTES_QUERY, note_tags.KEYS, cursor, limit)
+    return run_query(query, note_tags.tagged_notes_params(list(tags), date_from) + seek_params)
+
+@st.cache_resource
+def get_reference_store():
+    """Get the process-wide reference data store"""
+    return reference_data.ReferenceDataStore()
+
+def get_reference_data():
+    """Get the shared reference snapshot, reloaded only when a reference table changes"""
+    return get_reference_store().get(
+        cache_key('reference_data'),
+        lambda: run_statement(reference_data.SNAPSHOT_QUERY)
+    )
+
+def get_unit_lookup():
+    """Unit abbreviations and names -> abbreviation, for normalizing measurement units"""
+    try:
+        return measurements.unit_lookup(get_reference_data())
+    except Exception:
+        return {}
+
 def get_study_types():
     """Get available study types"""
     try:
-        query = "SELECT type_name FROM CLINICAL_RESEARCH.REFERENCE_DATA.STUDY_TYPES WHERE is_active = TRUE"
-        return session.sql(query).to_pandas()
+        study_types = get_reference_data().rows('STUDY_TYPES')
+        return pd.DataFrame({'TYPE_NAME': [t.type_name for t in study_types]})
     except:
         return pd.DataFrame({'TYPE_NAME': ['Clinical Trial', 'Observational Study', 'Chart Review']})
 
-@st.cache_data(ttl=300)
 def get_note_types():
     """Get available note types"""
     try:
-        query = "SELECT note_type_name FROM CLINICAL_RESEARCH.REFERENCE_DATA.NOTE_TYPES WHERE is_active = TRUE"
-        return session.sql(query).to_pandas()
+        note_types = get_reference_data().rows('NOTE_TYPES')
+        return pd.DataFrame({'NOTE_TYPE_NAME': [t.note_type_name for t in note_types]})
     except:
         return pd.DataFrame({'NOTE_TYPE_NAME': ['Progress Note', 'Adverse Event Note', 'Study Finding', 'General Observation']})
 
-def execute_query(query):
+def execute_query(query, params=None):
     """Execute a SQL query and return results"""
     try:
-        return session.sql(query).to_pandas()
+        return run_query(query, params)
     except Exception as e:
         st.error(f"Query error: {str(e)}")
         return pd.DataFrame()
 
+def iter_query_batches(query, params=None):
+    """Run a query and yield the result in DataFrame batches"""
+    get_query_stats().record(query)
+    with get_session_gate().statement():
+        yield from session.sql(query, params=params).to_pandas_batches()
+
+def export_csv(query, params=None):
+    """Stream a query's batches into CSV text; returns the text and row count"""
+    buffer = io.StringIO()
+    row_count = 0
+    for batch in iter_query_batches(query, params):
+        batch.to_csv(buffer, index=False, header=(row_count == 0))
+        row_count += len(batch)
+    return buffer.getvalue(), row_count
+
+# Browse and export projections - the VARIANT metadata and ARRAY tags columns
+# are left out so results stay narrow and columnar
+BROWSE_TABLES = {
+    "Studies": ("STUDIES", "created_date", [
+        "study_id", "study_name", "study_number", "principal_investigator", "study_phase",
+        "study_type", "study_description", "irb_approval_number", "irb_approval_date",
+        "study_start_date", "study_end_date", "target_enrollment",
+        "study_status", "study_sponsor", "study_site", "created_by", "created_date",
+    ]),
+    "Participants": ("PARTICIPANTS", "enrollment_date", [
+        "participant_id", "study_id", "participant_number", "enrollment_date", "consent_date",
+        "consent_version", "demographic_group", "inclusion_criteria_met", "exclusion_criteria_met",
+        "randomization_arm", "participant_status", "withdrawal_date", "withdrawal_reason",
+        "created_by", "created_date",
+    ]),
+    "Observations": ("OBSERVATIONS", "observation_date", [
+        "observation_id", "study_id", "participant_id", "observation_date", "observation_time",
+        "visit_number", "visit_name", "observation_type", "observation_category",
+        "measurement_name", "measurement_value", "measurement_unit", "normal_range",
+        "clinically_significant", "data_verified", "created_by", "created_date",
+    ]),
+    "Notes": ("RESEARCH_NOTES", "note_date", [
+        "note_id", "study_id", "participant_id", "observation_id", "note_type", "note_category",
+        "note_title", "note_text", "note_date", "note_priority", "requires_review",
+        "flagged_for_followup", "followup_due_date", "created_by", "created_date",
+    ]),
+    "Findings": ("FINDINGS", "created_date", [
+        "finding_id", "study_id", "participant_id", "finding_type", "finding_category",
+        "finding_description", "severity", "relationship_to_intervention", "action_taken",
+        "outcome", "outcome_date", "reported_to_irb", "sae_reported", "created_by", "created_date",
+    ]),
+}
+
+def browse_select(data_type):
+    """Build the projected SELECT of a data type, unordered"""
+    table, _, columns = BROWSE_TABLES[data_type]
+    return f"""
+        SELECT {', '.join(columns)}
+        FROM CLINICAL_RESEARCH.RESEARCH_DATA.{table}
+    """
+
+def browse_query(data_type):
+    """Build the projected browse query for a data type, newest first"""
+    return f"{browse_select(data_type)} ORDER BY {keyset.order_by(browse_keys(data_type))}"
+
+def browse_keys(data_type):
+    """Keyset sort keys of a data type: its date column, then its id"""
+    _, order_column, columns = BROWSE_TABLES[data_type]
+    return (order_column, columns[0])
+
+@st.cache_data(max_entries=200)
+def browse_page(data_type, accessible_studies, data_version, cursor, limit):
+    """Get a page of rows of a data type"""
+    query, params = keyset.page_query(browse_select(data_type), browse_keys(data_type), cursor, limit)
+    return run_query(query, params)
+
+# fetch_chunk(cursor, limit) returns up to limit rows after cursor and should be
+# cached: the prefetched second page of a chunk is shown by fetching it again.
+# The visited pages' cursors stay in session state until identity changes
+def show_pages(name, identity, fetch_chunk, keys, hide_columns=()):
+    """Show one page of a keyset-paginated list, with Previous and Next buttons"""
+    rows_per_page = get_session_context().rows_per_page
+    state = st.session_state.get(name)
+    if state is None or state['identity'] != identity or state['rows_per_page'] != rows_per_page:
+        state = {'identity': identity, 'rows_per_page': rows_per_page, 'cursors': [None]}
+        st.session_state[name] = state
+    cursors = state['cursors']
+    page_number = len(cursors) - 1
+    
+    try:
+        chunk = fetch_chunk(keyset.chunk_cursor(cursors, page_number), keyset.chunk_size(rows_per_page))
+    except Exception as e:
+        st.error(f"Query error: {str(e)}")
+        return None
+    page_df, has_next = keyset.page_of(chunk, page_number, rows_per_page)
+    
+    if not page_df.empty:
+        first_row = page_number * rows_per_page + 1
+        st.caption(f"Page {page_number + 1} · rows {first_row}–{first_row + len(page_df) - 1}")
+        st.dataframe(page_df.drop(columns=[c.upper() for c in hide_columns]), use_container_width=True, hide_index=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.button("← Previous", key=f"{name}_previous", disabled=page_number == 0,
+                  on_click=cursors.pop)
+    with col2:
+        next_cursor = keyset.cursor_after(page_df, keys) if has_next else None
+        st.button("Next →", key=f"{name}_next", disabled=not has_next,
+                  on_click=cursors.append, args=(next_cursor,))
+    return page_df
+
+@st.cache_resource
+def get_query_executor():
+    """Get the shared thread pool used to run independent page queries together"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="page_query")
+
+def execute_queries(queries):
+    """Execute independent queries concurrently and return results by name"""
+    ctx = get_script_run_ctx()
+    
+    def run(job):
+        # Let cached helpers and st.* calls in the worker see this script run
+        add_script_run_ctx(threading.current_thread(), ctx)
+        if callable(job):
+            return job()
+        if isinstance(job, str):
+            return run_query(job)
+        return run_query(*job)
+    
+    executor = get_query_executor()
+    futures = {name: executor.submit(run, job) for name, job in queries.items()}
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            st.error(f"Query error: {str(e)}")
+            results[name] = pd.DataFrame()
+    return results
+
+# Write-behind saves - optional, journaled locally and flushed in the background
+@st.cache_resource
+def get_write_behind():
+    """Get the process-wide write journal and start its flusher"""
+    journal = write_behind.WriteJournal(os.environ.get("CLINICAL_RESEARCH_JOURNAL", write_behind.DEFAULT_JOURNAL_PATH))
+    data_versions = get_data_versions()
+    
+    def on_flushed(table, study_ids, record_ids):
+        for index in index_saved_records(table, record_ids):
+            data_versions.bump(index)
+        for study_id in study_ids:
+            data_versions.bump(table.split('.')[-1], study_id)
+    
+    flusher = write_behind.Flusher(journal, run_statement, on_flushed, transaction=get_session_gate().transaction)
+    flusher.start()
+    return flusher
+
+def record_id(prefix, *content):
+    """Get a record key, stable for identical submissions in this session"""
+    fingerprint = hashlib.sha256(json.dumps([prefix, *content], default=str).encode()).hexdigest()
+    record_ids = st.session_state.setdefault('record_ids', {})
+    if fingerprint not in record_ids:
+        if len(record_ids) >= 5000:
+            record_ids.pop(next(iter(record_ids)))
+        record_ids[fingerprint] = new_id(prefix)
+    return record_ids[fingerprint]
+
+def index_saved_records(table, record_ids):
+    """Index saved records for search and tag filters; returns the indexes written"""
+    # The save has already succeeded, so a failed index is left for the tasks
+    table = table.split('.')[-1]
+    written = []
+    statements = list(record_search.index_statements(table, record_ids))
+    try:
+        for query, params in statements:
+            run_statement(query, params)
+        if statements:
+            written.append('SEARCH_DOCUMENTS')
+    except Exception:
+        pass
+    if table == 'RESEARCH_NOTES':
+        # Deletes and reinserts the notes' tag rows, so readers must not see it half done
+        try:
+            batch_writes.run_in_transaction(run_statement, list(note_tags.index_statements(record_ids)),
+                                            transaction=get_session_gate().transaction)
+            written.append('NOTE_TAGS')
+        except Exception:
+            pass
+    return written
+
+def save_rows(table, columns, rows, study_id, json_columns=()):
+    """Save rows, or queue them when write-behind is on; returns True if written"""
+    log_activity(activity_log.EDIT, f"Saved {len(rows)} {table.split('.')[-1].lower()} record(s)", study_id,
+                 table, rows[0][columns[0]] if len(rows) == 1 else None, rows=len(rows))
+    if st.session_state.write_behind:
+        flusher = get_write_behind()
+        queued = flusher.journal.enqueue(table, columns, rows, study_id, json_columns)
+        st.session_state.queued_saves = list(dict.fromkeys(st.session_state.queued_saves + queued))
+        flusher.wake()
+        return False
+    upsert_rows(table, columns, rows, json_columns=json_columns)
+    for index in index_saved_records(table, [row[columns[0]] for row in rows]):
+        invalidate(index)
+    invalidate(table.split('.')[-1], study_id)
+    return True
+
+# Activity logging - events are buffered per process and written in batches
+# by a background thread, so logging adds no round trip to a page render
+RECORD_TYPES = {
+    'STUDIES': 'STUDY', 'PARTICIPANTS': 'PARTICIPANT', 'OBSERVATIONS': 'OBSERVATION',
+    'RESEARCH_NOTES': 'NOTE', 'FINDINGS': 'FINDING',
+}
+
+@st.cache_resource
+def get_activity_log():
+    """Get the process-wide activity buffer and start its flusher"""
+    log = activity_log.ActivityLog(run_statement, transaction=get_session_gate().transaction)
+    log.start()
+    return log
+
+def log_activity(activity_type, description, study_id=None, table=None, record_id=None, **metadata):
+    """Buffer an activity event for the current user and session"""
+    try:
+        run_context = get_script_run_ctx()
+        get_activity_log().record(
+            get_session_context().user, activity_type, description,
+            study_id=study_id,
+            record_type=RECORD_TYPES.get(table.split('.')[-1]) if table else None,
+            record_id=record_id,
+            session_id=run_context.session_id if run_context else None,
+            metadata=metadata,
+        )
+    except Exception:
+        # Activity logging must never break the page
+        pass
+
 # Sidebar navigation
 with st.sidebar:
     st.header("🧭 Navigation")
@@ -133,37 +775,37 @@ with st.sidebar:
         ["Dashboard", "Studies", "Data Entry", "Search", "Reports", "Admin"],
         label_visibility="collapsed"
     )
+    if st.session_state.get('logged_page') != page:
+        st.session_state.logged_page = page
+        log_activity(activity_log.VIEW, f"Viewed {page}", st.session_state.current_study)
     
     st.divider()
     
     # Current study
     if st.session_state.current_study:
-        try:
-            study_df = execute_query(f"""
-                SELECT study_name FROM CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES
-                WHERE study_id = '{st.session_state.current_study}'
-            """)
-            if not study_df.empty:
-                st.success(f"📚 Current Study")
-                st.caption(study_df.iloc[0]['STUDY_NAME'])
-                if st.button("Clear Selection"):
-                    st.session_state.current_study = None
-                    st.rerun()
-        except:
-            pass
+        if context.study_name is not None:
+            st.success(f"📚 Current Study")
+            st.caption(context.study_name)
+            if st.button("Clear Selection"):
+                st.session_state.current_study = None
+                st.rerun()
     else:
         st.info("No study selected")
     
     st.divider()
     
     # User info
-    try:
-        current_user = session.sql("SELECT CURRENT_USER() as u").collect()[0]['U']
-        current_role = session.sql("SELECT CURRENT_ROLE() as r").collect()[0]['R']
-        st.caption(f"**User:** {current_user}")
-        st.caption(f"**Role:** {current_role}")
-    except:
-        pass
+    st.caption(f"**User:** {context.user}")
+    st.caption(f"**Role:** {context.role}")
+    st.caption(f"**Studies:** {len(context.accessible_studies)} accessible")
+    
+    st.divider()
+    
+    st.toggle("Write-behind saves", key="write_behind",
+              help="Save instantly to a local journal and write to Snowflake in the background")
+    if st.session_state.write_behind:
+        journal = get_write_behind().journal
+        st.caption(f"**Queued writes:** {journal.pending_count()} pending, {journal.failed_count()} failed")
 
 # ============================================================================
 # DASHBOARD
@@ -172,8 +814,17 @@ with st.sidebar:
 if page == "Dashboard":
     st.header("📊 Dashboard Overview")
     
-    # Get metrics
-    metrics_df = get_dashboard_metrics()
+    # Metrics and recent activity are independent, so fetch them together
+    accessible_studies = context.accessible_studies
+    metrics_key = cache_key('dashboard_metrics')
+    notes_key = cache_key('recent_notes')
+    findings_key = cache_key('recent_findings')
+    results = execute_queries({
+        'metrics': lambda: get_dashboard_metrics(accessible_studies, metrics_key),
+        'notes': lambda: get_recent_notes(accessible_studies, notes_key),
+        'findings': lambda: get_recent_findings(accessible_studies, findings_key),
+    })
+    metrics_df, metrics_as_of, metrics_refreshing = results['metrics']
     
     if not metrics_df.empty:
         col1, col2, col3, col4 = st.columns(4)
@@ -186,6 +837,8 @@ if page == "Dashboard":
             st.metric("Notes (7 days)", int(metrics_df.iloc[0]['RECENT_NOTES']))
         with col4:
             st.metric("Findings (7 days)", int(metrics_df.iloc[0]['RECENT_FINDINGS']))
+        
+        st.caption(f"As of {metrics_as_of.strftime('%H:%M:%S')}" + (" · refreshing…" if metrics_refreshing else ""))
     
     st.divider()
     
@@ -194,12 +847,7 @@ if page == "Dashboard":
     
     with col1:
         st.subheader("📝 Recent Notes")
-        notes_df = execute_query("""
-            SELECT n.note_title, s.study_name, n.note_type, n.created_date
-            FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES n
-            JOIN CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES s ON n.study_id = s.study_id
-            ORDER BY n.created_date DESC LIMIT 10
-        """)
+        notes_df = results['notes']
         if not notes_df.empty:
             st.dataframe(notes_df, use_container_width=True)
         else:
@@ -207,12 +855,7 @@ if page == "Dashboard":
     
     with col2:
         st.subheader("🔬 Recent Findings")
-        findings_df = execute_query("""
-            SELECT f.finding_type, s.study_name, f.severity, f.created_date
-            FROM CLINICAL_RESEARCH.RESEARCH_DATA.FINDINGS f
-            JOIN CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES s ON f.study_id = s.study_id
-            ORDER BY f.created_date DESC LIMIT 10
-        """)
+        findings_df = results['findings']
         if not findings_df.empty:
             st.dataframe(findings_df, use_container_width=True)
         else:
@@ -228,7 +871,7 @@ elif page == "Studies":
     tab1, tab2 = st.tabs(["Active Studies", "Create New Study"])
     
     with tab1:
-        studies_df = get_active_studies()
+        studies_df = get_active_studies(cache_key('active_studies'))
         
         if not studies_df.empty:
             for idx, study in studies_df.iterrows():
@@ -275,37 +918,33 @@ elif page == "Studies":
             if submitted:
                 if study_name and study_number and pi_name:
                     try:
-                        study_id = f"STD_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                        
-                        # Escape single quotes for SQL
-                        safe_name = study_name.replace("'", "''")
-                        safe_pi = pi_name.replace("'", "''")
-                        safe_desc = study_description.replace("'", "''") if study_description else ""
-                        
-                        session.sql(f"""
-                            INSERT INTO CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES (
-                                study_id, study_name, study_number, principal_investigator,
-                                study_phase, study_type, study_description, target_enrollment, 
-                                current_enrollment, study_status
-                            ) VALUES (
-                                '{study_id}', '{safe_name}', '{study_number}', '{safe_pi}',
-                                '{study_phase}', '{study_type}', '{safe_desc}', {target_enrollment},
-                                0, 'ACTIVE'
-                            )
-                        """).collect()
+                        study = {
+                            'study_id': record_id('STD', study_name, study_number, pi_name),
+                            'study_name': study_name,
+                            'study_number': study_number,
+                            'principal_investigator': pi_name,
+                            'study_phase': study_phase,
+                            'study_type': study_type,
+                            'study_description': study_description or "",
+                            'target_enrollment': int(target_enrollment),
+                            'current_enrollment': 0,
+                            'study_status': 'ACTIVE',
+                        }
+                        study_id = study['study_id']
+                        upsert_rows('RESEARCH_DATA.STUDIES', list(study), [study])
                         
                         # Grant access to creator
-                        session.sql(f"""
-                            INSERT INTO CLINICAL_RESEARCH.RESEARCH_DATA.USER_STUDY_ACCESS 
-                            (user_name, study_id, access_role, is_active)
-                            VALUES (CURRENT_USER(), '{study_id}', 'PI', TRUE)
-                        """).collect()
+                        access = {'user_name': context.user, 'study_id': study_id, 'access_role': 'PI', 'is_active': True}
+                        upsert_rows('RESEARCH_DATA.USER_STUDY_ACCESS', list(access), [access],
+                                    key_columns=['user_name', 'study_id'], update_columns=())
                         
+                        log_activity(activity_log.EDIT, f"Created study {study_name}", study_id, 'STUDIES', study_id)
                         st.success(f"✅ Study created successfully! ID: {study_id}")
                         st.balloons()
                         
-                        # Clear cache
-                        st.cache_data.clear()
+                        # New study changes the accessible study set
+                        invalidate_session_context()
+                        invalidate('STUDIES', study_id)
                     except Exception as e:
                         st.error(f"Error creating study: {str(e)}")
                 else:
@@ -322,7 +961,24 @@ elif page == "Data Entry":
         st.warning("⚠️ Please select a study from the Studies page first")
         st.stop()
     
-    tab1, tab2, tab3, tab4 = st.tabs(["Quick Note", "Observation", "Finding", "Enroll Participant"])
+    if st.session_state.queued_saves:
+        entries = get_write_behind().journal.status(st.session_state.queued_saves[-200:])
+        pending = sum(1 for e in entries if e.status == write_behind.PENDING)
+        failed = sum(1 for e in entries if e.status == write_behind.FAILED)
+        with st.expander(f"🕒 Queued saves: {pending} pending, {failed} failed, {len(entries) - pending - failed} confirmed",
+                         expanded=pending + failed > 0):
+            if failed:
+                st.error(f"{failed} saves failed {write_behind.MAX_ATTEMPTS} times and will not be retried; see LAST_ERROR")
+            st.dataframe(pd.DataFrame(
+                [(e.entry_id, e.table_name.split('.')[-1], e.status, e.attempts, e.last_error, e.created_at, e.confirmed_at)
+                 for e in reversed(entries)],
+                columns=['RECORD_ID', 'TABLE', 'STATUS', 'ATTEMPTS', 'LAST_ERROR', 'QUEUED', 'CONFIRMED']
+            ), use_container_width=True, hide_index=True)
+            if st.button("Refresh Status"):
+                st.rerun()
+    
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["Quick Note", "Observation", "Finding", "Enroll Participant",
+                                                        "Observation Grid", "Template Forms", "Spreadsheet Import"])
     
     # Quick Note
     with tab1:
@@ -335,26 +991,31 @@ elif page == "Data Entry":
             note_title = st.text_input("Note Title *", help="Brief summary of the note")
             note_text = st.text_area("Note Content *", height=200, help="Detailed research notes")
             note_priority = st.selectbox("Priority", ["Normal", "High", "Urgent"])
+            tags_text = st.text_input("Tags", placeholder="e.g., headache, dose change",
+                                      help="Comma-separated; used to filter notes on the Search page")
             
             if st.form_submit_button("Save Note", ):
                 if note_title and note_text:
                     try:
-                        note_id = f"NOTE_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                        safe_title = note_title.replace("'", "''")
-                        safe_text = note_text.replace("'", "''")
-                        
-                        session.sql(f"""
-                            INSERT INTO CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES (
-                                note_id, study_id, note_type, note_title, note_text,
-                                note_priority, note_date
-                            ) VALUES (
-                                '{note_id}', '{st.session_state.current_study}', '{note_type}',
-                                '{safe_title}', '{safe_text}', '{note_priority}', CURRENT_DATE()
-                            )
-                        """).collect()
+                        tags = note_tags.parse_tags(tags_text)
+                        note = {
+                            'note_id': record_id('NOTE', st.session_state.current_study, note_type, note_title, note_text),
+                            'study_id': st.session_state.current_study,
+                            'note_type': note_type,
+                            'note_title': note_title,
+                            'note_text': note_text,
+                            'note_priority': note_priority,
+                            'tags': json.dumps(tags) if tags else None,
+                            'note_date': date.today().isoformat(),
+                            'created_by': context.user,
+                            'created_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        }
                         
-                        st.success("✅ Note saved successfully!")
-                        st.cache_data.clear()
+                        if save_rows('RESEARCH_DATA.RESEARCH_NOTES', list(note), [note], st.session_state.current_study,
+                                     json_columns=('tags',)):
+                            st.success("✅ Note saved successfully!")
+                        else:
+                            st.info("🕒 Note queued - it will be written in the background")
                     except Exception as e:
                         st.error(f"Error saving note: {str(e)}")
                 else:
@@ -365,13 +1026,14 @@ elif page == "Data Entry":
         st.subheader("🩺 Clinical Observation")
         
         # Get participants
-        participants_df = execute_query(f"""
-            SELECT participant_id, participant_number 
-            FROM CLINICAL_RESEARCH.RESEARCH_DATA.PARTICIPANTS
-            WHERE study_id = '{st.session_state.current_study}' 
-            AND participant_status = 'ACTIVE'
-            ORDER BY participant_number
-        """)
+        try:
+            participants_df = get_study_participants(
+                st.session_state.current_study,
+                cache_key('study_participants', st.session_state.current_study)
+            )
+        except Exception as e:
+            st.error(f"Query error: {str(e)}")
+            participants_df = pd.DataFrame()
         
         if participants_df.empty:
             st.info("No participants enrolled yet. Enroll a participant in the 'Enroll Participant' tab first.")
@@ -396,24 +1058,30 @@ elif page == "Data Entry":
                 if st.form_submit_button("Save Observation", ):
                     if participant and measurement_name and measurement_value:
                         try:
-                            obs_id = f"OBS_{datetime.now().strftime('%Y%m%d%H%M%S')}"
                             participant_id = participants_df[participants_df['PARTICIPANT_NUMBER'] == participant]['PARTICIPANT_ID'].iloc[0]
-                            safe_measurement = measurement_name.replace("'", "''")
-                            unit_clause = f"'{measurement_unit}'" if measurement_unit else 'NULL'
-                            
-                            session.sql(f"""
-                                INSERT INTO CLINICAL_RESEARCH.RESEARCH_DATA.OBSERVATIONS (
-                                    observation_id, study_id, participant_id, observation_date,
-                                    visit_number, measurement_name, measurement_value, measurement_unit
-                                ) VALUES (
-                                    '{obs_id}', '{st.session_state.current_study}', '{participant_id}',
-                                    '{obs_date}', {visit_number}, '{safe_measurement}', 
-                                    '{measurement_value}', {unit_clause}
-                                )
-                            """).collect()
+                            observation = {
+                                'observation_id': record_id('OBS', str(participant_id), obs_date, visit_number,
+                                                            measurement_name, measurement_value, measurement_unit),
+                                'study_id': st.session_state.current_study,
+                                'participant_id': str(participant_id),
+                                'observation_date': obs_date.isoformat(),
+                                'visit_number': int(visit_number),
+                                'measurement_name': measurement_name,
+                                'measurement_value': measurement_value,
+                                'measurement_unit': measurement_unit or None,
+                                'created_by': context.user,
+                                'created_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                            }
+                            # Parsed once here, so reports never re-cast the text
+                            measurements.add_typed_values([observation], get_unit_lookup())
+                            if observation['value_parse_status'] != measurements.NUMERIC:
+                                st.info("ℹ️ Value is not a plain number - it is saved as text")
                             
-                            st.success("✅ Observation saved successfully!")
-                            st.cache_data.clear()
+                            if save_rows('RESEARCH_DATA.OBSERVATIONS', list(observation), [observation],
+                                         st.session_state.current_study):
+                                st.success("✅ Observation saved successfully!")
+                            else:
+                                st.info("🕒 Observation queued - it will be written in the background")
                         except Exception as e:
                             st.error(f"Error saving observation: {str(e)}")
                     else:
@@ -441,27 +1109,29 @@ elif page == "Data Entry":
             if st.form_submit_button("Save Finding", ):
                 if finding_description:
                     try:
-                        finding_id = f"FND_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                        safe_desc = finding_description.replace("'", "''")
-                        safe_action = action_taken.replace("'", "''") if action_taken else ""
-                        action_clause = f"'{safe_action}'" if action_taken else 'NULL'
-                        
-                        session.sql(f"""
-                            INSERT INTO CLINICAL_RESEARCH.RESEARCH_DATA.FINDINGS (
-                                finding_id, study_id, finding_type, finding_description,
-                                severity, relationship_to_intervention, action_taken,
-                                outcome, sae_reported
-                            ) VALUES (
-                                '{finding_id}', '{st.session_state.current_study}', '{finding_type}',
-                                '{safe_desc}', '{severity}', '{relationship}',
-                                {action_clause}, '{outcome}', {sae}
-                            )
-                        """).collect()
+                        finding = {
+                            'finding_id': record_id('FND', st.session_state.current_study, finding_type,
+                                                    finding_description, severity),
+                            'study_id': st.session_state.current_study,
+                            'finding_type': finding_type,
+                            'finding_description': finding_description,
+                            'severity': severity,
+                            'relationship_to_intervention': relationship,
+                            'action_taken': action_taken or None,
+                            'outcome': outcome,
+                            'sae_reported': bool(sae),
+                            'created_by': context.user,
+                            'created_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        }
                         
+                        written = save_rows('RESEARCH_DATA.FINDINGS', list(finding), [finding],
+                                            st.session_state.current_study)
                         if sae:
                             st.error("⚠️ SERIOUS ADVERSE EVENT reported! Ensure IRB notification within 24 hours.")
-                        st.success("✅ Finding saved successfully!")
-                        st.cache_data.clear()
+                        if written:
+                            st.success("✅ Finding saved successfully!")
+                        else:
+                            st.info("🕒 Finding queued - it will be written in the background")
                     except Exception as e:
                         st.error(f"Error saving finding: {str(e)}")
                 else:
@@ -494,35 +1164,320 @@ elif page == "Data Entry":
             if st.form_submit_button("Enroll Participant", ):
                 if participant_number and enrollment_date and consent_date:
                     try:
-                        participant_id = f"PART_{st.session_state.current_study}_{participant_number}"
-                        demo_clause = f"'{demographic_group}'" if demographic_group else 'NULL'
+                        participant = {
+                            'participant_id': new_id('PART'),
+                            'study_id': st.session_state.current_study,
+                            'participant_number': participant_number,
+                            'enrollment_date': enrollment_date.isoformat(),
+                            'consent_date': consent_date.isoformat(),
+                            'demographic_group': demographic_group or None,
+                            'inclusion_criteria_met': bool(inclusion_met),
+                            'exclusion_criteria_met': bool(exclusion_met),
+                            'participant_status': 'ACTIVE',
+                        }
                         
-                        session.sql(f"""
-                            INSERT INTO CLINICAL_RESEARCH.RESEARCH_DATA.PARTICIPANTS (
-                                participant_id, study_id, participant_number, enrollment_date,
-                                consent_date, demographic_group, inclusion_criteria_met,
-                                exclusion_criteria_met, participant_status
-                            ) VALUES (
-                                '{participant_id}', '{st.session_state.current_study}', '{participant_number}',
-                                '{enrollment_date}', '{consent_date}', {demo_clause},
-                                {inclusion_met}, {exclusion_met}, 'ACTIVE'
-                            )
-                        """).collect()
-                        
-                        # Update enrollment count
-                        session.sql(f"""
-                            UPDATE CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES
-                            SET current_enrollment = current_enrollment + 1
-                            WHERE study_id = '{st.session_state.current_study}'
-                        """).collect()
+                        # Keyed on the study's participant number, so a resubmit cannot enroll twice
+                        inserted, _ = upsert_rows('RESEARCH_DATA.PARTICIPANTS', list(participant), [participant],
+                                                  key_columns=['study_id', 'participant_number'], update_columns=())
                         
-                        st.success(f"✅ Participant {participant_number} enrolled successfully!")
-                        st.balloons()
-                        st.cache_data.clear()
+                        if inserted:
+                            log_activity(activity_log.EDIT, f"Enrolled participant {participant_number}",
+                                         st.session_state.current_study, 'PARTICIPANTS', participant['participant_id'])
+                            st.success(f"✅ Participant {participant_number} enrolled successfully!")
+                            st.balloons()
+                            invalidate('PARTICIPANTS', st.session_state.current_study)
+                        else:
+                            st.warning(f"Participant {participant_number} is already enrolled in this study")
                     except Exception as e:
                         st.error(f"Error enrolling participant: {str(e)}")
                 else:
                     st.error("Please fill in all required fields (*)")
+        
+        st.divider()
+        st.subheader("📥 Bulk Enrollment from CSV")
+        st.caption(f"Columns, in this order: {', '.join(participant_import.IMPORT_COLUMNS)}. "
+                   "Dates as YYYY-MM-DD; criteria flags as true or false (blank: inclusion met, exclusion not met).")
+        st.download_button("Download Template", participant_import.template_csv(),
+                           file_name="participant_import_template.csv", mime="text/csv")
+        
+        with st.form("bulk_enrollment_form", clear_on_submit=True):
+            uploads = st.file_uploader("Participant CSV files", type=["csv"], accept_multiple_files=True)
+            
+            if st.form_submit_button("Import Participants"):
+                files = [(upload.name, upload.getvalue()) for upload in uploads or []]
+                header_errors = []
+                for name, data in files:
+                    error = participant_import.check_header(data)
+                    if error:
+                        header_errors.append(f"{name}: {error}")
+                if not files:
+                    st.error("Please choose at least one CSV file")
+                elif header_errors:
+                    for error in header_errors:
+                        st.error(error)
+                else:
+                    try:
+                        result = participant_import.import_participants(
+                            session, run_statement, st.session_state.current_study, files
+                        )
+                        if result.enrolled:
+                            # One write to PARTICIPANTS for the whole batch
+                            invalidate('PARTICIPANTS', st.session_state.current_study)
+                        log_activity(activity_log.EDIT, f"Imported {result.enrolled} participants from CSV",
+                                     st.session_state.current_study, 'PARTICIPANTS', import_id=result.import_id,
+                                     files=[f.file_name for f in result.files])
+                        st.session_state.last_import = (st.session_state.current_study, result)
+                    except Exception as e:
+                        st.error(f"Error importing participants: {str(e)}")
+        
+        import_study, result = st.session_state.get('last_import') or (None, None)
+        if result and import_study == st.session_state.current_study:
+            rejected = sum(f.rows_rejected for f in result.files)
+            if result.enrolled:
+                st.success(f"✅ {result.enrolled} participants enrolled, {rejected} rows rejected")
+            else:
+                st.warning(f"No participants enrolled, {rejected} rows rejected")
+            st.dataframe(pd.DataFrame(result.files, columns=['FILE', 'ROWS_PARSED', 'ROWS_LOADED', 'ACCEPTED',
+                                                             'REJECTED', 'FIRST_LOAD_ERROR']),
+                         use_container_width=True, hide_index=True)
+            if result.rejects:
+                st.dataframe(pd.DataFrame(result.rejects, columns=['FILE', 'ROW', 'PARTICIPANT_NUMBER', 'REASON']),
+                             use_container_width=True, hide_index=True)
+    
+    # Bulk observation entry
+    with tab5:
+        st.subheader("📋 Observation Grid")
+        st.caption("Enter a whole visit for many participants at once. Rows without a value are skipped.")
+        
+        try:
+            participants_df = get_study_participants(
+                st.session_state.current_study,
+                cache_key('study_participants', st.session_state.current_study)
+            )
+        except Exception as e:
+            st.error(f"Query error: {str(e)}")
+            participants_df = pd.DataFrame()
+        
+        if participants_df.empty:
+            st.info("No participants enrolled yet. Enroll a participant in the 'Enroll Participant' tab first.")
+        else:
+            participant_ids = dict(zip(participants_df['PARTICIPANT_NUMBER'].astype(str),
+                                       participants_df['PARTICIPANT_ID'].astype(str)))
+            try:
+                obs_types = get_reference_data().rows('OBSERVATION_TYPES')
+            except Exception:
+                obs_types = ()
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                grid_type = st.selectbox("Observation Type", [t.obs_type_name for t in obs_types] or ["Vital Signs"])
+            with col2:
+                grid_date = st.date_input("Observation Date *", value=date.today(), key="grid_observation_date")
+            with col3:
+                grid_visit = st.number_input("Visit Number", min_value=0, value=1, step=1, key="grid_visit_number")
+            
+            # Prefill one row per participant and common measurement of the type
+            obs_type = next((t for t in obs_types if t.obs_type_name == grid_type), None)
+            measurement_names = list(obs_type.common_measurements or ()) if obs_type else []
+            units = list(obs_type.standard_units or ()) if obs_type else []
+            if len(units) != len(measurement_names):
+                units = [None] * len(measurement_names)
+            grid = pd.DataFrame(
+                [{'PARTICIPANT': number, 'MEASUREMENT': name, 'VALUE': None, 'UNIT': unit}
+                 for number in participant_ids for name, unit in zip(measurement_names, units)],
+                columns=['PARTICIPANT', 'MEASUREMENT', 'VALUE', 'UNIT']
+            )
+            edited_grid = st.data_editor(
+                grid,
+                key=f"observation_grid_{grid_type}",
+                num_rows="dynamic",
+                hide_index=True,
+                use_container_width=True,
+                column_config={
+                    'PARTICIPANT': st.column_config.SelectboxColumn("Participant", options=list(participant_ids)),
+                    'MEASUREMENT': st.column_config.TextColumn("Measurement", max_chars=255),
+                    'VALUE': st.column_config.TextColumn("Value", max_chars=500),
+                    'UNIT': st.column_config.TextColumn("Unit", max_chars=50),
+                }
+            )
+            
+            if st.button("Save Grid"):
+                rows, errors = batch_writes.validate_observations(edited_grid, participant_ids)
+                errors = batch_writes.validate_visit(grid_date, int(grid_visit)) + errors
+                if errors:
+                    for error in errors[:20]:
+                        st.error(error)
+                    if len(errors) > 20:
+                        st.error(f"...and {len(errors) - 20} more problems")
+                elif not rows:
+                    st.warning("Enter at least one value")
+                else:
+                    try:
+                        created_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                        for row in rows:
+                            row.update({
+                                'observation_id': record_id('OBS', row['participant_id'], grid_date, grid_visit,
+                                                            row['measurement_name'], row['measurement_value'],
+                                                            row['measurement_unit']),
+                                'study_id': st.session_state.current_study,
+                                'observation_date': grid_date.isoformat(),
+                                'visit_number': int(grid_visit),
+                                'observation_type': grid_type,
+                                'created_by': context.user,
+                                'created_date': created_date,
+                            })
+                        measurements.add_typed_values(rows, get_unit_lookup())
+                        
+                        if save_rows('RESEARCH_DATA.OBSERVATIONS', batch_writes.OBSERVATION_COLUMNS, rows,
+                                     st.session_state.current_study):
+                            st.success(f"✅ Saved {len(rows)} observations")
+                        else:
+                            st.info(f"🕒 {len(rows)} observations queued - they will be written in the background")
+                    except Exception as e:
+                        st.error(f"Error saving observations: {str(e)}")
+    
+    # Template-driven visit forms
+    with tab6:
+        st.subheader("🗂️ Template Forms")
+        
+        try:
+            forms = form_engine.compile_forms(get_reference_data())
+        except Exception as e:
+            st.error(f"Error loading form templates: {str(e)}")
+            forms = {}
+        try:
+            participants_df = get_study_participants(
+                st.session_state.current_study,
+                cache_key('study_participants', st.session_state.current_study)
+            )
+        except Exception as e:
+            st.error(f"Query error: {str(e)}")
+            participants_df = pd.DataFrame()
+        
+        if not forms:
+            st.info("No active form templates")
+        elif participants_df.empty:
+            st.info("No participants enrolled yet. Enroll a participant in the 'Enroll Participant' tab first.")
+        else:
+            template_id = st.selectbox("Template", list(forms), format_func=lambda t: forms[t].name)
+            form = forms[template_id]
+            if form.help_text:
+                st.caption(form.help_text)
+            
+            with st.form(f"template_form_{template_id}"):
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    participant = st.selectbox("Participant *", participants_df['PARTICIPANT_NUMBER'].tolist())
+                with col2:
+                    visit_date = st.date_input("Visit Date *", value=date.today())
+                with col3:
+                    visit_number = st.number_input("Visit Number", min_value=0, value=1, step=1)
+                
+                values = form_engine.render_fields(form, template_id)
+                
+                if st.form_submit_button(f"Save {form.name}"):
+                    errors, warnings = form.validate(values, visit_date)
+                    for warning in warnings:
+                        st.warning(f"⚠️ {warning}")
+                    if errors:
+                        for error in errors:
+                            st.error(error)
+                    else:
+                        try:
+                            participant_id = participants_df[participants_df['PARTICIPANT_NUMBER'] == participant]['PARTICIPANT_ID'].iloc[0]
+                            table, columns, rows, json_columns = form.to_rows(
+                                values, st.session_state.current_study, str(participant_id), visit_date,
+                                int(visit_number), context.user, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                                make_id=record_id
+                            )
+                            if rows:
+                                # The whole form is one statement
+                                if save_rows(table, columns, rows, st.session_state.current_study, json_columns):
+                                    st.success(f"✅ {form.name} saved ({len(rows)} record(s))")
+                                else:
+                                    st.info(f"🕒 {form.name} queued - it will be written in the background")
+                            else:
+                                st.warning("Enter at least one value")
+                        except Exception as e:
+                            st.error(f"Error saving form: {str(e)}")
+    
+    # Spreadsheet import
+    with tab7:
+        st.subheader("📊 Spreadsheet Import")
+        st.caption("Import a legacy study workbook (xlsx) or CSV file into observations, participants or findings. "
+                   "Large sheets are streamed in chunks, so hundreds of thousands of rows are fine.")
+        
+        upload = st.file_uploader("Workbook or CSV file", type=["xlsx", "csv"], key="spreadsheet_import_file")
+        if upload:
+            try:
+                data = upload.getvalue()
+                sheets = spreadsheet_import.sheet_names(upload.name, data)
+                col1, col2 = st.columns(2)
+                with col1:
+                    target_name = st.selectbox("Import Into", list(spreadsheet_import.TARGETS))
+                with col2:
+                    sheet = st.selectbox("Sheet", sheets) if sheets else None
+                target = spreadsheet_import.TARGETS[target_name]
+                header = spreadsheet_import.read_header(upload.name, data, sheet)
+                suggested = spreadsheet_import.suggest_mapping(target, header)
+            except Exception as e:
+                st.error(f"Error reading {upload.name}: {str(e)}")
+                target = None
+            
+            if target:
+                st.markdown("**Column Mapping**")
+                options = ["(not imported)"] + header
+                mapping = {}
+                cols = st.columns(3)
+                for i, field in enumerate(target.fields):
+                    with cols[i % 3]:
+                        choice = st.selectbox(
+                            f"{field.label}{' *' if field.required else ''}", options,
+                            index=options.index(suggested[field.column]) if suggested[field.column] else 0,
+                            key=f"import_map_{target_name}_{field.column}_{upload.name}"
+                        )
+                        mapping[field.column] = None if choice == "(not imported)" else choice
+                
+                if st.button("Import Rows"):
+                    missing = [field.label for field in target.fields if field.required and not mapping[field.column]]
+                    if missing:
+                        st.error(f"Map a column to: {', '.join(missing)}")
+                    else:
+                        try:
+                            participants_df = get_study_participants(
+                                st.session_state.current_study,
+                                cache_key('study_participants', st.session_state.current_study)
+                            )
+                            participant_ids = dict(zip(participants_df['PARTICIPANT_NUMBER'].astype(str),
+                                                       participants_df['PARTICIPANT_ID'].astype(str)))
+                            numbers_df = get_participant_numbers(
+                                st.session_state.current_study,
+                                cache_key('study_participants', st.session_state.current_study)
+                            )
+                            status = st.empty()
+                            result = spreadsheet_import.import_sheet(
+                                session, run_statement, target, st.session_state.current_study, upload.name, data,
+                                mapping, context.user, participant_ids, sheet=sheet, units=get_unit_lookup(),
+                                progress=lambda rows_read: status.caption(f"⏳ {rows_read:,} rows read..."),
+                                participant_numbers=set(numbers_df['PARTICIPANT_NUMBER'].astype(str))
+                            )
+                            status.empty()
+                            if result.rows_loaded:
+                                invalidate(target.table.split('.')[-1], st.session_state.current_study)
+                            log_activity(activity_log.EDIT, f"Imported {result.rows_loaded} rows from {upload.name}",
+                                         st.session_state.current_study, target.table, import_id=result.import_id,
+                                         rows_read=result.rows_read, rows_rejected=result.rows_rejected)
+                            st.success(f"✅ {result.rows_loaded:,} of {result.rows_read:,} rows imported "
+                                       f"in {result.seconds:.1f}s ({result.files} chunk files)")
+                            if result.rows_skipped:
+                                st.info(f"{result.rows_skipped:,} rows were already imported and were skipped")
+                            if result.rows_rejected:
+                                st.warning(f"{result.rows_rejected:,} rows rejected"
+                                           + (f" (first {len(result.rejects)} shown)"
+                                              if result.rows_rejected > len(result.rejects) else ""))
+                                st.dataframe(result.rejects, use_container_width=True, hide_index=True)
+                        except Exception as e:
+                            st.error(f"Error importing rows: {str(e)}")
 
 # ============================================================================
 # SEARCH
@@ -531,65 +1486,113 @@ elif page == "Data Entry":
 elif page == "Search":
     st.header("🔍 Search & Browse")
     
-    tab1, tab2 = st.tabs(["Search Notes", "Browse Data"])
+    tab1, tab2, tab3 = st.tabs(["Search Records", "Notes by Tag", "Browse Data"])
     
     with tab1:
-        st.subheader("Search Research Notes")
+        st.subheader("Search Notes, Findings, Observations and Comments")
         
-        search_text = st.text_input("Search Text", placeholder="Search in note titles and content")
-        date_from = st.date_input("From Date", value=date.today() - timedelta(days=30))
+        # Typing and picking a date don't rerun the page; a search runs on submit
+        # and stays on screen across reruns, served from the search cache
+        with st.form("record_search_form"):
+            search_text = st.text_input("Search Text", placeholder="Search notes, findings, measurements and comments")
+            col1, col2 = st.columns(2)
+            with col1:
+                date_from = st.date_input("From Date", value=date.today() - timedelta(days=30))
+            with col2:
+                type_labels = st.multiselect("Record Types", list(SEARCH_TYPES), default=list(SEARCH_TYPES))
+            submitted = st.form_submit_button("Search")
+        st.caption("Records saved in Data Entry are searchable at once; imported records within a minute")
         
-        if st.button("Search", ) or search_text:
-            where_clauses = [f"note_date >= '{date_from}'"]
-            
-            if search_text:
-                safe_search = search_text.replace("'", "''").upper()
-                where_clauses.append(f"(UPPER(note_title) LIKE '%{safe_search}%' OR UPPER(note_text) LIKE '%{safe_search}%')")
-            
-            where_clause = " AND ".join(where_clauses)
+        if submitted:
+            doc_types = tuple(SEARCH_TYPES[label] for label in type_labels) or tuple(SEARCH_TYPES.values())
+            st.session_state.record_search = (tuple(record_search.search_terms(search_text)), date_from, doc_types)
+            st.session_state.pop('record_search_pages', None)
+        
+        if st.session_state.get('record_search'):
+            search_terms, search_from, doc_types = st.session_state.record_search
+            accessible_studies = get_session_context().accessible_studies
+            results_df = show_pages(
+                'record_search_pages', st.session_state.record_search,
+                lambda cursor, limit: search_records(search_terms, search_from, doc_types, accessible_studies,
+                                                     cache_key('record_search'), cursor, limit),
+                record_search.KEYS if search_terms else record_search.LATEST_KEYS
+            )
             
-            results_df = execute_query(f"""
-                SELECT n.note_title, s.study_name, n.note_type, n.note_date, n.created_by
-                FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES n
-                JOIN CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES s ON n.study_id = s.study_id
-                WHERE {where_clause}
-                ORDER BY n.note_date DESC
-                LIMIT 100
-            """)
+            if submitted:
+                log_activity(activity_log.SEARCH, "Searched records", table='SEARCH_DOCUMENTS',
+                             term=" ".join(search_terms), date_from=search_from, record_types=list(doc_types),
+                             results=len(results_df) if results_df is not None else 0)
             
-            if not results_df.empty:
-                st.success(f"Found {len(results_df)} notes")
-                st.dataframe(results_df, use_container_width=True, )
-            else:
-                st.info("No notes found matching search criteria")
+            if results_df is not None and results_df.empty:
+                st.info("No records found matching search criteria")
     
     with tab2:
-        st.subheader("Browse All Data")
+        st.subheader("Filter Notes by Tag")
         
-        data_type = st.selectbox("Data Type", ["Studies", "Participants", "Observations", "Notes", "Findings"])
+        accessible_studies = get_session_context().accessible_studies
+        tag_from = st.date_input("From Date", value=date.today() - timedelta(days=365), key="tag_date_from")
+        selected_tags = tuple(st.session_state.get('note_tag_filter', ()))
         
-        if data_type == "Studies":
-            df = execute_query("SELECT * FROM CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES ORDER BY created_date DESC LIMIT 100")
-        elif data_type == "Participants":
-            df = execute_query("SELECT * FROM CLINICAL_RESEARCH.RESEARCH_DATA.PARTICIPANTS ORDER BY enrollment_date DESC LIMIT 100")
-        elif data_type == "Observations":
-            df = execute_query("SELECT * FROM CLINICAL_RESEARCH.RESEARCH_DATA.OBSERVATIONS ORDER BY observation_date DESC LIMIT 100")
-        elif data_type == "Notes":
-            df = execute_query("SELECT * FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES ORDER BY note_date DESC LIMIT 100")
-        else:
-            df = execute_query("SELECT * FROM CLINICAL_RESEARCH.RESEARCH_DATA.FINDINGS ORDER BY created_date DESC LIMIT 100")
+        # Counts are for the notes matching the tags picked so far, so each
+        # further pick narrows the list
+        try:
+            facets_df = get_tag_facets(selected_tags, tag_from, accessible_studies, cache_key('note_tags'))
+        except Exception as e:
+            st.error(f"Query error: {str(e)}")
+            facets_df = pd.DataFrame(columns=['TAG', 'NOTE_COUNT'])
+        tag_counts = dict(zip(facets_df['TAG'], facets_df['NOTE_COUNT']))
         
-        if not df.empty:
-            st.dataframe(df, use_container_width=True, )
-            
-            csv = df.to_csv(index=False)
-            st.download_button(
-                label=f"📥 Download {data_type} as CSV",
-                data=csv,
-                file_name=f"{data_type.lower()}_{datetime.now().strftime('%Y%m%d')}.csv",
-                mime="text/csv"
+        st.multiselect(
+            "Tags", list(dict.fromkeys(selected_tags + tuple(tag_counts))), key='note_tag_filter',
+            max_selections=note_tags.MAX_TAGS, format_func=lambda tag: f"{tag} ({tag_counts.get(tag, 0)})",
+            help="Notes carrying all of the selected tags",
+            on_change=lambda: log_activity(activity_log.SEARCH, "Filtered notes by tag", table='NOTE_TAGS',
+                                           tags=list(st.session_state.note_tag_filter), date_from=tag_from)
+        )
+        
+        if not tag_counts:
+            st.info("No tagged notes in this period")
+        elif selected_tags:
+            notes_df = show_pages(
+                'note_tag_pages', (selected_tags, tag_from),
+                lambda cursor, limit: tagged_notes(selected_tags, tag_from, accessible_studies,
+                                                   cache_key('note_tags'), cursor, limit),
+                note_tags.KEYS
             )
+            if notes_df is not None and notes_df.empty:
+                st.info("No notes carry all of the selected tags")
         else:
+            st.caption("Pick one or more tags to list the notes carrying all of them")
+    
+    with tab3:
+        st.subheader("Browse All Data")
+        
+        data_type = st.selectbox("Data Type", ["Studies", "Participants", "Observations", "Notes", "Findings"])
+        
+        accessible_studies = get_session_context().accessible_studies
+        df = show_pages(
+            'browse_pages', data_type,
+            lambda cursor, limit: browse_page(data_type, accessible_studies,
+                                              cache_key(f"browse_{data_type.lower()}"), cursor, limit),
+            browse_keys(data_type)
+        )
+        
+        if df is not None and not df.empty:
+            # The full export is streamed in batches, and only when requested
+            if st.button(f"Prepare {data_type} Export"):
+                try:
+                    csv, row_count = export_csv(browse_query(data_type))
+                    log_activity(activity_log.EXPORT, f"Exported {data_type} as CSV",
+                                 table=BROWSE_TABLES[data_type][0], rows=row_count)
+                    st.download_button(
+                        label=f"📥 Download {data_type} as CSV ({row_count} rows)",
+                        data=csv,
+                        file_name=f"{data_type.lower()}_{datetime.now().strftime('%Y%m%d')}.csv",
+                        mime="text/csv"
+                    )
+                except Exception as e:
+                    st.error(f"Export error: {str(e)}")
+        elif df is not None:
             st.info(f"No {data_type.lower()} data available")
 
 # ============================================================================
@@ -599,28 +1602,78 @@ elif page == "Search":
 elif page == "Reports":
     st.header("📊 Reports & Analytics")
     
-    tab1, tab2, tab3 = st.tabs(["Study Summary", "Enrollment Tracking", "Safety Monitoring"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Study Summary", "Enrollment Tracking", "Safety Monitoring", "Measurements"])
     
-    with tab1:
-        st.subheader("Study Summary Report")
-        
-        summary_df = execute_query("""
+    # Every tab renders on each run, so fetch all report queries together
+    results = execute_queries({
+        'summary': """
             SELECT 
                 s.study_name,
                 s.principal_investigator,
-                s.current_enrollment,
+                COALESCE(e.enrolled_count, 0) as current_enrollment,
                 s.target_enrollment,
                 COUNT(DISTINCT n.note_id) as total_notes,
                 COUNT(DISTINCT o.observation_id) as total_observations,
                 COUNT(DISTINCT f.finding_id) as total_findings
             FROM CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES s
+            LEFT JOIN CLINICAL_RESEARCH.RESEARCH_DATA.STUDY_ENROLLMENT e ON s.study_id = e.study_id
             LEFT JOIN CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES n ON s.study_id = n.study_id
             LEFT JOIN CLINICAL_RESEARCH.RESEARCH_DATA.OBSERVATIONS o ON s.study_id = o.study_id
             LEFT JOIN CLINICAL_RESEARCH.RESEARCH_DATA.FINDINGS f ON s.study_id = f.study_id
             WHERE s.study_status = 'ACTIVE'
-            GROUP BY s.study_name, s.principal_investigator, s.current_enrollment, s.target_enrollment
+            GROUP BY s.study_name, s.principal_investigator, e.enrolled_count, s.target_enrollment
+            ORDER BY s.study_name
+        """,
+        'enrollment': """
+            SELECT 
+                s.study_name,
+                s.target_enrollment,
+                COALESCE(e.enrolled_count, 0) as current_enrollment,
+                ROUND((COALESCE(e.enrolled_count::FLOAT, 0) / s.target_enrollment * 100), 1) as enrollment_percent
+            FROM CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES s
+            LEFT JOIN CLINICAL_RESEARCH.RESEARCH_DATA.STUDY_ENROLLMENT e ON s.study_id = e.study_id
+            WHERE s.study_status = 'ACTIVE' AND s.target_enrollment > 0
             ORDER BY s.study_name
-        """)
+        """,
+        'safety': """
+            SELECT 
+                finding_type,
+                severity,
+                COUNT(*) as event_count,
+                SUM(CASE WHEN sae_reported THEN 1 ELSE 0 END) as sae_count
+            FROM CLINICAL_RESEARCH.RESEARCH_DATA.FINDINGS
+            WHERE finding_type IN ('Adverse Event', 'Lab Abnormality')
+            GROUP BY finding_type, severity
+            ORDER BY severity, finding_type
+        """,
+        # Typed columns only - no per-row casts of measurement_value
+        'measurements': """
+            SELECT 
+                o.measurement_name,
+                o.measurement_unit_normalized as unit,
+                COUNT(*) as observations,
+                COUNT_IF(o.value_parse_status = 'NUMERIC') as numeric_values,
+                MIN(o.measurement_value_num) as min_value,
+                ROUND(AVG(o.measurement_value_num), 2) as mean_value,
+                MAX(o.measurement_value_num) as max_value,
+                COUNT_IF(o.measurement_value_num < r.lower_limit OR o.measurement_value_num > r.upper_limit) as outside_normal_range
+            FROM CLINICAL_RESEARCH.RESEARCH_DATA.OBSERVATIONS o
+            LEFT JOIN (
+                SELECT measurement_name, unit, MIN(lower_limit) as lower_limit, MAX(upper_limit) as upper_limit
+                FROM CLINICAL_RESEARCH.REFERENCE_DATA.NORMAL_RANGES
+                WHERE is_active
+                GROUP BY measurement_name, unit
+            ) r ON r.measurement_name = o.measurement_name AND r.unit = o.measurement_unit_normalized
+            GROUP BY o.measurement_name, o.measurement_unit_normalized
+            ORDER BY observations DESC
+            LIMIT 200
+        """,
+    })
+    
+    with tab1:
+        st.subheader("Study Summary Report")
+        
+        summary_df = results['summary']
         
         if not summary_df.empty:
             st.dataframe(summary_df, use_container_width=True, )
@@ -630,16 +1683,7 @@ elif page == "Reports":
     with tab2:
         st.subheader("Enrollment Progress")
         
-        enrollment_df = execute_query("""
-            SELECT 
-                study_name,
-                target_enrollment,
-                current_enrollment,
-                ROUND((current_enrollment::FLOAT / target_enrollment * 100), 1) as enrollment_percent
-            FROM CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES
-            WHERE study_status = 'ACTIVE' AND target_enrollment > 0
-            ORDER BY study_name
-        """)
+        enrollment_df = results['enrollment']
         
         if not enrollment_df.empty:
             st.dataframe(enrollment_df, use_container_width=True, )
@@ -660,17 +1704,7 @@ elif page == "Reports":
     with tab3:
         st.subheader("Safety Monitoring")
         
-        safety_df = execute_query("""
-            SELECT 
-                finding_type,
-                severity,
-                COUNT(*) as event_count,
-                SUM(CASE WHEN sae_reported THEN 1 ELSE 0 END) as sae_count
-            FROM CLINICAL_RESEARCH.RESEARCH_DATA.FINDINGS
-            WHERE finding_type IN ('Adverse Event', 'Lab Abnormality')
-            GROUP BY finding_type, severity
-            ORDER BY severity, finding_type
-        """)
+        safety_df = results['safety']
         
         if not safety_df.empty:
             st.dataframe(safety_df, use_container_width=True, )
@@ -692,6 +1726,29 @@ elif page == "Reports":
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.success("✅ No adverse events reported")
+    
+    with tab4:
+        st.subheader("Measurement Summary")
+        
+        measurements_df = results['measurements']
+        
+        if not measurements_df.empty:
+            st.caption("Statistics over numeric values; the normal range is the widest active NORMAL_RANGES entry "
+                       "for the measurement and unit")
+            st.dataframe(measurements_df, use_container_width=True, hide_index=True)
+            
+            flagged = measurements_df[measurements_df['OUTSIDE_NORMAL_RANGE'] > 0]
+            if not flagged.empty:
+                fig = px.bar(
+                    flagged,
+                    x='MEASUREMENT_NAME',
+                    y='OUTSIDE_NORMAL_RANGE',
+                    title='Values Outside Normal Range',
+                    labels={'OUTSIDE_NORMAL_RANGE': 'Observations', 'MEASUREMENT_NAME': 'Measurement'}
+                )
+                st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No observations recorded yet")
 
 # ============================================================================
 # ADMIN
@@ -702,27 +1759,71 @@ elif page == "Admin":
     
     tab1, tab2 = st.tabs(["System Status", "Audit Trail"])
     
+    # Status counts and audit trail queries are independent, so fetch them together
+    results = execute_queries({
+        'total_studies': "SELECT COUNT(*) as cnt FROM CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES",
+        'total_participants': "SELECT COUNT(*) as cnt FROM CLINICAL_RESEARCH.RESEARCH_DATA.PARTICIPANTS",
+        'total_data': """
+            SELECT 
+                (SELECT COUNT(*) FROM CLINICAL_RESEARCH.RESEARCH_DATA.OBSERVATIONS) +
+                (SELECT COUNT(*) FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES) +
+                (SELECT COUNT(*) FROM CLINICAL_RESEARCH.RESEARCH_DATA.FINDINGS) as cnt
+        """,
+        'changes': """
+            SELECT table_name, operation_type, changed_by, changed_date
+            FROM CLINICAL_RESEARCH.AUDIT.CHANGE_LOG
+            ORDER BY changed_date DESC
+            LIMIT 50
+        """,
+        'activity': """
+            SELECT user_name, activity_type, activity_description, activity_timestamp
+            FROM CLINICAL_RESEARCH.AUDIT.USER_ACTIVITY_LOG
+            ORDER BY activity_timestamp DESC
+            LIMIT 50
+        """,
+    })
+    
     with tab1:
         st.subheader("System Status")
         
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            total_studies = execute_query("SELECT COUNT(*) as cnt FROM CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES")
+            total_studies = results['total_studies']
             st.metric("Total Studies", int(total_studies.iloc[0]['CNT']) if not total_studies.empty else 0)
         
         with col2:
-            total_participants = execute_query("SELECT COUNT(*) as cnt FROM CLINICAL_RESEARCH.RESEARCH_DATA.PARTICIPANTS")
+            total_participants = results['total_participants']
             st.metric("Total Participants", int(total_participants.iloc[0]['CNT']) if not total_participants.empty else 0)
         
         with col3:
-            total_data = execute_query("""
-                SELECT 
-                    (SELECT COUNT(*) FROM CLINICAL_RESEARCH.RESEARCH_DATA.OBSERVATIONS) +
-                    (SELECT COUNT(*) FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES) +
-                    (SELECT COUNT(*) FROM CLINICAL_RESEARCH.RESEARCH_DATA.FINDINGS) as cnt
-            """)
+            total_data = results['total_data']
             st.metric("Total Data Points", int(total_data.iloc[0]['CNT']) if not total_data.empty else 0)
+        
+        # Query text reuse - a low distinct count means plans and cached results are shared
+        query_stats = get_query_stats()
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Distinct Query Texts", query_stats.distinct_texts())
+        with col2:
+            st.metric("Statements Issued", query_stats.total())
+        
+        try:
+            reference = get_reference_data()
+            st.caption(f"Reference data: {sum(reference.counts().values())} rows in "
+                       f"{len(reference.counts())} tables, loaded {reference.loaded_at.strftime('%Y-%m-%d %H:%M:%S')}")
+        except Exception as e:
+            st.caption(f"Reference data unavailable: {str(e)}")
+        
+        # Rows saved without typed values (e.g. by an older app version) are parsed set-based
+        if st.button("Backfill Typed Measurement Values"):
+            try:
+                result = run_statement(measurements.BACKFILL_STATEMENT)
+                updated = result[0][0] if result else 0
+                invalidate('OBSERVATIONS')
+                st.success(f"✅ {updated} observations backfilled")
+            except Exception as e:
+                st.error(f"Error backfilling measurements: {str(e)}")
     
     with tab2:
         st.subheader("Audit Trail")
@@ -731,12 +1832,7 @@ elif page == "Admin":
         
         with col1:
             st.markdown("**Recent Changes**")
-            changes_df = execute_query("""
-                SELECT table_name, operation_type, changed_by, changed_date
-                FROM CLINICAL_RESEARCH.AUDIT.CHANGE_LOG
-                ORDER BY changed_date DESC
-                LIMIT 50
-            """)
+            changes_df = results['changes']
             if not changes_df.empty:
                 st.dataframe(changes_df, use_container_width=True, height=300)
             else:
@@ -744,12 +1840,12 @@ elif page == "Admin":
         
         with col2:
             st.markdown("**Recent Activity**")
-            activity_df = execute_query("""
-                SELECT user_name, activity_type, activity_description, activity_timestamp
-                FROM CLINICAL_RESEARCH.AUDIT.USER_ACTIVITY_LOG
-                ORDER BY activity_timestamp DESC
-                LIMIT 50
-            """)
+            activity = get_activity_log()
+            st.caption(f"{activity.pending_count()} events buffered, {activity.flushed} written by this instance"
+                       + (f", {activity.dropped} dropped" if activity.dropped else ""))
+            if activity.last_error:
+                st.warning(f"Last activity flush failed: {activity.last_error}")
+            activity_df = results['activity']
             if not activity_df.empty:
                 st.dataframe(activity_df, use_container_width=True, height=300)
             else:
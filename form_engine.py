@@ -0,0 +1,210 @@
+"""
+Template-driven data entry forms
+
+FORM_TEMPLATES rows from the reference snapshot are compiled once per
+snapshot into CompiledForm objects: typed fields from form_structure plus
+the checks from the VALIDATION_RULES the template references. A completed
+form becomes the rows for one batched write - one OBSERVATIONS row per
+filled measurement field, or a single FINDINGS row for safety templates -
+so saving a whole visit is one round trip.
+"""
+
+import json
+import re
+from collections import namedtuple
+from datetime import date
+from functools import lru_cache
+
+import streamlit as st
+
+import measurements
+from id_generator import new_id
+
+FormField = namedtuple("FormField", ["name", "type", "label", "unit", "required", "options"])
+
+# Templates in these categories are reports about a participant and are
+# saved as one FINDINGS row of this finding_type; all others are
+# measurement sets for OBSERVATIONS
+FINDING_TYPES = {"Safety": "Adverse Event"}
+
+OBSERVATION_FORM_COLUMNS = [
+    "observation_id", "study_id", "participant_id", "observation_date", "visit_number",
+    "observation_type", "observation_category", "measurement_name", "measurement_value",
+    "measurement_unit", "created_by", "created_date",
+] + measurements.TYPED_COLUMNS
+
+FINDING_FORM_COLUMNS = [
+    "finding_id", "study_id", "participant_id", "finding_type", "finding_category",
+    "finding_description", "severity", "relationship_to_intervention", "action_taken",
+    "outcome", "sae_reported", "created_by", "created_date", "metadata",
+]
+
+# Form field name -> FINDINGS column; other fields are kept in metadata
+FINDING_FIELD_COLUMNS = {
+    "event_description": "finding_description",
+    "severity": "severity",
+    "relationship": "relationship_to_intervention",
+    "action_taken": "action_taken",
+    "outcome": "outcome",
+    "sae": "sae_reported",
+}
+
+_APPLIES_WHEN = re.compile(r"^\s*measurement_name\s*=\s*(.+?)\s*$", re.IGNORECASE)
+
+
+def _format(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float):
+        return f"{value:g}"
+    return str(value)
+
+
+class CompiledForm:
+    """A FORM_TEMPLATES row ready to render, validate and save"""
+
+    __slots__ = ("template_id", "name", "category", "help_text", "fields", "table", "_checks", "_units")
+
+    def __init__(self, template, rules, units=None):
+        self.template_id = template.template_id
+        self.name = template.template_name
+        self.category = template.template_category
+        self.help_text = template.help_text
+        structure = template.form_structure or {}
+        self.fields = tuple(
+            FormField(
+                name=field["name"],
+                type=field.get("type", "text"),
+                label=field.get("label", field["name"]),
+                unit=field.get("unit"),
+                required=bool(field.get("required", False)),
+                options=tuple(field.get("options", ())),
+            )
+            for field in structure.get("fields", ())
+        )
+        self.table = "FINDINGS" if self.category in FINDING_TYPES else "OBSERVATIONS"
+        self._checks = tuple(self._compile_rule(rule) for rule in rules)
+        self._units = units or {}
+
+    def _compile_rule(self, rule):
+        """Turn a VALIDATION_RULES row into check(values, visit_date) -> [(severity, message)]"""
+        definition = rule.rule_definition or {}
+        severity = rule.severity or "ERROR"
+        if rule.rule_type == "RANGE":
+            match = _APPLIES_WHEN.match(definition.get("applies_when", ""))
+            prefix = match.group(1).lower().replace(" ", "_") if match else ""
+            names = [f.name for f in self.fields if f.type == "number" and f.name.startswith(prefix)]
+            low, high = definition.get("min"), definition.get("max")
+
+            def check(values, visit_date):
+                return [(severity, rule.error_message) for name in names
+                        if values.get(name) is not None
+                        and ((low is not None and values[name] < low) or (high is not None and values[name] > high))]
+            return check
+        if rule.column_name == "observation_date":
+            date_names = [f.name for f in self.fields if f.type == "date"]
+
+            def check(values, visit_date):
+                dates = [visit_date] + [values.get(name) for name in date_names]
+                return [(severity, rule.error_message) for d in dates if d is not None and d > date.today()][:1]
+            return check
+        # Other rule types are enforced elsewhere (e.g. participant selection)
+        return lambda values, visit_date: []
+
+    def validate(self, values, visit_date):
+        """Return (errors, warnings) for a completed form"""
+        errors, warnings = [], []
+        for field in self.fields:
+            value = values.get(field.name)
+            if field.required and field.type != "checkbox" and (value is None or value == ""):
+                errors.append(f"{field.label} is required")
+        for check in self._checks:
+            for severity, message in check(values, visit_date):
+                (errors if severity == "ERROR" else warnings).append(message)
+        return errors, warnings
+
+    def to_rows(self, values, study_id, participant_id, visit_date, visit_number, user, created_date,
+                make_id=None):
+        """Rows for one batched write: (table, columns, rows, json_columns)
+
+        make_id(prefix, *content) supplies record keys; by default every
+        call gets a fresh ID.
+        """
+        make_id = make_id or (lambda prefix, *content: new_id(prefix))
+        if self.table == "FINDINGS":
+            row = {column: None for column in FINDING_FORM_COLUMNS}
+            extra = {"template_id": self.template_id, "visit_date": visit_date.isoformat()}
+            for field in self.fields:
+                value = values.get(field.name)
+                if isinstance(value, date):
+                    value = value.isoformat()
+                column = FINDING_FIELD_COLUMNS.get(field.name)
+                if column:
+                    row[column] = bool(value) if field.type == "checkbox" else value
+                elif value not in (None, ""):
+                    extra[field.name] = value
+            row.update({
+                "finding_id": make_id("FND", self.template_id, participant_id, row["finding_description"],
+                                      visit_date),
+                "study_id": study_id,
+                "participant_id": participant_id,
+                "finding_type": FINDING_TYPES[self.category],
+                "finding_category": self.category,
+                "created_by": user,
+                "created_date": created_date,
+                "metadata": json.dumps(extra),
+            })
+            return "RESEARCH_DATA.FINDINGS", FINDING_FORM_COLUMNS, [row], ("metadata",)
+        rows = []
+        for field in self.fields:
+            value = values.get(field.name)
+            if value is None or value == "":
+                continue
+            rows.append({
+                "observation_id": make_id("OBS", self.template_id, participant_id, visit_date, visit_number,
+                                          field.name, value),
+                "study_id": study_id,
+                "participant_id": participant_id,
+                "observation_date": visit_date.isoformat(),
+                "visit_number": visit_number,
+                "observation_type": self.name,
+                "observation_category": self.category,
+                "measurement_name": field.label,
+                "measurement_value": _format(value),
+                "measurement_unit": field.unit,
+                "created_by": user,
+                "created_date": created_date,
+            })
+        measurements.add_typed_values(rows, self._units)
+        return "RESEARCH_DATA.OBSERVATIONS", OBSERVATION_FORM_COLUMNS, rows, ()
+
+
+@lru_cache(maxsize=4)
+def compile_forms(snapshot):
+    """Compile every active template of a reference snapshot, by template ID"""
+    forms = {}
+    units = measurements.unit_lookup(snapshot)
+    for template in snapshot.rows("FORM_TEMPLATES"):
+        rules = [snapshot.get("VALIDATION_RULES", rule_id) for rule_id in template.validation_rules or ()]
+        forms[template.template_id] = CompiledForm(template, [r for r in rules if r is not None and r.is_active],
+                                                   units)
+    return forms
+
+
+def render_fields(form, key):
+    """Draw a form's fields inside the current st.form and return their values by name"""
+    values = {}
+    for field in form.fields:
+        label = f"{field.label}{f' ({field.unit})' if field.unit else ''}{' *' if field.required else ''}"
+        widget_key = f"{key}_{field.name}"
+        if field.type == "number":
+            values[field.name] = st.number_input(label, value=None, key=widget_key)
+        elif field.type == "date":
+            values[field.name] = st.date_input(label, value=date.today(), key=widget_key)
+        elif field.type == "select":
+            values[field.name] = st.selectbox(label, field.options, key=widget_key)
+        elif field.type == "checkbox":
+            values[field.name] = st.checkbox(label, key=widget_key)
+        else:
+            values[field.name] = st.text_area(label, key=widget_key).strip()
+    return values
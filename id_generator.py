@@ -0,0 +1,76 @@
+"""
+Collision-free, time-sortable record IDs
+
+IDs are ULIDs (48-bit millisecond timestamp + 80 random bits, Crockford
+base32, 26 characters) behind the table prefix, e.g.
+NOTE_01JA2B3C4D5E6F7G8H9J0KMNPQ. Within one millisecond the random part is
+incremented instead of redrawn, so IDs from one process are strictly
+increasing and never repeat, and the random bits keep separate app
+instances apart. Because they sort by creation time, new rows land next to
+each other, in line with the tables' time-based clustering.
+
+Imported rows that must load once however often they are re-sent get a
+content ID instead: the same prefix and 26 characters of a SHA-256 of the
+row, so a re-upload names the same rows again.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Crockford base32: no I, L, O or U
+ENCODING = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+
+def _encode(value, length):
+    chars = []
+    for _ in range(length):
+        chars.append(ENCODING[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+class IdGenerator:
+    """Monotonic ULID source, safe to share between threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._last_random = 0
+
+    def ulid(self):
+        """Next ULID string; strictly greater than every earlier one from this generator"""
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms <= self._last_ms:
+                # Same millisecond (or the clock stepped back): stay on the
+                # last timestamp and count up so ordering is preserved
+                now_ms = self._last_ms
+                random = self._last_random + 1
+                if random > _RANDOM_MAX:
+                    now_ms += 1
+                    random = int.from_bytes(os.urandom(10), "big")
+            else:
+                random = int.from_bytes(os.urandom(10), "big")
+            self._last_ms = now_ms
+            self._last_random = random
+        return _encode(now_ms, 10) + _encode(random, 16)
+
+
+_generator = IdGenerator()
+
+
+def new_id(prefix):
+    """New record ID such as STD_<ulid>, OBS_<ulid>"""
+    return f"{prefix}_{_generator.ulid()}"
+
+
+def content_id(prefix, *content):
+    """Record ID derived from content: the same prefix and content always give the same ID"""
+    digest = hashlib.sha256(json.dumps([prefix, *content], default=str).encode()).digest()
+    return f"{prefix}_{_encode(int.from_bytes(digest, 'big') >> (256 - 26 * 5), 26)}"
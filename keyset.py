@@ -0,0 +1,83 @@
+"""
+Keyset pagination for newest-first result lists
+
+A list is ordered by its sort keys, all descending with NULLs last, the
+last key being unique (the record id). A page is the rows after the last
+row of the previous page - its cursor - found with a seek predicate on
+those keys instead of OFFSET. Reaching page 50 reads no more rows than
+page 1, and rows added in the meantime don't shift the pages.
+
+Pages are fetched in chunks of two plus one row: the second page of a
+chunk is the prefetched next page, and the extra row tells whether there
+is a page after it.
+"""
+
+import pandas as pd
+
+PAGES_PER_CHUNK = 2
+
+
+def order_by(keys):
+    return ", ".join(f"{key} DESC NULLS LAST" for key in keys)
+
+
+def seek(keys, cursor):
+    """WHERE clause and bind parameters for the rows after cursor (None: all rows)"""
+    if cursor is None:
+        return "", []
+    clauses, params = [], []
+    equal, equal_params = [], []
+    for key, value in zip(keys, cursor):
+        if value is None:
+            # NULLs sort last, so only later keys can come after a NULL here
+            equal.append(f"{key} IS NULL")
+            continue
+        clauses.append(" AND ".join(equal + [f"({key} < ? OR {key} IS NULL)"]))
+        params += equal_params + [value]
+        equal.append(f"{key} = ?")
+        equal_params.append(value)
+    return "WHERE " + " OR ".join(f"({clause})" for clause in clauses), params
+
+
+def page_query(query, keys, cursor, limit):
+    """Wrap query to return up to limit rows after cursor
+
+    keys are result column names of query. Returns the query text and the
+    seek parameters, which go after query's own parameters.
+    """
+    where, params = seek(keys, cursor)
+    return f"""
+        SELECT * FROM ({query}) page
+        {where}
+        ORDER BY {order_by(keys)}
+        LIMIT {int(limit)}
+    """, params
+
+
+def chunk_size(rows_per_page):
+    return rows_per_page * PAGES_PER_CHUNK + 1
+
+
+def _plain(value):
+    if value is None or (not isinstance(value, (list, tuple, dict)) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value.item() if hasattr(value, "item") else value
+
+
+def cursor_after(df, keys):
+    """Cursor of the last row of a page DataFrame"""
+    row = df.iloc[-1]
+    return tuple(_plain(row[key.upper()]) for key in keys)
+
+
+def page_of(chunk, page_number, rows_per_page):
+    """Rows of a page within its chunk, and whether a next page exists"""
+    start = (page_number % PAGES_PER_CHUNK) * rows_per_page
+    return chunk.iloc[start:start + rows_per_page], len(chunk) > start + rows_per_page
+
+
+def chunk_cursor(cursors, page_number):
+    """Cursor a page's chunk starts at, from the cursors of the pages visited so far"""
+    return cursors[page_number - page_number % PAGES_PER_CHUNK]
@@ -0,0 +1,995 @@
+"""
+Local stand-in for the Snowpark session used by clinical_research_app.py
+
+Loads the DDL and reference data from sql/*.sql into an in-memory SQLite
+database (one attached database per Snowflake schema) and implements the
+small part of the Snowpark surface the app relies on:
+
+    session.sql(query, params=None).collect()
+    session.sql(query, params=None).to_pandas()
+    session.file.put_stream(stream, "@STAGE/path/file.csv")
+
+plus COPY INTO ... FROM (SELECT ... FROM @STAGE/path/), MERGE ... USING
+(SELECT $n ... FROM @STAGE/path/ (FILE_FORMAT => ...)) and REMOVE on those
+files. Streams are change tables filled by triggers and emptied by the
+DML statement that reads them; resumed tasks run right after a write
+gives their streams data. FULL_TEXT search optimization is an FTS5
+inverted index kept in step by triggers, which SEARCH() queries; EQUALITY
+search optimization is an index per column. ARRAY and
+VARIANT values are JSON text, and LATERAL FLATTEN is json_each. Select it
+with CLINICAL_RESEARCH_BACKEND=local to run the app, or the benchmarks in
+benchmarks.py, without a Snowflake account.
+"""
+
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql")
+DATABASE_NAME = "CLINICAL_RESEARCH"
+DEFAULT_SCHEMA = "RESEARCH_DATA"
+
+# ============================================================================
+# Rows and result sets
+# ============================================================================
+
+
+class Row(tuple):
+    """Result row supporting positional, key and attribute access like snowpark.Row"""
+
+    def __new__(cls, values, fields):
+        row = super().__new__(cls, values)
+        row._fields = fields
+        row._index = {name: i for i, name in enumerate(fields)}
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key.upper()])
+        return tuple.__getitem__(self, key)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def as_dict(self):
+        return dict(zip(self._fields, self))
+
+
+class LocalDataFrame:
+    """Lazy query result returned by LocalSession.sql()"""
+
+    def __init__(self, session, query, params=None):
+        self._session = session
+        self._query = query
+        self._params = params
+
+    def collect(self):
+        fields, rows = self._session._execute(self._query, self._params)
+        return [Row(values, fields) for values in rows]
+
+    def to_pandas(self):
+        import pandas as pd
+
+        fields, rows = self._session._execute(self._query, self._params)
+        return pd.DataFrame.from_records(rows, columns=fields)
+
+    def to_pandas_batches(self, batch_size=10000):
+        """Yield the result as DataFrames of at most batch_size rows"""
+        import pandas as pd
+
+        for fields, rows in self._session._execute_batches(self._query, self._params, batch_size):
+            yield pd.DataFrame.from_records(rows, columns=fields)
+
+
+# ============================================================================
+# Snowflake -> SQLite translation
+# ============================================================================
+
+_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+_DATABASE_PREFIX = re.compile(r"\b%s\." % DATABASE_NAME, re.IGNORECASE)
+_NILADIC_CALLS = re.compile(r"\b(CURRENT_DATE|CURRENT_TIMESTAMP|CURRENT_TIME)\(\)", re.IGNORECASE)
+_DATE_PART_ARG = re.compile(r"\b(DATEADD|DATEDIFF)\(\s*(\w+)\s*,", re.IGNORECASE)
+_CAST_SUFFIX = re.compile(r"([\w.]+|\))::(\w+)")
+_DEFAULT_CALL = re.compile(r"\bDEFAULT\s+(\w+\(\))", re.IGNORECASE)
+_FLATTEN = re.compile(r"\bLATERAL\s+FLATTEN\(\s*input\s*=>\s*([\w.]+)\s*\)", re.IGNORECASE)
+_CREATE_TABLE = re.compile(
+    r"^CREATE\s+(?:OR\s+REPLACE\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.]+)",
+    re.IGNORECASE,
+)
+_CREATE_DYNAMIC_TABLE = re.compile(
+    r"^CREATE\s+(?:OR\s+REPLACE\s+)?DYNAMIC\s+TABLE\s+([\w.]+)\b.*?\bAS\s+(SELECT\b.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+_SOURCE_TABLE = re.compile(r"\b(?:FROM|JOIN)\s+([\w.]+)", re.IGNORECASE)
+_INSERT_INTO = re.compile(r"^INSERT\s+INTO\s+([\w.]+)", re.IGNORECASE)
+_CREATE_SCHEMA = re.compile(r"^CREATE\s+SCHEMA\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.]+)", re.IGNORECASE)
+_USE_SCHEMA = re.compile(r"^USE\s+SCHEMA\s+([\w.]+)", re.IGNORECASE)
+_MERGE = re.compile(
+    r"^\s*MERGE\s+INTO\s+([\w.]+)\s+(?:AS\s+)?(\w+)\s+USING\s+\((.*)\)\s+(?:AS\s+)?(\w+)\s+ON\s+(.*?)"
+    r"(?:\s+WHEN\s+MATCHED\s+AND\s+(.*?)\s+THEN\s+DELETE)?"
+    r"(?:\s+WHEN\s+MATCHED\s+THEN\s+UPDATE\s+SET\s+(.*?))?"
+    r"\s+WHEN\s+NOT\s+MATCHED(?:\s+AND\s+(.*?))?\s+THEN\s+INSERT\s*\((.*?)\)\s*VALUES\s*\((.*)\)\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+_COPY_INTO = re.compile(
+    r"^\s*COPY\s+INTO\s+([\w.]+)\s*\((.*?)\)\s+FROM\s+\(\s*SELECT\s+(.*?)\s+FROM\s+(@[\w.$/-]+)\s*\)(.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+# SELECT [DISTINCT] $n as name, ... FROM @stage/path/ (FILE_FORMAT => 'name'), as a MERGE source
+_STAGED_SELECT = re.compile(
+    r"^\s*SELECT\s+(DISTINCT\s+)?(.*?)\s+FROM\s+(@[\w.$/-]+)\s*\(\s*FILE_FORMAT\s*=>\s*'([\w.]+)'\s*\)\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+_FORMAT_NAME = re.compile(r"\bFORMAT_NAME\s*=\s*'?([\w.]+)'?", re.IGNORECASE)
+_ON_ERROR = re.compile(r"\bON_ERROR\s*=\s*'?(\w+)'?", re.IGNORECASE)
+
+# NULL_IF of the CSV file formats in sql/01_setup_database.sql (both SKIP_HEADER = 1);
+# an empty field is NULL in both (EMPTY_FIELD_AS_NULL)
+_FILE_FORMAT_NULLS = {
+    "REFERENCE_DATA.CSV_FORMAT": ("NULL", "null", ""),
+    "REFERENCE_DATA.EXCEL_FORMAT": ("",),
+}
+_REMOVE = re.compile(r"^\s*REMOVE\s+(@[\w.$/-]+)\s*$", re.IGNORECASE)
+_CREATE_STREAM = re.compile(
+    r"^CREATE\s+(?:OR\s+REPLACE\s+)?STREAM\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.]+)\s+ON\s+TABLE\s+([\w.]+)(.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+_SHOW_INITIAL_ROWS = re.compile(r"\bSHOW_INITIAL_ROWS\s*=\s*TRUE\b", re.IGNORECASE)
+_CREATE_TASK = re.compile(
+    r"^CREATE\s+(?:OR\s+REPLACE\s+)?TASK\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.]+)\b(.*?)\bAS\s+(.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+_STREAM_HAS_DATA = re.compile(r"SYSTEM\$STREAM_HAS_DATA\(\s*'([\w.]+)'\s*\)", re.IGNORECASE)
+_ALTER_TASK = re.compile(r"^\s*ALTER\s+TASK\s+(?:IF\s+EXISTS\s+)?([\w.]+)\s+(RESUME|SUSPEND)\s*$", re.IGNORECASE)
+_EXECUTE_TASK = re.compile(r"^\s*EXECUTE\s+TASK\s+([\w.]+)\s*$", re.IGNORECASE)
+_ADD_SEARCH_OPTIMIZATION = re.compile(
+    r"^ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?([\w.]+)\s+ADD\s+SEARCH\s+OPTIMIZATION\s+ON\s+FULL_TEXT\s*\(([^)]*)\)",
+    re.IGNORECASE,
+)
+_ADD_EQUALITY_SEARCH = re.compile(
+    r"^ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?([\w.]+)\s+ADD\s+SEARCH\s+OPTIMIZATION\s+ON\s+EQUALITY\s*\(([^)]*)\)",
+    re.IGNORECASE,
+)
+_SEARCH_CALL = re.compile(r"\bSEARCH\(\s*\(([^()]*)\)\s*,\s*(\?|'(?:[^']|'')*')\s*\)", re.IGNORECASE)
+_DML_TARGET = re.compile(r"^\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|MERGE\s+INTO)\s+([\w.]+)", re.IGNORECASE)
+
+_SQLITE_TYPES = {
+    "FLOAT": "REAL", "DOUBLE": "REAL", "NUMBER": "NUMERIC", "INTEGER": "INTEGER",
+    "INT": "INTEGER", "VARCHAR": "TEXT", "STRING": "TEXT", "TEXT": "TEXT",
+    "BOOLEAN": "INTEGER", "DATE": "TEXT", "TIMESTAMP_NTZ": "TEXT",
+}
+
+
+def _translate_code(code):
+    """Rewrite the Snowflake-only syntax in a SQL fragment with no string literals"""
+    code = _DATABASE_PREFIX.sub("", code)
+    code = _NILADIC_CALLS.sub(lambda m: m.group(1).upper(), code)
+    code = _FLATTEN.sub(r"json_each(\1)", code)
+    code = _DATE_PART_ARG.sub(lambda m: "%s('%s'," % (m.group(1).upper(), m.group(2).lower()), code)
+    code = _CAST_SUFFIX.sub(
+        lambda m: "CAST(%s AS %s)" % (m.group(1), _SQLITE_TYPES.get(m.group(2).upper(), m.group(2))),
+        code,
+    )
+    return code
+
+
+def translate(query):
+    """Translate a Snowflake SQL statement into the SQLite dialect"""
+    parts = _STRING_LITERAL.split(query)
+    # Odd indexes are string literals, which are passed through untouched
+    return "".join(part if i % 2 else _translate_code(part) for i, part in enumerate(parts))
+
+
+def split_statements(script):
+    """Split a SQL script on semicolons, ignoring comments, strings and $$ blocks"""
+    statements, current = [], []
+    i, n = 0, len(script)
+    while i < n:
+        ch = script[i]
+        if script.startswith("--", i):
+            end = script.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if script.startswith("/*", i):
+            end = script.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            continue
+        if script.startswith("$$", i):
+            end = script.find("$$", i + 2)
+            end = n if end == -1 else end + 2
+            current.append(script[i:end])
+            i = end
+            continue
+        if ch == "'":
+            end = i + 1
+            while end < n:
+                if script[end] == "'":
+                    if script.startswith("''", end):
+                        end += 2
+                        continue
+                    break
+                end += 1
+            current.append(script[i:end + 1])
+            i = end + 1
+            continue
+        if ch == ";":
+            statement = "".join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    statement = "".join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+# ============================================================================
+# Snowflake functions registered on the SQLite connection
+# ============================================================================
+
+
+def _array_construct(*values):
+    return json.dumps(list(values))
+
+
+def _object_construct(*pairs):
+    # Like Snowflake, keys with NULL values are omitted
+    return json.dumps({pairs[i]: pairs[i + 1] for i in range(0, len(pairs), 2) if pairs[i + 1] is not None})
+
+
+def _parse_json(text):
+    return None if text is None else json.dumps(json.loads(text))
+
+
+def _to_variant(value):
+    return None if value is None else json.dumps(value)
+
+
+def _array_contains(value, array):
+    return None if value is None or array is None else json.loads(value) in json.loads(array)
+
+
+def _array_to_string(array, separator):
+    return None if array is None else separator.join(str(item) for item in json.loads(array))
+
+
+def _try_to_date(value):
+    if value is None:
+        return None
+    for pattern in ("%Y-%m-%d", "%m/%d/%Y", "%d-%b-%Y"):
+        try:
+            return datetime.strptime(str(value).strip(), pattern).date().isoformat()
+        except ValueError:
+            pass
+    return None
+
+
+_BOOLEAN_STRINGS = {"true": 1, "t": 1, "yes": 1, "y": 1, "on": 1, "1": 1,
+                    "false": 0, "f": 0, "no": 0, "n": 0, "off": 0, "0": 0}
+
+
+def _try_to_boolean(value):
+    return None if value is None else _BOOLEAN_STRINGS.get(str(value).strip().lower())
+
+
+def _rlike(subject, pattern):
+    # Snowflake regular expressions match the whole subject
+    return None if subject is None or pattern is None else re.fullmatch(pattern, str(subject)) is not None
+
+
+def _try_to_double(value):
+    try:
+        return None if value is None else float(value)
+    except ValueError:
+        return None
+
+
+def _to_date(value):
+    return None if value is None else datetime.fromisoformat(str(value)).date().isoformat()
+
+
+def _regexp_replace(subject, pattern, replacement=""):
+    return None if subject is None or pattern is None else re.sub(pattern, replacement, str(subject))
+
+
+def _regexp_count(subject, pattern):
+    return None if subject is None or pattern is None else len(re.findall(pattern, str(subject)))
+
+
+def _fts_query(text):
+    """SEARCH() search string -> FTS5 query matching any of its tokens, as SEARCH's default OR mode"""
+    tokens = re.findall(r"[^\W_]+", str(text or "").lower())
+    return " OR ".join(f'"{token}"' for token in dict.fromkeys(tokens)) or None
+
+
+def _lpad(value, length, pad):
+    if value is None:
+        return None
+    value = str(value)
+    return value[:length] if len(value) >= length else (pad * length + value)[-length:]
+
+
+def _dateadd(part, amount, value):
+    if value is None or amount is None:
+        return None
+    is_date = len(str(value)) <= 10
+    base = datetime.fromisoformat(str(value))
+    part = part.lower()
+    if part in ("day", "days", "d"):
+        result = base + timedelta(days=amount)
+    elif part in ("week", "weeks", "w"):
+        result = base + timedelta(weeks=amount)
+    elif part in ("hour", "hours", "h"):
+        result = base + timedelta(hours=amount)
+    elif part in ("minute", "minutes"):
+        result = base + timedelta(minutes=amount)
+    elif part in ("month", "months", "year", "years"):
+        months = amount * 12 if part.startswith("year") else amount
+        month_index = base.month - 1 + months
+        year, month = base.year + month_index // 12, month_index % 12 + 1
+        result = base.replace(year=year, month=month, day=min(base.day, 28))
+    else:
+        raise ValueError(f"Unsupported date part: {part}")
+    return result.date().isoformat() if is_date else result.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class _ArrayAgg:
+    """ARRAY_AGG aggregate returning a JSON array, as Snowpark returns ARRAY columns"""
+
+    def __init__(self):
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        return json.dumps(self.values)
+
+
+class _CountIf:
+    """COUNT_IF aggregate"""
+
+    def __init__(self):
+        self.count = 0
+
+    def step(self, condition):
+        if condition:
+            self.count += 1
+
+    def finalize(self):
+        return self.count
+
+
+# ============================================================================
+# Local session
+# ============================================================================
+
+
+class LocalSession:
+    """SQLite-backed stand-in for snowflake.snowpark.Session"""
+
+    def __init__(self, user="LOCAL_USER", role="RESEARCH_ADMIN", latency=0.0):
+        self.user = user
+        self.role = role
+        # Simulated warehouse round trip in seconds, paid outside the lock so
+        # concurrent queries overlap the way they do against Snowflake
+        self.latency = latency
+        self.schemas = []
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self._register_functions()
+        self.query_count = 0
+        self._last_altered = datetime.min
+        # Dynamic tables: "SCHEMA.TABLE" -> (defining SELECT, {(schema, table) sources})
+        self._dynamic_tables = {}
+        # Staged files: "SCHEMA.STAGE/path/file" -> bytes
+        self._stage_files = {}
+        # Streams: "SCHEMA.STREAM" -> "SCHEMA.TABLE" it captures
+        self._streams = {}
+        # Tasks: "SCHEMA.TASK" -> [body, streams in its WHEN clause, resumed]
+        self._tasks = {}
+        self._running_tasks = set()
+        # Thread between BEGIN and COMMIT/ROLLBACK, which holds _lock meanwhile
+        self._transaction_owner = None
+        # FULL_TEXT search indexes: (column, ...) -> "SCHEMA.TABLE_SEARCH_INDEX"
+        self._search_indexes = {}
+        self.file = LocalFileOperation(self)
+        # INFORMATION_SCHEMA.TABLES with a LAST_ALTERED stamp that every DML
+        # statement advances, the local counterpart of Snowflake's change tracking
+        self._attach_schema("INFORMATION_SCHEMA")
+        self._conn.execute(
+            "CREATE TABLE INFORMATION_SCHEMA.TABLES (table_catalog TEXT, table_schema TEXT,"
+            " table_name TEXT, table_type TEXT, created TEXT, last_altered TEXT)"
+        )
+
+    @classmethod
+    def from_scripts(cls, paths=None, **kwargs):
+        """Create a session and load the given SQL scripts (default: sql/*.sql in order)"""
+        session = cls(**kwargs)
+        if paths is None:
+            paths = sorted(
+                os.path.join(SQL_DIR, name) for name in os.listdir(SQL_DIR) if name.endswith(".sql")
+            )
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                session.run_script(f.read())
+        return session
+
+    def _register_functions(self):
+        conn = self._conn
+        conn.create_function("CURRENT_USER", 0, lambda: self.user)
+        conn.create_function("CURRENT_ROLE", 0, lambda: self.role)
+        conn.create_function("CURRENT_DATABASE", 0, lambda: DATABASE_NAME)
+        conn.create_function("CURRENT_SCHEMA", 0, lambda: DEFAULT_SCHEMA)
+        conn.create_function("UUID_STRING", 0, lambda: str(uuid.uuid4()))
+        conn.create_function("ARRAY_CONSTRUCT", -1, _array_construct)
+        conn.create_function("OBJECT_CONSTRUCT", -1, _object_construct, deterministic=True)
+        conn.create_function("PARSE_JSON", 1, _parse_json, deterministic=True)
+        conn.create_function("TO_VARIANT", 1, _to_variant, deterministic=True)
+        conn.create_function("ARRAY_CONTAINS", 2, _array_contains, deterministic=True)
+        conn.create_function("ARRAY_TO_STRING", 2, _array_to_string, deterministic=True)
+        conn.create_function("DATEADD", 3, _dateadd, deterministic=True)
+        conn.create_function("TRY_TO_DATE", 1, _try_to_date, deterministic=True)
+        conn.create_function("TRY_TO_BOOLEAN", 1, _try_to_boolean, deterministic=True)
+        conn.create_function("LPAD", 3, _lpad, deterministic=True)
+        conn.create_function("TO_DATE", 1, _to_date, deterministic=True)
+        conn.create_function("REGEXP_REPLACE", 3, _regexp_replace, deterministic=True)
+        conn.create_function("REGEXP_COUNT", 2, _regexp_count, deterministic=True)
+        conn.create_function("SEARCH_QUERY", 1, _fts_query, deterministic=True)
+        conn.create_function("RLIKE", 2, _rlike, deterministic=True)
+        conn.create_function("TRY_TO_DOUBLE", 1, _try_to_double, deterministic=True)
+        conn.create_aggregate("ARRAY_AGG", 1, _ArrayAgg)
+        conn.create_aggregate("COUNT_IF", 1, _CountIf)
+
+    def _attach_schema(self, schema):
+        schema = schema.split(".")[-1].upper()
+        if schema not in self.schemas:
+            self._conn.execute(f"ATTACH DATABASE ':memory:' AS {schema}")
+            self.schemas.append(schema)
+        return schema
+
+    def run_script(self, script):
+        """Apply the CREATE SCHEMA, CREATE TABLE and INSERT statements of a setup script"""
+        schema = DEFAULT_SCHEMA
+        with self._lock:
+            for statement in split_statements(script):
+                if _CREATE_SCHEMA.match(statement):
+                    self._attach_schema(_CREATE_SCHEMA.match(statement).group(1))
+                elif _USE_SCHEMA.match(statement):
+                    schema = self._attach_schema(_USE_SCHEMA.match(statement).group(1))
+                elif _CREATE_TABLE.match(statement):
+                    self._create_table(statement, schema)
+                elif _CREATE_DYNAMIC_TABLE.match(statement):
+                    self._create_dynamic_table(statement, schema)
+                elif _CREATE_STREAM.match(statement):
+                    self._create_stream(statement, schema)
+                elif _CREATE_TASK.match(statement):
+                    self._create_task(statement, schema)
+                elif _ALTER_TASK.match(statement) or _EXECUTE_TASK.match(statement):
+                    self._run(statement)
+                elif _ADD_SEARCH_OPTIMIZATION.match(statement):
+                    self._add_search_optimization(statement, schema)
+                elif _ADD_EQUALITY_SEARCH.match(statement):
+                    self._add_equality_search(statement, schema)
+                elif _INSERT_INTO.match(statement):
+                    statement = self._qualify(_INSERT_INTO, statement, schema)
+                    self._conn.execute(translate(statement))
+                    self._touch(_INSERT_INTO.match(statement).group(1))
+                # Warehouses, grants, policies, views and procedures have
+                # no local equivalent and are skipped
+
+    def _qualify(self, pattern, statement, schema):
+        """Prefix the table name matched by pattern with the current schema"""
+        match = pattern.match(statement)
+        name = _DATABASE_PREFIX.sub("", match.group(1))
+        if "." not in name:
+            name = f"{schema}.{name}"
+        return statement[:match.start(1)] + name + statement[match.end(1):]
+
+    def _create_table(self, statement, schema):
+        statement = self._qualify(_CREATE_TABLE, statement, schema)
+        statement = _CREATE_TABLE.sub(lambda m: f"CREATE TABLE IF NOT EXISTS {m.group(1)}", statement)
+        statement = translate(statement)
+        statement = _DEFAULT_CALL.sub(lambda m: f"DEFAULT ({m.group(1)})", statement)
+        self._conn.execute(statement)
+        self._register_table(_CREATE_TABLE.match(statement).group(1))
+
+    def _register_table(self, name):
+        table_schema, table_name = name.upper().split(".")
+        stamp = self._next_stamp()
+        self._conn.execute(
+            "INSERT INTO INFORMATION_SCHEMA.TABLES VALUES (?, ?, ?, 'BASE TABLE', ?, ?)",
+            (DATABASE_NAME, table_schema, table_name, stamp, stamp),
+        )
+
+    def _create_dynamic_table(self, statement, schema):
+        """Materialize a dynamic table and keep it current on every write to its sources
+
+        Snowflake refreshes within TARGET_LAG; locally the refresh is a
+        synchronous full recompute after each write to a source table.
+        """
+        match = _CREATE_DYNAMIC_TABLE.match(statement)
+        name = _DATABASE_PREFIX.sub("", match.group(1)).upper()
+        name = name if "." in name else f"{schema}.{name}"
+        select = match.group(2)
+        sources = set()
+        for source in _SOURCE_TABLE.findall(_DATABASE_PREFIX.sub("", select)):
+            parts = source.upper().split(".")
+            sources.add((parts[-2] if len(parts) > 1 else schema, parts[-1]))
+            if len(parts) == 1:
+                select = re.sub(r"\b(FROM|JOIN)\s+%s\b" % source, r"\1 %s.%s" % (schema, source), select,
+                                flags=re.IGNORECASE)
+        self._conn.execute(f"CREATE TABLE {name} AS {translate(select)}")
+        self._register_table(name)
+        self._dynamic_tables[name] = (translate(select), sources)
+
+    def _refresh_dynamic_table(self, name):
+        select, _ = self._dynamic_tables[name]
+        self._conn.execute(f"DELETE FROM {name}")
+        self._conn.execute(f"INSERT INTO {name} {select}")
+        self._touch(name)
+
+    def _refresh_dynamic_tables(self, table_schema, table_name):
+        for name, (_, sources) in self._dynamic_tables.items():
+            if any(t == table_name and table_schema in (None, s) for s, t in sources):
+                self._refresh_dynamic_table(name)
+
+    def refresh_dynamic_tables(self):
+        """Recompute every dynamic table and run due tasks, e.g. after loading data through the raw connection"""
+        with self._lock:
+            for name in list(self._dynamic_tables):
+                self._refresh_dynamic_table(name)
+            self._run_due_tasks()
+
+    def _local_name(self, name, schema):
+        name = _DATABASE_PREFIX.sub("", name).upper()
+        return name if "." in name else f"{schema}.{name}"
+
+    def _create_stream(self, statement, schema):
+        """Change table for a stream, filled by triggers on its source table
+
+        Each row is a source row plus METADATA$ACTION, METADATA$ISUPDATE and
+        METADATA$ROW_ID; an update is a DELETE row and an INSERT row, as in
+        Snowflake. Changes are kept as they happen rather than netted, which
+        gives the same totals for the delta aggregations tasks run. Stream
+        names must be unique across schemas: trigger bodies cannot qualify
+        the table they write.
+        """
+        match = _CREATE_STREAM.match(statement)
+        name = self._local_name(match.group(1), schema)
+        source = self._local_name(match.group(2), schema)
+        stream_schema, stream_name = name.split(".")
+        source_schema, source_table = source.split(".")
+        columns = [row[1] for row in self._conn.execute(f"PRAGMA {source_schema}.table_info({source_table})")]
+        self._conn.execute(f"DROP TABLE IF EXISTS {name}")
+        self._conn.execute(
+            f"CREATE TABLE {name} ({', '.join(columns)}, METADATA$ACTION TEXT, METADATA$ISUPDATE INTEGER,"
+            " METADATA$ROW_ID TEXT)"
+        )
+
+        def capture(row, action, is_update):
+            values = ", ".join(f"{row}.{column}" for column in columns)
+            return f"INSERT INTO {stream_name} VALUES ({values}, '{action}', {is_update}, {row}.rowid);"
+
+        triggers = {
+            "INSERT": capture("NEW", "INSERT", 0),
+            "DELETE": capture("OLD", "DELETE", 0),
+            "UPDATE": capture("OLD", "DELETE", 1) + " " + capture("NEW", "INSERT", 1),
+        }
+        for event, body in triggers.items():
+            trigger = f"{stream_name}_{event.lower()}"
+            self._conn.execute(f"DROP TRIGGER IF EXISTS temp.{trigger}")
+            self._conn.execute(f"CREATE TEMP TRIGGER {trigger} AFTER {event} ON {source} BEGIN {body} END")
+        if _SHOW_INITIAL_ROWS.search(match.group(3)):
+            self._conn.execute(f"INSERT INTO {name} SELECT *, 'INSERT', 0, rowid FROM {source}")
+        self._streams[name] = source
+
+    def _add_search_optimization(self, statement, schema):
+        """FTS5 index over a table's FULL_TEXT columns, kept current by triggers
+
+        SEARCH((columns), string) on the same columns becomes a rowid
+        lookup in the index (see _rewrite_search). Like Snowflake's default
+        analyzer, FTS5 lower-cases text and splits it on non-alphanumerics.
+        """
+        match = _ADD_SEARCH_OPTIMIZATION.match(statement)
+        table = self._local_name(match.group(1), schema)
+        columns = [column.strip().upper() for column in match.group(2).split(",")]
+        table_schema, table_name = table.split(".")
+        index_name = f"{table_name}_SEARCH_INDEX"
+        index = f"{table_schema}.{index_name}"
+        self._conn.execute(f"DROP TABLE IF EXISTS {index}")
+        self._conn.execute(
+            f"CREATE VIRTUAL TABLE {index} USING fts5({', '.join(columns)}, content='{table_name}', content_rowid='rowid')"
+        )
+        self._conn.execute(f"INSERT INTO {index} ({index_name}) VALUES ('rebuild')")
+
+        def add(row):
+            values = ", ".join(f"{row}.{column}" for column in columns)
+            return f"INSERT INTO {index_name} (rowid, {', '.join(columns)}) VALUES ({row}.rowid, {values});"
+
+        def remove(row):
+            values = ", ".join(f"{row}.{column}" for column in columns)
+            return (f"INSERT INTO {index_name} ({index_name}, rowid, {', '.join(columns)})"
+                    f" VALUES ('delete', {row}.rowid, {values});")
+
+        triggers = {"INSERT": add("NEW"), "DELETE": remove("OLD"), "UPDATE": remove("OLD") + " " + add("NEW")}
+        for event, body in triggers.items():
+            trigger = f"{index_name}_{event.lower()}"
+            self._conn.execute(f"DROP TRIGGER IF EXISTS temp.{trigger}")
+            self._conn.execute(f"CREATE TEMP TRIGGER {trigger} AFTER {event} ON {table} BEGIN {body} END")
+        self._search_indexes[tuple(columns)] = index
+
+    def _add_equality_search(self, statement, schema):
+        """An index per EQUALITY search optimization column, for point lookups on each on its own"""
+        match = _ADD_EQUALITY_SEARCH.match(statement)
+        table_schema, table_name = self._local_name(match.group(1), schema).split(".")
+        for column in (column.strip().upper() for column in match.group(2).split(",")):
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {table_schema}.{table_name}_{column}_EQUALITY ON {table_name} ({column})"
+            )
+
+    def _rewrite_search(self, query):
+        """SEARCH((alias.column, ...), string) -> alias.rowid IN (FTS5 index match)"""
+        def lookup(match):
+            qualified = [column.strip().upper().split(".") for column in match.group(1).split(",")]
+            index = self._search_indexes.get(tuple(parts[-1] for parts in qualified))
+            if index is None:
+                raise sqlite3.OperationalError(f"No FULL_TEXT search optimization on ({match.group(1)})")
+            rowid = f"{qualified[0][0]}.rowid" if len(qualified[0]) > 1 else "rowid"
+            index_name = index.split(".")[-1]
+            return f"{rowid} IN (SELECT rowid FROM {index} WHERE {index_name} MATCH SEARCH_QUERY({match.group(2)}))"
+
+        return _SEARCH_CALL.sub(lookup, query) if self._search_indexes else query
+
+    def _create_task(self, statement, schema):
+        """Register a task; like Snowflake's, it starts suspended"""
+        match = _CREATE_TASK.match(statement)
+        streams = [self._local_name(stream, schema) for stream in _STREAM_HAS_DATA.findall(match.group(2))]
+        self._tasks[self._local_name(match.group(1), schema)] = [match.group(3).strip(), streams, False]
+
+    def _task(self, name):
+        name = _DATABASE_PREFIX.sub("", name).upper()
+        for task in self._tasks:
+            if task == name or task.split(".")[-1] == name:
+                return task
+        raise sqlite3.OperationalError(f"Task '{name}' does not exist")
+
+    def _consume_streams(self, query):
+        """Advance (empty) the streams a DML statement read"""
+        code = "".join(_STRING_LITERAL.split(query)[::2]).upper()
+        for name in self._streams:
+            if re.search(r"\b%s\b" % name.split(".")[-1], code):
+                self._conn.execute(f"DELETE FROM {name}")
+
+    def _stream_has_data(self, name):
+        return self._conn.execute(f"SELECT 1 FROM {name} LIMIT 1").fetchone() is not None
+
+    def _execute_task(self, name):
+        body = self._tasks[name][0]
+        self._running_tasks.add(name)
+        try:
+            self._run(body)
+        finally:
+            self._running_tasks.discard(name)
+
+    def _run_due_tasks(self, source=None):
+        """Run resumed tasks whose WHEN streams have data (and, if given, capture source)
+
+        Snowflake checks on the task's schedule; locally the check follows
+        every write, the way dynamic tables are kept current here.
+        """
+        for name, (_, streams, resumed) in list(self._tasks.items()):
+            if not resumed or name in self._running_tasks:
+                continue
+            if source is not None and source not in (self._streams.get(stream) for stream in streams):
+                continue
+            if any(stream in self._streams and self._stream_has_data(stream) for stream in streams):
+                self._execute_task(name)
+
+    def _next_stamp(self):
+        """Strictly increasing timestamp, so two writes never share a version"""
+        self._last_altered = max(datetime.now(), self._last_altered + timedelta(microseconds=1))
+        return self._last_altered.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    def _touch(self, name):
+        """Advance LAST_ALTERED for a table written by a DML statement"""
+        parts = _DATABASE_PREFIX.sub("", name).upper().split(".")
+        query = "UPDATE INFORMATION_SCHEMA.TABLES SET last_altered = ? WHERE table_name = ?"
+        params = [self._next_stamp(), parts[-1]]
+        if len(parts) > 1:
+            query += " AND table_schema = ?"
+            params.append(parts[-2])
+        self._conn.execute(query, params)
+        self._refresh_dynamic_tables(parts[-2] if len(parts) > 1 else None, parts[-1])
+        if self._tasks:
+            self._run_due_tasks(".".join(parts) if len(parts) > 1 else None)
+
+    def sql(self, query, params=None):
+        return LocalDataFrame(self, query, params)
+
+    def _execute(self, query, params=None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.query_count += 1
+            result = self._run(query, params)
+            # A transaction keeps the lock from BEGIN to COMMIT or ROLLBACK, so
+            # no other thread's statement runs inside it or is rolled back with it
+            verb = query.strip().upper()
+            if verb == "BEGIN":
+                self._lock.acquire()
+                self._transaction_owner = threading.get_ident()
+            elif verb in ("COMMIT", "ROLLBACK") and self._transaction_owner == threading.get_ident():
+                self._transaction_owner = None
+                self._lock.release()
+            return result
+
+    def _run(self, query, params=None):
+        merge = _MERGE.match(query)
+        if merge:
+            return self._merge(merge, params)
+        copy_into = _COPY_INTO.match(query)
+        if copy_into:
+            return self._copy_into(copy_into)
+        remove = _REMOVE.match(query)
+        if remove:
+            return self._remove(remove.group(1))
+        alter_task = _ALTER_TASK.match(query)
+        if alter_task:
+            self._tasks[self._task(alter_task.group(1))][2] = alter_task.group(2).upper() == "RESUME"
+            return ["status"], [("Statement executed successfully.",)]
+        execute_task = _EXECUTE_TASK.match(query)
+        if execute_task:
+            self._execute_task(self._task(execute_task.group(1)))
+            return ["status"], [(f"Task {execute_task.group(1).upper()} is scheduled to run immediately.",)]
+        cursor = self._conn.execute(translate(self._rewrite_search(query)), params or ())
+        target = _DML_TARGET.match(query)
+        if target:
+            if self._streams:
+                self._consume_streams(query)
+            self._touch(target.group(1))
+        if cursor.description is None:
+            verb = query.lstrip().split(None, 1)[0].lower()
+            return [f"number of rows {verb.rstrip('e')}ed"], [(cursor.rowcount,)]
+        fields = [column[0].upper() for column in cursor.description]
+        return fields, cursor.fetchall()
+
+    def _merge(self, match, params):
+        """Run MERGE INTO t USING (source) s ON ... as DELETE, UPDATE ... FROM and INSERT ... WHERE NOT EXISTS
+
+        Covers the upsert shape batch_writes.merge_statements generates:
+        an optional WHEN MATCHED THEN UPDATE SET and a WHEN NOT MATCHED
+        THEN INSERT, with all bind parameters in the source query. A
+        WHEN MATCHED AND condition THEN DELETE runs first, so it assumes
+        the INSERT condition excludes the rows it deletes, as in
+        sql/10_search_documents.sql. The source may also select the
+        fields of staged files, as spreadsheet_import.py does.
+        """
+        staged = _STAGED_SELECT.match(match.group(3))
+        (target, alias, source, source_alias, on, delete_when, update_set, insert_when, insert_columns,
+         insert_values) = (translate(part) if part is not None else None for part in match.groups())
+        conn = self._conn
+        conn.execute("DROP TABLE IF EXISTS temp._merge_source")
+        if staged:
+            self._load_staged_source(staged)
+        else:
+            conn.execute(f"CREATE TEMP TABLE _merge_source AS {source}", params or ())
+        try:
+            if delete_when:
+                conn.execute(
+                    f"DELETE FROM {target} WHERE rowid IN (SELECT {alias}.rowid FROM _merge_source AS {source_alias}"
+                    f" JOIN {target} AS {alias} ON {on} WHERE {delete_when})"
+                )
+            updated = 0
+            if update_set:
+                updated = conn.execute(
+                    f"UPDATE {target} AS {alias} SET {update_set} FROM _merge_source AS {source_alias} WHERE {on}"
+                ).rowcount
+            inserted = conn.execute(
+                f"INSERT INTO {target} ({insert_columns}) SELECT {insert_values}"
+                f" FROM _merge_source AS {source_alias}"
+                f" WHERE NOT EXISTS (SELECT 1 FROM {target} AS {alias} WHERE {on})"
+                + (f" AND ({insert_when})" if insert_when else "")
+            ).rowcount
+        finally:
+            conn.execute("DROP TABLE temp._merge_source")
+        if self._streams:
+            self._consume_streams(source)
+        self._touch(match.group(1))
+        return ["number of rows inserted", "number of rows updated"], [(inserted, updated)]
+
+    def _staged(self, location):
+        """Staged files under a stage location, as (path relative to the stage, bytes)"""
+        prefix = _stage_path(location)
+        stage = prefix.split("/", 1)[0]
+        return [(path[len(stage) + 1:], data) for path, data in sorted(self._stage_files.items())
+                if path.startswith(prefix)]
+
+    def _staged_lines(self, location, format_name):
+        """Staged files under a location as (path, [(line number, fields)]), header skipped, NULLs as None"""
+        nulls = _FILE_FORMAT_NULLS[_DATABASE_PREFIX.sub("", format_name).upper()]
+        files = []
+        for path, data in self._staged(location):
+            if path.endswith(".gz"):
+                data = gzip.decompress(data)
+            lines = list(csv.reader(io.StringIO(data.decode("utf-8-sig")), quotechar='"'))
+            files.append((path, [(line_number, [None if f in nulls else f for f in fields])
+                                 for line_number, fields in enumerate(lines[1:], start=2) if fields]))
+        return files
+
+    def _load_staged_source(self, match):
+        """Fill temp._merge_source with the fields a staged SELECT picks from every line"""
+        distinct, select, location, format_name = match.groups()
+        items, names = zip(*(re.split(r"\s+as\s+", item.strip(), flags=re.IGNORECASE)
+                             for item in select.split(",")))
+        rows = [tuple(_copy_value(item, path, line_number, fields) for item in items)
+                for path, lines in self._staged_lines(location, format_name)
+                for line_number, fields in lines]
+        if distinct:
+            rows = list(dict.fromkeys(rows))
+        self._conn.execute(f"CREATE TEMP TABLE _merge_source ({', '.join(names)})")
+        self._conn.executemany(
+            f"INSERT INTO _merge_source VALUES ({', '.join('?' for _ in names)})", rows
+        )
+
+    def _copy_into(self, match):
+        """Run COPY INTO t (columns) FROM (SELECT ... FROM @stage/path/) FILE_FORMAT = (FORMAT_NAME = ...)
+
+        Covers the transforming loads of participant_import.py: string
+        literals, METADATA$FILENAME, METADATA$FILE_ROW_NUMBER and $n
+        fields, read with one of the CSV file formats. A line whose field
+        count does not match is an error; with ON_ERROR = 'CONTINUE' it is
+        skipped and counted, otherwise nothing is loaded.
+        """
+        table, columns, select, location, options = match.groups()
+        table = _DATABASE_PREFIX.sub("", table)
+        format_name = _FORMAT_NAME.search(options)
+        on_error = _ON_ERROR.search(options)
+        on_error = on_error.group(1).upper() if on_error else "ABORT_STATEMENT"
+        items = [item.strip() for item in select.split(",")]
+        width = max((int(item[1:]) for item in items if item.startswith("$")), default=0)
+        placeholders = ", ".join("?" for _ in items)
+        rows, results = [], []
+        for path, lines in self._staged_lines(location, format_name.group(1)):
+            loaded, errors, first_error, first_error_line = 0, 0, None, None
+            for line_number, fields in lines:
+                if len(fields) != width:
+                    errors += 1
+                    if first_error is None:
+                        first_error = (f"Number of columns in file ({len(fields)}) does not match"
+                                       f" that of the corresponding table ({width})")
+                        first_error_line = line_number
+                    continue
+                rows.append([_copy_value(item, path, line_number, fields) for item in items])
+                loaded += 1
+            if errors and on_error != "CONTINUE":
+                raise sqlite3.DataError(f"{first_error} (file {path}, line {first_error_line})")
+            status = "LOADED" if not errors else "PARTIALLY_LOADED" if loaded else "LOAD_FAILED"
+            results.append((path, status, loaded + errors, loaded, loaded + errors + 1, errors,
+                            first_error, first_error_line))
+        if rows:
+            # One transaction for the whole load, as COPY is one statement
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        if results:
+            self._touch(table)
+        return ["file", "status", "rows_parsed", "rows_loaded", "error_limit", "errors_seen",
+                "first_error", "first_error_line"], results
+
+    def _remove(self, location):
+        removed = [path for path, _ in self._staged(location)]
+        prefix = _stage_path(location).split("/", 1)[0]
+        for path in removed:
+            del self._stage_files[f"{prefix}/{path}"]
+        return ["name", "result"], [(path, "removed") for path in removed]
+
+    def _execute_batches(self, query, params, batch_size):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.query_count += 1
+            cursor = self._conn.execute(translate(self._rewrite_search(query)), params or ())
+            fields = [column[0].upper() for column in cursor.description]
+        while True:
+            # Fetch under the lock one batch at a time so other queries interleave
+            with self._lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield fields, rows
+
+    def write_pandas(self, df, table_name, database=None, schema=None, auto_create_table=False,
+                     overwrite=False, **kwargs):
+        """Append a DataFrame to an existing table, as one statement like Snowpark's bulk load"""
+        if auto_create_table or overwrite:
+            raise NotImplementedError("local write_pandas only appends to existing tables")
+        table = f"{(schema or DEFAULT_SCHEMA).upper()}.{table_name.upper()}"
+        columns = ", ".join(df.columns)
+        placeholders = ", ".join("?" for _ in df.columns)
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.query_count += 1
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            self._touch(table)
+
+    def close(self):
+        self._conn.close()
+
+
+def _stage_path(location):
+    """@CLINICAL_RESEARCH.STAGING.IMPORT_STAGE/a/b -> STAGING.IMPORT_STAGE/a/b"""
+    stage, _, path = location.lstrip("@").partition("/")
+    return f"{_DATABASE_PREFIX.sub('', stage).upper()}/{path}"
+
+
+def _copy_value(item, path, line_number, fields):
+    if item.startswith("'"):
+        return item[1:-1].replace("''", "'")
+    if item.upper() == "METADATA$FILENAME":
+        return path
+    if item.upper() == "METADATA$FILE_ROW_NUMBER":
+        return line_number
+    return fields[int(item[1:]) - 1]
+
+
+class LocalFileOperation:
+    """session.file: uploads to named stages, kept in memory"""
+
+    def __init__(self, session):
+        self._session = session
+
+    def put_stream(self, input_stream, stage_location, parallel=4, auto_compress=True,
+                   source_compression="AUTO_DETECT", overwrite=False):
+        path = _stage_path(stage_location)
+        data = input_stream.read()
+        if auto_compress and not path.endswith(".gz"):
+            path, data = path + ".gz", gzip.compress(data)
+        with self._session._lock:
+            if path in self._session._stage_files and not overwrite:
+                return {"target": path.rsplit("/", 1)[-1], "status": "SKIPPED"}
+            self._session._stage_files[path] = data
+        return {"target": path.rsplit("/", 1)[-1], "status": "UPLOADED"}
+
+
+_shared_session = None
+_shared_lock = threading.Lock()
+
+
+def shared_session():
+    """Process-wide LocalSession, so Streamlit reruns and benchmarks see the same data"""
+    global _shared_session
+    with _shared_lock:
+        if _shared_session is None:
+            latency = float(os.environ.get("CLINICAL_RESEARCH_LOCAL_LATENCY_MS", "0")) / 1000
+            _shared_session = LocalSession.from_scripts(latency=latency)
+        return _shared_session
@@ -0,0 +1,119 @@
+"""
+Typed measurement values, parsed once at ingestion
+
+OBSERVATIONS.measurement_value stays the text that was entered. Every
+write path also fills three typed columns from it:
+
+    measurement_value_num        the value as a FLOAT when it is a plain number
+    measurement_unit_normalized  the unit as its UNITS_OF_MEASURE abbreviation
+    value_parse_status           NUMERIC, TEXT (e.g. "120/80", "<5") or MISSING
+
+Reports and range checks then compare native numbers. Snowflake keeps
+min/max metadata per micro-partition for the FLOAT column, so range
+predicates prune instead of casting every row. BACKFILL_STATEMENT derives
+the same values set-based for rows written without them (existing data,
+or saves journaled by an older app version). It uses the same number
+pattern and unit lookup, so both paths agree.
+"""
+
+import re
+from functools import lru_cache
+
+import pandas as pd
+
+NUMERIC = "NUMERIC"
+TEXT = "TEXT"
+MISSING = "MISSING"
+
+TYPED_COLUMNS = ["measurement_value_num", "measurement_unit_normalized", "value_parse_status"]
+
+# A plain decimal number, optionally signed or in exponent notation; no
+# thousands separators, ranges or comparison signs
+NUMBER_PATTERN = r"[+-]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][+-]?[0-9]+)?"
+
+_NUMBER = re.compile(NUMBER_PATTERN)
+
+BACKFILL_STATEMENT = f"""
+UPDATE CLINICAL_RESEARCH.RESEARCH_DATA.OBSERVATIONS AS o
+SET measurement_value_num = t.measurement_value_num,
+    measurement_unit_normalized = t.measurement_unit_normalized,
+    value_parse_status = t.value_parse_status
+FROM (
+    SELECT
+        obs.observation_id,
+        CASE WHEN RLIKE(TRIM(obs.measurement_value), '{NUMBER_PATTERN}')
+            THEN TRY_TO_DOUBLE(TRIM(obs.measurement_value)) END as measurement_value_num,
+        COALESCE(u.unit_abbreviation, NULLIF(TRIM(obs.measurement_unit), '')) as measurement_unit_normalized,
+        CASE
+            WHEN NULLIF(TRIM(obs.measurement_value), '') IS NULL THEN '{MISSING}'
+            WHEN RLIKE(TRIM(obs.measurement_value), '{NUMBER_PATTERN}') THEN '{NUMERIC}'
+            ELSE '{TEXT}'
+        END as value_parse_status
+    FROM CLINICAL_RESEARCH.RESEARCH_DATA.OBSERVATIONS obs
+    LEFT JOIN (
+        SELECT UPPER(unit_abbreviation) as unit_key, unit_abbreviation
+        FROM CLINICAL_RESEARCH.REFERENCE_DATA.UNITS_OF_MEASURE WHERE is_active
+        UNION
+        SELECT UPPER(unit_name), unit_abbreviation
+        FROM CLINICAL_RESEARCH.REFERENCE_DATA.UNITS_OF_MEASURE WHERE is_active
+    ) u ON u.unit_key = UPPER(TRIM(obs.measurement_unit))
+    WHERE obs.value_parse_status IS NULL
+) t
+WHERE o.observation_id = t.observation_id
+"""
+
+
+@lru_cache(maxsize=4)
+def unit_lookup(snapshot):
+    """Upper-cased unit abbreviations and names -> abbreviation, from a reference snapshot"""
+    units = {}
+    for unit in snapshot.rows("UNITS_OF_MEASURE"):
+        if unit.unit_abbreviation:
+            units.setdefault(unit.unit_abbreviation.upper(), unit.unit_abbreviation)
+            if unit.unit_name:
+                units.setdefault(unit.unit_name.upper(), unit.unit_abbreviation)
+    return units
+
+
+def parse_value(value):
+    """(number or None, parse status) for a measurement value"""
+    text = "" if value is None else str(value).strip()
+    if not text:
+        return None, MISSING
+    if _NUMBER.fullmatch(text):
+        return float(text), NUMERIC
+    return None, TEXT
+
+
+def normalize_unit(unit, units):
+    text = "" if unit is None else str(unit).strip()
+    return units.get(text.upper(), text) if text else None
+
+
+def add_typed_values(rows, units):
+    """Fill the typed columns of observation rows (dicts) in place; returns rows"""
+    for row in rows:
+        number, status = parse_value(row.get("measurement_value"))
+        row["measurement_value_num"] = number
+        row["measurement_unit_normalized"] = normalize_unit(row.get("measurement_unit"), units)
+        row["value_parse_status"] = status
+    return rows
+
+
+def _stripped(column):
+    return column.astype(object).where(column.notna(), "").astype(str).str.strip()
+
+
+def add_typed_columns(frame, units):
+    """Fill the typed columns of an observation DataFrame in place, column-wise; returns frame"""
+    text = _stripped(frame["measurement_value"])
+    numeric = text.str.fullmatch(NUMBER_PATTERN)
+    frame["measurement_value_num"] = pd.to_numeric(text.where(numeric), errors="coerce")
+    status = pd.Series(TEXT, index=frame.index, dtype=object)
+    status[numeric] = NUMERIC
+    status[text == ""] = MISSING
+    frame["value_parse_status"] = status
+    unit = _stripped(frame["measurement_unit"])
+    normalized = unit.str.upper().map(units).fillna(unit)
+    frame["measurement_unit_normalized"] = normalized.where(normalized != "", None)
+    return frame
@@ -0,0 +1,125 @@
+"""
+Tag facets and tag filters over research notes
+
+Notes carry their tags in the RESEARCH_NOTES.tags ARRAY. Filtering on that
+column (ARRAY_CONTAINS) has to read the tags of every note in the window,
+so NOTE_TAGS (sql/11_note_tags.sql) holds one row per tag and note, kept in
+step with the notes by a task. A tag filter reads only the rows of the
+selected tags:
+
+    notes with all of tags t1..tn = note_ids under t1..tn having n rows
+
+and the facet counts are the tags of those notes, counted from the same
+table. Without a selection the counts cover every tagged note in the date
+window. Notes saved in the app are indexed right after the save
+(index_statements), so counts and filters see their tags at once; the
+task covers notes changed elsewhere and a failed indexing after a save.
+
+Tags are lower-cased, with runs of other characters than letters, digits,
+'-' and '_' collapsed to '-', so "Dose Change" and "dose-change" are one
+tag. The query text is the same for every filter: unused tag slots are
+bound as NULL.
+"""
+
+import re
+
+MAX_TAGS = 5
+MAX_TAGS_PER_NOTE = 20
+MAX_TAG_LENGTH = 50
+FACET_LIMIT = 50
+
+# Note keys per indexing statement
+MAX_INDEX_IDS = 1000
+
+# Result order, for keyset pagination
+KEYS = ("note_date", "note_id")
+
+_SEPARATOR = re.compile(r"[^a-z0-9_-]+")
+
+_TAG_SLOTS = ", ".join("?" for _ in range(MAX_TAGS))
+
+# Notes having every selected tag: each has one NOTE_TAGS row per selected tag
+_MATCHES = f"""
+    SELECT note_id
+    FROM CLINICAL_RESEARCH.RESEARCH_DATA.NOTE_TAGS
+    WHERE tag IN ({_TAG_SLOTS})
+    AND note_date >= ?
+    GROUP BY note_id
+    HAVING COUNT(*) = ?
+"""
+
+FACET_QUERY = f"""
+SELECT t.tag, COUNT(*) as note_count
+FROM CLINICAL_RESEARCH.RESEARCH_DATA.NOTE_TAGS t
+JOIN ({_MATCHES}) m ON t.note_id = m.note_id
+GROUP BY t.tag
+ORDER BY note_count DESC, t.tag
+LIMIT {FACET_LIMIT}
+"""
+
+# Facet counts before any tag is selected
+ALL_FACETS_QUERY = f"""
+SELECT tag, COUNT(*) as note_count
+FROM CLINICAL_RESEARCH.RESEARCH_DATA.NOTE_TAGS
+WHERE note_date >= ?
+GROUP BY tag
+ORDER BY note_count DESC, tag
+LIMIT {FACET_LIMIT}
+"""
+
+TAGGED_NOTES_QUERY = f"""
+SELECT n.note_id, n.note_title, n.note_type, s.study_name, n.participant_id, n.note_date,
+    ARRAY_TO_STRING(n.tags, ', ') as tags
+FROM ({_MATCHES}) m
+JOIN CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES n ON n.note_id = m.note_id
+LEFT JOIN CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES s ON n.study_id = s.study_id
+"""
+
+
+def normalize_tag(text):
+    """A tag as stored, or '' if nothing of it is left"""
+    return _SEPARATOR.sub("-", (text or "").strip().lower()).strip("-")[:MAX_TAG_LENGTH]
+
+
+def parse_tags(text):
+    """Distinct tags of a comma-separated entry, in order, at most MAX_TAGS_PER_NOTE"""
+    tags = (normalize_tag(part) for part in (text or "").split(","))
+    return list(dict.fromkeys(tag for tag in tags if tag))[:MAX_TAGS_PER_NOTE]
+
+
+def _match_params(tags, date_from):
+    tags = list(tags)
+    return tags + [None] * (MAX_TAGS - len(tags)) + [date_from.isoformat(), len(tags)]
+
+
+def facet_query(tags, date_from):
+    """Query and bind parameters counting the tags of the notes having all of tags (any, if none)"""
+    if not tags:
+        return ALL_FACETS_QUERY, [date_from.isoformat()]
+    return FACET_QUERY, _match_params(tags, date_from)
+
+
+def tagged_notes_params(tags, date_from):
+    """Bind parameters of TAGGED_NOTES_QUERY for 1 to MAX_TAGS tags"""
+    return _match_params(tags, date_from)
+
+
+def index_statements(note_ids):
+    """Yield (query, params) statements rebuilding the NOTE_TAGS rows of saved notes
+
+    The rows of each chunk of notes are deleted and inserted again from the
+    notes' current tags, so run the statements in one transaction.
+    """
+    note_ids = list(note_ids)
+    for start in range(0, len(note_ids), MAX_INDEX_IDS):
+        chunk = note_ids[start:start + MAX_INDEX_IDS]
+        slots = ", ".join("?" for _ in chunk)
+        yield f"DELETE FROM CLINICAL_RESEARCH.RESEARCH_DATA.NOTE_TAGS WHERE note_id IN ({slots})", chunk
+        yield f"""
+            INSERT INTO CLINICAL_RESEARCH.RESEARCH_DATA.NOTE_TAGS (tag, note_id, study_id, note_date)
+            SELECT DISTINCT f.value::STRING as tag, n.note_id, n.study_id, n.note_date
+            FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES n,
+            LATERAL FLATTEN(input => n.tags) f
+            WHERE n.note_id IN ({slots})
+            AND f.value::STRING <> ''
+        """, chunk
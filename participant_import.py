@@ -0,0 +1,223 @@
+"""
+Bulk participant enrollment from CSV files
+
+An import puts its files on STAGING.IMPORT_STAGE under its own import ID,
+loads them with one COPY INTO STAGING.PARTICIPANT_IMPORT (ON_ERROR =
+CONTINUE, so unreadable lines are counted instead of failing the load),
+validates every staged row with one set-based UPDATE that records a
+reject reason, and enrolls the remaining rows with one insert-only MERGE
+into PARTICIPANTS. However many participants a batch holds, PARTICIPANTS
+is written once, so STUDY_ENROLLMENT refreshes once per batch.
+"""
+
+import io
+import re
+from collections import namedtuple
+
+from id_generator import ENCODING, new_id
+
+STAGE = "@CLINICAL_RESEARCH.STAGING.IMPORT_STAGE"
+STAGING_TABLE = "CLINICAL_RESEARCH.STAGING.PARTICIPANT_IMPORT"
+FILE_FORMAT = "CLINICAL_RESEARCH.REFERENCE_DATA.CSV_FORMAT"
+
+# Columns of an import file, in order; the header row is skipped by CSV_FORMAT
+IMPORT_COLUMNS = [
+    "participant_number", "enrollment_date", "consent_date", "consent_version", "demographic_group",
+    "inclusion_criteria_met", "exclusion_criteria_met", "randomization_arm",
+]
+
+# Column widths from sql/02_create_tables.sql
+_MAX_LENGTHS = {"participant_number": 100, "consent_version": 50, "demographic_group": 100,
+                "randomization_arm": 100}
+
+FileReport = namedtuple("FileReport", [
+    "file_name", "rows_parsed", "rows_loaded", "rows_accepted", "rows_rejected", "first_error",
+])
+
+ImportResult = namedtuple("ImportResult", ["import_id", "files", "rejects", "enrolled"])
+
+# COPY takes no bind variables: the stage path is part of the statement
+# text, so the import ID is formatted in, and only after copy_statement has
+# checked that it is an ID new_id made
+_IMPORT_ID = re.compile(rf"IMP_[{ENCODING}]{{26}}")
+
+COPY_STATEMENT = """
+COPY INTO {table} (import_id, file_name, file_row_number, {columns})
+FROM (
+    SELECT '{import_id}', METADATA$FILENAME, METADATA$FILE_ROW_NUMBER, {fields}
+    FROM {stage}/{import_id}/
+)
+FILE_FORMAT = (FORMAT_NAME = '{file_format}')
+ON_ERROR = 'CONTINUE'
+"""
+
+_LENGTH_CHECKS = "\n".join(
+    f"            WHEN LENGTH(s.{column}) > {limit} THEN '{column} is longer than {limit} characters'"
+    for column, limit in _MAX_LENGTHS.items()
+)
+
+# Each staged row gets the first reason it cannot be enrolled, or NULL
+VALIDATE_STATEMENT = f"""
+UPDATE {STAGING_TABLE} AS i
+SET reject_reason = v.reject_reason
+FROM (
+    SELECT
+        s.file_name,
+        s.file_row_number,
+        CASE
+            WHEN s.participant_number IS NULL THEN 'Missing participant number'
+{_LENGTH_CHECKS}
+            WHEN TRY_TO_DATE(s.enrollment_date) IS NULL THEN 'Missing or invalid enrollment date'
+            WHEN TRY_TO_DATE(s.consent_date) IS NULL THEN 'Missing or invalid consent date'
+            WHEN TRY_TO_DATE(s.enrollment_date) > CURRENT_DATE() THEN 'Enrollment date is in the future'
+            WHEN TRY_TO_DATE(s.consent_date) > TRY_TO_DATE(s.enrollment_date) THEN 'Consent date is after the enrollment date'
+            WHEN s.inclusion_criteria_met IS NOT NULL AND TRY_TO_BOOLEAN(s.inclusion_criteria_met) IS NULL
+                THEN 'inclusion_criteria_met is not true or false'
+            WHEN s.exclusion_criteria_met IS NOT NULL AND TRY_TO_BOOLEAN(s.exclusion_criteria_met) IS NULL
+                THEN 'exclusion_criteria_met is not true or false'
+            WHEN COUNT(*) OVER (PARTITION BY s.participant_number) > 1 THEN 'Participant number appears more than once in this import'
+            WHEN p.participant_id IS NOT NULL THEN 'Already enrolled in this study'
+        END as reject_reason
+    FROM {STAGING_TABLE} s
+    LEFT JOIN CLINICAL_RESEARCH.RESEARCH_DATA.PARTICIPANTS p
+        ON p.study_id = ? AND p.participant_number = s.participant_number
+    WHERE s.import_id = ?
+) v
+WHERE i.import_id = ? AND i.file_name = v.file_name AND i.file_row_number = v.file_row_number
+"""
+
+# Participant IDs are the import's ULID plus a sequence number, so a batch
+# sorts by creation time like single enrollments do
+MERGE_STATEMENT = f"""
+MERGE INTO CLINICAL_RESEARCH.RESEARCH_DATA.PARTICIPANTS t
+USING (
+    SELECT
+        ? || '_' || LPAD(ROW_NUMBER() OVER (ORDER BY file_name, file_row_number), 6, '0') as participant_id,
+        ? as study_id,
+        participant_number,
+        TRY_TO_DATE(enrollment_date) as enrollment_date,
+        TRY_TO_DATE(consent_date) as consent_date,
+        consent_version,
+        demographic_group,
+        COALESCE(TRY_TO_BOOLEAN(inclusion_criteria_met), TRUE) as inclusion_criteria_met,
+        COALESCE(TRY_TO_BOOLEAN(exclusion_criteria_met), FALSE) as exclusion_criteria_met,
+        randomization_arm,
+        OBJECT_CONSTRUCT('import_id', import_id, 'source_file', file_name, 'source_row', file_row_number) as metadata
+    FROM {STAGING_TABLE}
+    WHERE import_id = ? AND reject_reason IS NULL
+) s
+ON t.study_id = s.study_id AND t.participant_number = s.participant_number
+WHEN NOT MATCHED THEN INSERT (participant_id, study_id, participant_number, enrollment_date, consent_date,
+    consent_version, demographic_group, inclusion_criteria_met, exclusion_criteria_met, randomization_arm,
+    participant_status, metadata)
+VALUES (s.participant_id, s.study_id, s.participant_number, s.enrollment_date, s.consent_date,
+    s.consent_version, s.demographic_group, s.inclusion_criteria_met, s.exclusion_criteria_met, s.randomization_arm,
+    'ACTIVE', s.metadata)
+"""
+
+FILE_COUNTS_QUERY = f"""
+SELECT file_name, COUNT_IF(reject_reason IS NULL) as accepted, COUNT_IF(reject_reason IS NOT NULL) as rejected
+FROM {STAGING_TABLE}
+WHERE import_id = ?
+GROUP BY file_name
+"""
+
+REJECTS_QUERY = f"""
+SELECT file_name, file_row_number, participant_number, reject_reason
+FROM {STAGING_TABLE}
+WHERE import_id = ? AND reject_reason IS NOT NULL
+ORDER BY file_name, file_row_number
+LIMIT 1000
+"""
+
+CLEANUP_STATEMENT = f"DELETE FROM {STAGING_TABLE} WHERE import_id = ?"
+
+
+def template_csv():
+    """An empty import file with the expected header"""
+    return ",".join(IMPORT_COLUMNS) + "\n"
+
+
+def check_header(data):
+    """Error message if a file's header row is not IMPORT_COLUMNS, else None
+
+    COPY maps fields by position, so a reordered or renamed column would
+    load silently into the wrong place.
+    """
+    header = data.split(b"\n", 1)[0].decode("utf-8-sig", errors="replace").strip()
+    names = [name.strip().strip('"').lower() for name in header.split(",")]
+    if names != IMPORT_COLUMNS:
+        return f"expected the columns {', '.join(IMPORT_COLUMNS)}"
+    return None
+
+
+def _staged_name(name, used):
+    """Stage-safe file name, unique within the import"""
+    base = re.sub(r"[^\w.-]", "_", name) or "participants.csv"
+    staged, n = base, 1
+    while staged in used:
+        n += 1
+        staged = f"{n}_{base}"
+    used.add(staged)
+    return staged
+
+
+def _display_name(staged_path, import_id):
+    """METADATA$FILENAME / COPY file column -> the name the file was staged under"""
+    name = staged_path.split(f"{import_id}/", 1)[-1]
+    return name[:-3] if name.endswith(".gz") else name
+
+
+def copy_statement(import_id):
+    """COPY INTO the staging table of the files staged under import_id"""
+    if not _IMPORT_ID.fullmatch(import_id):
+        raise ValueError(f"Not an import ID: {import_id!r}")
+    return COPY_STATEMENT.format(
+        table=STAGING_TABLE, columns=", ".join(IMPORT_COLUMNS), import_id=import_id,
+        fields=", ".join(f"${i}" for i in range(1, len(IMPORT_COLUMNS) + 1)),
+        stage=STAGE, file_format=FILE_FORMAT,
+    )
+
+
+def _lower_keys(row):
+    return {key.lower(): value for key, value in row.as_dict().items()}
+
+
+def import_participants(session, execute, study_id, files):
+    """Enroll the participants in CSV files into a study
+
+    files is a list of (file name, bytes); execute(query, params) runs one
+    statement and returns its rows. Returns an ImportResult with a
+    FileReport per file (COPY errors count as rejected rows), the rejected
+    rows with their reasons, and the number of participants enrolled.
+    """
+    import_id = new_id("IMP")
+    used = set()
+    for name, data in files:
+        session.file.put_stream(io.BytesIO(data), f"{STAGE}/{import_id}/{_staged_name(name, used)}",
+                                auto_compress=True, overwrite=True)
+    try:
+        copy_results = [_lower_keys(row) for row in execute(copy_statement(import_id))]
+        execute(VALIDATE_STATEMENT, [study_id, import_id, import_id])
+        counts = {_display_name(row[0], import_id): (row[1], row[2])
+                  for row in execute(FILE_COUNTS_QUERY, [import_id])}
+        rejects = [(_display_name(row[0], import_id), row[1], row[2], row[3])
+                   for row in execute(REJECTS_QUERY, [import_id])]
+        merged = execute(MERGE_STATEMENT, [new_id("PART"), study_id, import_id])
+        enrolled = _lower_keys(merged[0]).get("number of rows inserted", 0) if merged else 0
+    finally:
+        execute(CLEANUP_STATEMENT, [import_id])
+        execute(f"REMOVE {STAGE}/{import_id}/")
+    reports = []
+    for result in copy_results:
+        name = _display_name(result.get("file", ""), import_id)
+        accepted, rejected = counts.get(name, (0, 0))
+        reports.append(FileReport(
+            file_name=name,
+            rows_parsed=result.get("rows_parsed") or 0,
+            rows_loaded=result.get("rows_loaded") or 0,
+            rows_accepted=accepted,
+            rows_rejected=rejected + (result.get("errors_seen") or 0),
+            first_error=result.get("first_error"),
+        ))
+    return ImportResult(import_id, reports, rejects, enrolled)
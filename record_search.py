@@ -0,0 +1,181 @@
+"""
+Ranked full-text search over notes, findings, observations and comments
+
+SEARCH_DOCUMENTS (sql/10_search_documents.sql) holds the text of every
+record with its owning study and participant, and has FULL_TEXT search
+optimization on its title and body. SEARCH() finds the documents
+containing any of the search terms through that index, so only
+micro-partitions with a match are read. A task keeps the documents in
+step with their records; the local backend keeps an inverted index in
+step with triggers. The newest MAX_CANDIDATES matches in the date window
+are ranked together, whatever their type, with BM25:
+
+    score = sum over terms of idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average length))
+    idf   = ln(1 + (N - df + 0.5) / (df + 0.5))
+
+tf counts a term in one document, and df counts the candidates containing
+it. df is exact unless a common term fills the candidate cap; it is then
+undercounted, which only narrows the gap between the idf of common and
+rare terms. The cap keeps ranking cost flat however many documents match.
+N and the average document length (in characters) come from the per-study,
+per-day DOCUMENTS and DOCUMENT_LENGTH counters in DASHBOARD_METRICS, so
+ranking never scans the documents outside the candidates. The row access
+policy limits them to the studies the reader can see, like the documents.
+
+REFRESH_SEARCH_DOCUMENTS runs every minute. Records saved in the app are
+also indexed right after the save (index_statements), so they can be
+found at once; the task's later run rebuilds the same documents.
+
+Terms are lower-cased runs of letters and digits. The query text is the
+same for every search: unused term and type slots are bound as NULL. It
+returns the ranked documents unordered; pages come from keyset.page_query
+on KEYS.
+"""
+
+import re
+
+K1 = 1.2
+B = 0.75
+
+MAX_TERMS = 8
+MAX_CANDIDATES = 5000
+
+# Record keys per indexing statement
+MAX_INDEX_IDS = 1000
+
+# Document types, as written by REFRESH_SEARCH_DOCUMENTS
+DOC_TYPES = ("NOTE", "FINDING", "OBSERVATION", "COMMENT")
+
+# Result order, for keyset pagination
+KEYS = ("relevance", "doc_date", "doc_type", "record_id")
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+_TERM_SLOTS = ", ".join("(?)" for _ in range(MAX_TERMS))
+_TYPE_SLOTS = ", ".join("?" for _ in DOC_TYPES)
+
+# Tokens are separated by two spaces and padded by two, so ' term ' matches
+# each occurrence of a token on its own, including back-to-back repeats
+SEARCH_QUERY = f"""
+WITH stats AS (
+    SELECT
+        SUM(CASE WHEN metric_name = 'DOCUMENTS' THEN metric_value END) as doc_count,
+        SUM(CASE WHEN metric_name = 'DOCUMENT_LENGTH' THEN metric_value::FLOAT END)
+            / NULLIF(SUM(CASE WHEN metric_name = 'DOCUMENTS' THEN metric_value END), 0) as average_length
+    FROM CLINICAL_RESEARCH.RESEARCH_DATA.DASHBOARD_METRICS
+    WHERE metric_name IN ('DOCUMENTS', 'DOCUMENT_LENGTH') AND metric_date >= ?
+),
+candidates AS (
+    SELECT
+        d.doc_type, d.record_id, d.title, s.study_name, d.participant_id, d.doc_date, d.doc_length,
+        '  ' || REGEXP_REPLACE(LOWER(COALESCE(d.title, '') || ' ' || COALESCE(d.body, '')), '[^a-z0-9]+', '  ') || '  ' as tokens
+    FROM CLINICAL_RESEARCH.RESEARCH_DATA.SEARCH_DOCUMENTS d
+    LEFT JOIN CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES s ON d.study_id = s.study_id
+    WHERE d.doc_date >= ?
+    AND d.doc_type IN ({_TYPE_SLOTS})
+    AND SEARCH((d.title, d.body), ?)
+    ORDER BY d.doc_date DESC, d.record_id DESC
+    LIMIT {MAX_CANDIDATES}
+),
+term_counts AS (
+    SELECT
+        c.doc_type, c.record_id, c.title, c.study_name, c.participant_id, c.doc_date, c.doc_length,
+        t.term, REGEXP_COUNT(c.tokens, ' ' || t.term || ' ') as tf
+    FROM candidates c
+    CROSS JOIN (SELECT column1 as term FROM (VALUES {_TERM_SLOTS})) t
+    WHERE t.term IS NOT NULL
+),
+weights AS (
+    SELECT tc.*, COUNT(*) OVER (PARTITION BY tc.term) as df
+    FROM term_counts tc
+    WHERE tc.tf > 0
+)
+SELECT
+    w.doc_type, w.record_id, w.title, w.study_name, w.participant_id, w.doc_date,
+    ROUND(SUM(
+        LN(1 + (CASE WHEN st.doc_count > w.df THEN st.doc_count ELSE w.df END - w.df + 0.5) / (w.df + 0.5))
+        * w.tf * {K1 + 1} / (w.tf + {K1} * (1 - {B} + {B} * w.doc_length / COALESCE(st.average_length, w.doc_length)))
+    ), 3) as relevance
+FROM weights w
+CROSS JOIN stats st
+GROUP BY w.doc_type, w.record_id, w.title, w.study_name, w.participant_id, w.doc_date
+"""
+
+# The latest documents, for a search without terms
+LATEST_QUERY = f"""
+SELECT d.doc_type, d.record_id, d.title, s.study_name, d.participant_id, d.doc_date
+FROM CLINICAL_RESEARCH.RESEARCH_DATA.SEARCH_DOCUMENTS d
+LEFT JOIN CLINICAL_RESEARCH.RESEARCH_DATA.STUDIES s ON d.study_id = s.study_id
+WHERE d.doc_date >= ?
+AND d.doc_type IN ({_TYPE_SLOTS})
+"""
+
+LATEST_KEYS = ("doc_date", "doc_type", "record_id")
+
+# Documents of the tables the app writes, built as REFRESH_SEARCH_DOCUMENTS
+# builds them: table -> (key column, document query)
+DOCUMENT_SOURCES = {
+    "RESEARCH_NOTES": ("note_id", """
+        SELECT 'NOTE' as doc_type, note_id as record_id, study_id, participant_id,
+            note_title as title, note_text as body, note_date as doc_date
+        FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES"""),
+    "FINDINGS": ("finding_id", """
+        SELECT 'FINDING' as doc_type, finding_id as record_id, study_id, participant_id,
+            finding_type as title, COALESCE(finding_description, '') || ' ' || COALESCE(action_taken, '') as body,
+            TO_DATE(created_date) as doc_date
+        FROM CLINICAL_RESEARCH.RESEARCH_DATA.FINDINGS"""),
+    "OBSERVATIONS": ("observation_id", """
+        SELECT 'OBSERVATION' as doc_type, observation_id as record_id, study_id, participant_id,
+            observation_type as title, measurement_name as body, observation_date as doc_date
+        FROM CLINICAL_RESEARCH.RESEARCH_DATA.OBSERVATIONS"""),
+}
+
+
+def search_terms(text):
+    """Distinct search terms of a search box entry, in order, at most MAX_TERMS"""
+    return list(dict.fromkeys(_TOKEN.findall((text or "").lower())))[:MAX_TERMS]
+
+
+def _type_params(doc_types):
+    doc_types = list(doc_types or DOC_TYPES)
+    return doc_types + [None] * (len(DOC_TYPES) - len(doc_types))
+
+
+def search_params(terms, date_from, doc_types=None):
+    """Bind parameters of SEARCH_QUERY for terms (from search_terms), a date window start and document types"""
+    date_from = date_from.isoformat()
+    return ([date_from, date_from] + _type_params(doc_types) + [" ".join(terms)]
+            + terms + [None] * (MAX_TERMS - len(terms)))
+
+
+def latest_params(date_from, doc_types=None):
+    """Bind parameters of LATEST_QUERY"""
+    return [date_from.isoformat()] + _type_params(doc_types)
+
+
+def index_statements(table, record_ids):
+    """Yield (query, params) MERGEs upserting the documents of saved records of table
+
+    Yields nothing for a table without documents.
+    """
+    if table not in DOCUMENT_SOURCES:
+        return
+    key, source = DOCUMENT_SOURCES[table]
+    record_ids = list(record_ids)
+    for start in range(0, len(record_ids), MAX_INDEX_IDS):
+        chunk = record_ids[start:start + MAX_INDEX_IDS]
+        yield f"""
+            MERGE INTO CLINICAL_RESEARCH.RESEARCH_DATA.SEARCH_DOCUMENTS t
+            USING (
+                SELECT d.*, LENGTH(COALESCE(d.title, '')) + LENGTH(COALESCE(d.body, '')) as doc_length
+                FROM ({source}
+                    WHERE {key} IN ({', '.join('?' for _ in chunk)})) d
+            ) s
+            ON t.doc_type = s.doc_type AND t.record_id = s.record_id
+            WHEN MATCHED THEN UPDATE SET
+                study_id = s.study_id, participant_id = s.participant_id, title = s.title, body = s.body,
+                doc_date = s.doc_date, doc_length = s.doc_length, indexed_date = CURRENT_TIMESTAMP()
+            WHEN NOT MATCHED THEN INSERT
+                (doc_type, record_id, study_id, participant_id, title, body, doc_date, doc_length)
+            VALUES (s.doc_type, s.record_id, s.study_id, s.participant_id, s.title, s.body, s.doc_date, s.doc_length)
+        """, chunk
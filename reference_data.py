@@ -0,0 +1,191 @@
+"""
+Shared, immutable snapshot of the REFERENCE_DATA schema
+
+Every reference table from sql/03_reference_data.sql is pulled in a single
+UNION ALL query (one OBJECT_CONSTRUCT record per row) and turned into a
+ReferenceSnapshot: namedtuple records with interned strings, frozen JSON
+values and prebuilt lookup dicts. ReferenceDataStore holds the current
+snapshot for the whole process and swaps in a new one when the version
+stamp of the reference tables changes.
+
+USER_PREFERENCES is per-user data rather than a shared vocabulary and is
+not part of the snapshot.
+"""
+
+import json
+import sys
+import threading
+from collections import namedtuple
+from datetime import datetime
+from types import MappingProxyType
+
+# table -> (record name, [(column, kind)], indexed columns)
+# kind is 'str', 'int', 'float', 'bool' or 'json' (VARIANT/ARRAY columns)
+REFERENCE_TABLES = {
+    "STUDY_TYPES": ("StudyType", [
+        ("type_id", "str"), ("type_name", "str"), ("type_description", "str"),
+        ("regulatory_requirements", "str"), ("typical_duration_months", "int"), ("is_active", "bool"),
+    ], ["type_name"]),
+    "OBSERVATION_TYPES": ("ObservationType", [
+        ("obs_type_id", "str"), ("obs_type_name", "str"), ("obs_category", "str"),
+        ("common_measurements", "json"), ("standard_units", "json"), ("is_active", "bool"),
+    ], ["obs_type_name", "obs_category"]),
+    "NOTE_TYPES": ("NoteType", [
+        ("note_type_id", "str"), ("note_type_name", "str"), ("note_category", "str"),
+        ("requires_review", "bool"), ("template_text", "str"), ("is_active", "bool"),
+    ], ["note_type_name"]),
+    "FINDING_CLASSIFICATIONS": ("FindingClassification", [
+        ("classification_id", "str"), ("classification_name", "str"), ("classification_category", "str"),
+        ("severity_levels", "json"), ("reporting_requirements", "str"), ("is_active", "bool"),
+    ], ["classification_name"]),
+    "UNITS_OF_MEASURE": ("UnitOfMeasure", [
+        ("unit_id", "str"), ("unit_name", "str"), ("unit_category", "str"),
+        ("unit_abbreviation", "str"), ("conversion_to_si", "float"), ("si_unit", "str"), ("is_active", "bool"),
+    ], ["unit_abbreviation"]),
+    "NORMAL_RANGES": ("NormalRange", [
+        ("range_id", "str"), ("measurement_name", "str"), ("demographic_group", "str"),
+        ("lower_limit", "float"), ("upper_limit", "float"), ("unit", "str"),
+        ("interpretation_low", "str"), ("interpretation_high", "str"), ("source", "str"), ("is_active", "bool"),
+    ], ["measurement_name"]),
+    "VALIDATION_RULES": ("ValidationRule", [
+        ("rule_id", "str"), ("rule_name", "str"), ("applies_to", "str"), ("column_name", "str"),
+        ("rule_type", "str"), ("rule_definition", "json"), ("error_message", "str"),
+        ("severity", "str"), ("is_active", "bool"),
+    ], ["applies_to"]),
+    "FORM_TEMPLATES": ("FormTemplate", [
+        ("template_id", "str"), ("template_name", "str"), ("template_category", "str"),
+        ("study_type", "str"), ("form_structure", "json"), ("validation_rules", "json"),
+        ("help_text", "str"), ("is_active", "bool"),
+    ], ["template_name"]),
+    "MEDICAL_ABBREVIATIONS": ("MedicalAbbreviation", [
+        ("abbreviation", "str"), ("full_term", "str"), ("category", "str"),
+        ("definition", "str"), ("example_usage", "str"),
+    ], ["category"]),
+}
+
+RECORD_TYPES = {
+    table: namedtuple(record_name, [column for column, _ in columns])
+    for table, (record_name, columns, _) in REFERENCE_TABLES.items()
+}
+
+
+def _snapshot_query():
+    selects = []
+    for table, (_, columns, _) in REFERENCE_TABLES.items():
+        pairs = ", ".join(f"'{column}', {column}" for column, _ in columns)
+        selects.append(
+            f"SELECT '{table}' as table_name, OBJECT_CONSTRUCT({pairs}) as record\n"
+            f"FROM CLINICAL_RESEARCH.REFERENCE_DATA.{table}"
+        )
+    return "\nUNION ALL\n".join(selects)
+
+
+# One round trip for the whole schema
+SNAPSHOT_QUERY = _snapshot_query()
+
+
+def _freeze(value):
+    """Deep-freeze parsed JSON: dicts become read-only mappings, lists tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({sys.intern(k): _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+def _convert(value, kind):
+    if value is None:
+        return None
+    if kind == "json":
+        return _freeze(json.loads(value) if isinstance(value, str) else value)
+    if kind == "bool":
+        return bool(value)
+    if kind == "int":
+        return int(value)
+    if kind == "float":
+        return float(value)
+    return sys.intern(str(value))
+
+
+class ReferenceSnapshot:
+    """Immutable in-memory copy of every reference table with prebuilt lookups"""
+
+    __slots__ = ("version", "loaded_at", "_rows", "_by_key", "_indexes")
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.loaded_at = datetime.now()
+        self._rows = MappingProxyType(rows)
+        self._by_key = MappingProxyType({
+            table: MappingProxyType({record[0]: record for record in records})
+            for table, records in rows.items()
+        })
+        indexes = {}
+        for table, (_, _, indexed_columns) in REFERENCE_TABLES.items():
+            for column in indexed_columns:
+                index = {}
+                for record in rows[table]:
+                    index.setdefault(getattr(record, column), []).append(record)
+                indexes[(table, column)] = MappingProxyType({k: tuple(v) for k, v in index.items()})
+        self._indexes = MappingProxyType(indexes)
+
+    @classmethod
+    def from_rows(cls, result_rows, version):
+        """Build a snapshot from the (TABLE_NAME, RECORD) rows of SNAPSHOT_QUERY"""
+        records = {table: [] for table in REFERENCE_TABLES}
+        for row in result_rows:
+            table = row["TABLE_NAME"]
+            record = row["RECORD"]
+            record = json.loads(record) if isinstance(record, str) else record
+            # OBJECT_CONSTRUCT drops NULL values, so missing keys are NULLs
+            _, columns, _ = REFERENCE_TABLES[table]
+            values = [_convert(record.get(column), kind) for column, kind in columns]
+            records[table].append(RECORD_TYPES[table](*values))
+        return cls({table: tuple(rows) for table, rows in records.items()}, version)
+
+    def rows(self, table, active_only=True):
+        """All records of a table, optionally only the active ones"""
+        records = self._rows[table]
+        if active_only and "is_active" in RECORD_TYPES[table]._fields:
+            return tuple(record for record in records if record.is_active)
+        return records
+
+    def get(self, table, key):
+        """Record by primary key, or None"""
+        return self._by_key[table].get(key)
+
+    def lookup(self, table, column, value):
+        """Records whose indexed column equals value"""
+        return self._indexes[(table, column)].get(value, ())
+
+    def counts(self):
+        return {table: len(records) for table, records in self._rows.items()}
+
+
+class ReferenceDataStore:
+    """Process-wide holder of the current snapshot, hot-swapped on version change"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def get(self, version, load_rows):
+        """Return the snapshot for version, calling load_rows() to rebuild it if stale"""
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                try:
+                    snapshot = ReferenceSnapshot.from_rows(load_rows(), version)
+                except Exception:
+                    # Keep serving the previous snapshot if the reload fails
+                    if snapshot is None:
+                        raise
+                    return snapshot
+                # Readers holding the old snapshot keep a consistent view
+                self._snapshot = snapshot
+            return snapshot
@@ -0,0 +1,413 @@
+"""
+Streaming import of legacy study spreadsheets
+
+A workbook sheet (xlsx, read with openpyxl in read-only mode) or a CSV file
+is read row by row and cut into chunks of CHUNK_ROWS rows, so memory stays
+bounded by the chunk size rather than the sheet size. Each chunk is mapped
+onto the columns of OBSERVATIONS, PARTICIPANTS or FINDINGS and validated
+with column-wise pandas operations. Its valid rows are then written as a
+CSV file to STAGING.IMPORT_STAGE while the next chunk is being read, with
+up to PARALLEL_UPLOADS uploads in flight. Once the sheet has been read,
+one insert-only MERGE reads every chunk file in parallel on the warehouse,
+with REFERENCE_DATA.EXCEL_FORMAT, and inserts the rows whose ID is not in
+the table yet.
+
+Row IDs are content IDs of the study, the sheet and the row's values, so
+uploading a sheet again, or retrying an import whose result was lost,
+loads none of the rows twice; a row repeated within the sheet is loaded
+once. Rows that fail validation are reported and not loaded. The MERGE is
+one statement, so the rows that passed are loaded completely or not at
+all.
+"""
+
+import csv
+import io
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+import measurements
+from id_generator import content_id, new_id
+
+STAGE = "@CLINICAL_RESEARCH.STAGING.IMPORT_STAGE"
+FILE_FORMAT = "CLINICAL_RESEARCH.REFERENCE_DATA.EXCEL_FORMAT"
+
+CHUNK_ROWS = 50_000
+PARALLEL_UPLOADS = 4
+
+# Rejected rows kept for the report; all of them are counted
+MAX_REPORTED_REJECTS = 1000
+
+# kind is one of text, date, integer, boolean, or participant (a study
+# participant number, stored as the participant_id it maps to)
+ImportField = namedtuple("ImportField", ["column", "label", "kind", "required", "max_length", "aliases"])
+
+# derive(rows, units) adds derived_columns to a chunk of valid rows
+ImportTarget = namedtuple("ImportTarget", [
+    "table", "id_column", "id_prefix", "fields", "defaults", "derived_columns", "derive",
+])
+
+# rows_skipped are valid rows already in the table (or repeated in the sheet)
+ImportResult = namedtuple("ImportResult", [
+    "import_id", "rows_read", "rows_loaded", "rows_rejected", "rows_skipped", "rejects", "files", "seconds",
+])
+
+# Columns and widths from sql/02_create_tables.sql
+TARGETS = {
+    "Observations": ImportTarget(
+        table="RESEARCH_DATA.OBSERVATIONS",
+        id_column="observation_id",
+        id_prefix="OBS",
+        fields=(
+            ImportField("participant_id", "Participant", "participant", True, None,
+                        ("participant", "participant number", "subject", "subject id", "patient")),
+            ImportField("observation_date", "Observation Date", "date", True, None,
+                        ("date", "visit date", "collection date")),
+            ImportField("visit_number", "Visit Number", "integer", False, None, ("visit", "visit no")),
+            ImportField("visit_name", "Visit Name", "text", False, 100, ("timepoint",)),
+            ImportField("observation_type", "Observation Type", "text", False, 100, ("type",)),
+            ImportField("observation_category", "Category", "text", False, 100, ("category",)),
+            ImportField("measurement_name", "Measurement", "text", True, 255,
+                        ("test", "parameter", "measure", "test name")),
+            ImportField("measurement_value", "Value", "text", True, 500, ("result", "measurement value")),
+            ImportField("measurement_unit", "Unit", "text", False, 50, ("units", "uom")),
+            ImportField("normal_range", "Normal Range", "text", False, 100, ("reference range", "range")),
+            ImportField("clinically_significant", "Clinically Significant", "boolean", False, None, ("cs",)),
+        ),
+        defaults={},
+        derived_columns=measurements.TYPED_COLUMNS,
+        derive=measurements.add_typed_columns,
+    ),
+    "Participants": ImportTarget(
+        table="RESEARCH_DATA.PARTICIPANTS",
+        id_column="participant_id",
+        id_prefix="PART",
+        fields=(
+            ImportField("participant_number", "Participant Number", "text", True, 100,
+                        ("participant", "subject", "subject id", "study number")),
+            ImportField("enrollment_date", "Enrollment Date", "date", True, None, ("enrolled", "enrollment")),
+            ImportField("consent_date", "Consent Date", "date", True, None, ("consented", "consent")),
+            ImportField("consent_version", "Consent Version", "text", False, 50, ()),
+            ImportField("demographic_group", "Demographic Group", "text", False, 100, ("demographics", "group")),
+            ImportField("inclusion_criteria_met", "Inclusion Criteria Met", "boolean", False, None, ("inclusion",)),
+            ImportField("exclusion_criteria_met", "Exclusion Criteria Met", "boolean", False, None, ("exclusion",)),
+            ImportField("randomization_arm", "Randomization Arm", "text", False, 100, ("arm", "randomization")),
+            ImportField("participant_status", "Status", "text", False, 50, ("status",)),
+        ),
+        defaults={"inclusion_criteria_met": True, "exclusion_criteria_met": False, "participant_status": "ACTIVE"},
+        derived_columns=[],
+        derive=None,
+    ),
+    "Findings": ImportTarget(
+        table="RESEARCH_DATA.FINDINGS",
+        id_column="finding_id",
+        id_prefix="FND",
+        fields=(
+            ImportField("participant_id", "Participant", "participant", False, None,
+                        ("participant", "participant number", "subject", "subject id", "patient")),
+            ImportField("finding_type", "Finding Type", "text", False, 100, ("type",)),
+            ImportField("finding_category", "Category", "text", False, 100, ("category",)),
+            ImportField("finding_description", "Description", "text", True, None,
+                        ("finding", "event", "event description", "description")),
+            ImportField("severity", "Severity", "text", False, 50, ("grade",)),
+            ImportField("relationship_to_intervention", "Relationship", "text", False, 100,
+                        ("relationship", "causality")),
+            ImportField("action_taken", "Action Taken", "text", False, None, ("action",)),
+            ImportField("outcome", "Outcome", "text", False, 100, ()),
+            ImportField("outcome_date", "Outcome Date", "date", False, None, ()),
+            ImportField("sae_reported", "Serious (SAE)", "boolean", False, None, ("sae", "serious")),
+        ),
+        defaults={"sae_reported": False},
+        derived_columns=[],
+        derive=None,
+    ),
+}
+
+# Tried in order for text dates, as Snowflake's AUTO date format does
+DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%m/%d/%Y", "%d-%b-%Y")
+
+_BOOLEANS = {"true": True, "t": True, "yes": True, "y": True, "1": True, "x": True,
+             "false": False, "f": False, "no": False, "n": False, "0": False}
+
+
+def _is_xlsx(file_name):
+    return file_name.lower().endswith((".xlsx", ".xlsm"))
+
+
+def sheet_names(file_name, data):
+    """Worksheet names of an xlsx workbook; empty for CSV files"""
+    if not _is_xlsx(file_name):
+        return []
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def iter_sheet_rows(file_name, data, sheet=None):
+    """Yield the rows of a sheet (or CSV file) as tuples, header row first"""
+    if _is_xlsx(file_name):
+        import openpyxl
+
+        # read_only streams the sheet XML instead of building the whole workbook
+        workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        try:
+            worksheet = workbook[sheet] if sheet else workbook.active
+            for row in worksheet.iter_rows(values_only=True):
+                yield row
+        finally:
+            workbook.close()
+    else:
+        text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline="")
+        for row in csv.reader(text):
+            yield tuple(row)
+
+
+def _header(row):
+    names, seen = [], set()
+    for i, value in enumerate(row, start=1):
+        name = str(value).strip() if value is not None and str(value).strip() else f"Column {i}"
+        while name in seen:
+            name += f" ({i})"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def read_header(file_name, data, sheet=None):
+    """Column names from a sheet's first row"""
+    rows = iter_sheet_rows(file_name, data, sheet)
+    try:
+        return _header(next(rows, ()))
+    finally:
+        rows.close()
+
+
+def _normalize(name):
+    return " ".join(str(name).lower().replace("_", " ").replace("-", " ").split())
+
+
+def suggest_mapping(target, header):
+    """Best guess of the sheet column for each target column, or None"""
+    by_name = {_normalize(name): name for name in header}
+    mapping = {}
+    for field in target.fields:
+        candidates = (field.column, field.label) + field.aliases
+        mapping[field.column] = next(
+            (by_name[_normalize(c)] for c in candidates if _normalize(c) in by_name), None
+        )
+    return mapping
+
+
+def iter_chunks(rows, header, chunk_size=CHUNK_ROWS):
+    """Yield DataFrames of at most chunk_size rows, indexed by sheet row number
+
+    Blank rows are skipped; short rows are padded to the header width.
+    """
+    width = len(header)
+    chunk, numbers = [], []
+    for number, row in enumerate(rows, start=2):
+        if not any(value is not None and str(value).strip() != "" for value in row):
+            continue
+        row = tuple(row[:width]) + (None,) * (width - len(row))
+        chunk.append(row)
+        numbers.append(number)
+        if len(chunk) >= chunk_size:
+            yield pd.DataFrame(chunk, columns=header, index=numbers, dtype=object)
+            chunk, numbers = [], []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=header, index=numbers, dtype=object)
+
+
+def _cell_text(value):
+    if value is None:
+        return None
+    if isinstance(value, float):
+        if value != value:
+            return None
+        if value.is_integer():
+            return str(int(value))
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    text = str(value).strip()
+    return text or None
+
+
+def _parse_dates(text):
+    parsed = pd.Series(pd.NaT, index=text.index, dtype="datetime64[ns]")
+    for date_format in DATE_FORMATS:
+        remaining = parsed.isna() & text.notna()
+        if not remaining.any():
+            break
+        parsed[remaining] = pd.to_datetime(text[remaining], format=date_format, errors="coerce")
+    return parsed
+
+
+def _cell_boolean(value):
+    if isinstance(value, bool):
+        return value
+    text = _cell_text(value)
+    return None if text is None else _BOOLEANS.get(text.lower(), "invalid")
+
+
+class _Rejections:
+    """First rejection reason per row of a chunk"""
+
+    def __init__(self, index):
+        self.reasons = pd.Series(None, index=index, dtype=object)
+
+    def add(self, failed, reason):
+        if isinstance(reason, str):
+            self.reasons = self.reasons.mask(self.reasons.isna() & failed, reason)
+        else:
+            self.reasons = self.reasons.mask(self.reasons.isna() & failed, reason[failed])
+
+
+def validate_chunk(target, chunk, mapping, participant_ids, enrolled_numbers=frozenset()):
+    """Map a chunk onto the target table and check it column by column
+
+    mapping is {target column: sheet column or None}; participant_ids maps
+    the study's participant numbers to participant IDs; enrolled_numbers
+    are rejected as duplicates when importing participants (pass the
+    numbers of earlier chunks in too). Returns (rows, rejects): rows is a
+    DataFrame of the valid rows in target columns, rejects a DataFrame of
+    ROW and REASON.
+    """
+    rejections = _Rejections(chunk.index)
+    rows = pd.DataFrame(index=chunk.index)
+    for field in target.fields:
+        source = mapping.get(field.column)
+        raw = chunk[source] if source else pd.Series(None, index=chunk.index, dtype=object)
+        text = raw.map(_cell_text)
+        missing = text.isna()
+        if field.required:
+            rejections.add(missing, f"{field.label} is required")
+        if field.kind == "date":
+            parsed = _parse_dates(text)
+            rejections.add(~missing & parsed.isna(), f"{field.label} is not a date")
+            values = parsed.dt.strftime("%Y-%m-%d").where(parsed.notna(), None)
+        elif field.kind == "integer":
+            parsed = pd.to_numeric(text, errors="coerce")
+            rejections.add(~missing & (parsed.isna() | (parsed % 1 != 0)), f"{field.label} is not a whole number")
+            values = parsed.where(parsed.notna() & (parsed % 1 == 0)).astype("Int64")
+        elif field.kind == "boolean":
+            parsed = raw.map(_cell_boolean)
+            rejections.add(parsed == "invalid", f"{field.label} is not yes or no")
+            values = parsed.where(parsed != "invalid", None)
+        elif field.kind == "participant":
+            values = text.map(participant_ids)
+            rejections.add(~missing & values.isna(),
+                           "Participant " + text.fillna("") + " is not enrolled in this study")
+        else:
+            values = text
+            if field.max_length:
+                rejections.add(text.str.len() > field.max_length,
+                               f"{field.label} is longer than {field.max_length} characters")
+        if field.column in target.defaults:
+            values = values.where(values.notna(), target.defaults[field.column])
+        rows[field.column] = values
+    if "participant_number" in rows:
+        numbers = rows["participant_number"]
+        rejections.add(numbers.isin(enrolled_numbers), "Participant number is already enrolled")
+        rejections.add(numbers.notna() & numbers.duplicated(), "Participant number appears more than once")
+    failed = rejections.reasons.notna()
+    rejects = pd.DataFrame({"ROW": chunk.index[failed], "REASON": rejections.reasons[failed].values})
+    return rows[~failed].copy(), rejects
+
+
+def _chunk_csv(rows, boolean_columns):
+    """Chunk file contents: a header row (skipped by EXCEL_FORMAT) and the rows, NULL as an empty field"""
+    rows = rows.copy()
+    for column in boolean_columns:
+        rows[column] = rows[column].map({True: 1, False: 0})
+    return rows.to_csv(index=False, lineterminator="\n").encode("utf-8")
+
+
+def row_ids(target, study_id, sheet, rows):
+    """Content IDs of a chunk's valid rows, from the study, the sheet and the target field values"""
+    values = rows[[field.column for field in target.fields]].itertuples(index=False, name=None)
+    return [content_id(target.id_prefix, study_id, sheet, *row) for row in values]
+
+
+def merge_statement(target, columns, import_id):
+    """Insert-only MERGE of the import's chunk files on the ID column"""
+    fields = ", ".join(f"${i} as {column}" for i, column in enumerate(columns, start=1))
+    return (
+        f"MERGE INTO CLINICAL_RESEARCH.{target.table} t"
+        f" USING (SELECT DISTINCT {fields} FROM {STAGE}/{import_id}/ (FILE_FORMAT => '{FILE_FORMAT}')) s"
+        f" ON t.{target.id_column} = s.{target.id_column}"
+        f" WHEN NOT MATCHED THEN INSERT ({', '.join(columns)})"
+        f" VALUES ({', '.join(f's.{column}' for column in columns)})"
+    )
+
+
+def import_sheet(session, execute, target, study_id, file_name, data, mapping, user, participant_ids,
+                 sheet=None, units=None, chunk_size=CHUNK_ROWS, parallel=PARALLEL_UPLOADS, progress=None,
+                 participant_numbers=()):
+    """Stream a sheet into the target table through the import stage
+
+    execute(query, params) runs one statement; participant_ids maps the
+    study's active participant numbers to IDs; participant_numbers are all
+    of the study's participant numbers, whatever their status, which an
+    import of participants must not repeat; units is
+    measurements.unit_lookup of the reference snapshot; progress(rows_read)
+    is called after every chunk. Returns an ImportResult.
+    """
+    started = time.perf_counter()
+    import_id = new_id("IMP")
+    created_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    columns = ([target.id_column, "study_id"] + [field.column for field in target.fields]
+               + target.derived_columns + ["created_by", "created_date"])
+    boolean_columns = [field.column for field in target.fields if field.kind == "boolean"]
+    enrolled_numbers = set(participant_numbers) if target.id_column == "participant_id" else set()
+    rows_read = rows_rejected = rows_valid = rows_loaded = 0
+    rejects, uploads = [], []
+    rows = iter_sheet_rows(file_name, data, sheet)
+    try:
+        header = _header(next(rows, ()))
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            for number, chunk in enumerate(iter_chunks(rows, header, chunk_size), start=1):
+                valid, chunk_rejects = validate_chunk(target, chunk, mapping, participant_ids, enrolled_numbers)
+                rows_read += len(chunk)
+                rows_rejected += len(chunk_rejects)
+                if sum(len(r) for r in rejects) < MAX_REPORTED_REJECTS:
+                    rejects.append(chunk_rejects.head(MAX_REPORTED_REJECTS - sum(len(r) for r in rejects)))
+                if "participant_number" in valid:
+                    enrolled_numbers.update(valid["participant_number"])
+                rows_valid += len(valid)
+                if not valid.empty:
+                    valid.insert(0, target.id_column, row_ids(target, study_id, sheet, valid))
+                    valid.insert(1, "study_id", study_id)
+                    valid["created_by"] = user
+                    valid["created_date"] = created_date
+                    if target.derive:
+                        target.derive(valid, units or {})
+                    # Hold at most `parallel` chunks in memory while they upload
+                    pending = [upload for upload in uploads if not upload.done()]
+                    if len(pending) >= parallel:
+                        pending[0].result()
+                    uploads.append(pool.submit(
+                        session.file.put_stream, io.BytesIO(_chunk_csv(valid[columns], boolean_columns)),
+                        f"{STAGE}/{import_id}/chunk_{number:05d}.csv", auto_compress=True, overwrite=True,
+                    ))
+                if progress:
+                    progress(rows_read)
+        for upload in uploads:
+            upload.result()
+        if uploads:
+            for result in execute(merge_statement(target, columns, import_id)):
+                counts = {key.lower(): value for key, value in result.as_dict().items()}
+                rows_loaded += counts.get("number of rows inserted") or 0
+    finally:
+        rows.close()
+        if uploads:
+            execute(f"REMOVE {STAGE}/{import_id}/")
+    rejects = pd.concat(rejects, ignore_index=True) if rejects else pd.DataFrame(columns=["ROW", "REASON"])
+    return ImportResult(import_id, rows_read, rows_loaded, rows_rejected, rows_valid - rows_loaded, rejects,
+                        len(uploads), time.perf_counter() - started)
@@ -29,7 +29,7 @@ CREATE OR REPLACE TABLE STUDIES (
     study_start_date DATE,
     study_end_date DATE,
     target_enrollment INTEGER,
-    current_enrollment INTEGER DEFAULT 0,
+    current_enrollment INTEGER DEFAULT 0,  -- Not maintained; see STUDY_ENROLLMENT (06_enrollment_counts.sql)
     study_status VARCHAR(50) DEFAULT 'ACTIVE',
     study_sponsor VARCHAR(255),
     study_site VARCHAR(255),
@@ -83,6 +83,9 @@ CREATE OR REPLACE TABLE OBSERVATIONS (
     measurement_name VARCHAR(255),
     measurement_value VARCHAR(500),
     measurement_unit VARCHAR(50),
+    measurement_value_num FLOAT,  -- measurement_value parsed at ingestion; NULL unless a plain number
+    measurement_unit_normalized VARCHAR(50),  -- UNITS_OF_MEASURE abbreviation
+    value_parse_status VARCHAR(20),  -- NUMERIC, TEXT, MISSING
     normal_range VARCHAR(100),
     clinically_significant BOOLEAN,
     data_quality_score INTEGER,  -- 0-100
@@ -120,7 +123,7 @@ CREATE OR REPLACE TABLE RESEARCH_NOTES (
     flagged_for_followup BOOLEAN DEFAULT FALSE,
     followup_due_date DATE,
     followup_completed BOOLEAN DEFAULT FALSE,
-    tags ARRAY,  -- Searchable tags
+    tags ARRAY,  -- Lower-case tags, indexed in NOTE_TAGS (11_note_tags.sql)
     created_by VARCHAR(255) DEFAULT CURRENT_USER(),
     created_date TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
     modified_by VARCHAR(255),
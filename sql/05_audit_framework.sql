@@ -352,6 +352,16 @@ GRANT SELECT ON ALL TABLES IN SCHEMA AUDIT TO ROLE RESEARCH_ADMIN;
 GRANT SELECT ON TABLE USER_ACTIVITY_LOG TO ROLE DATA_MANAGER;
 GRANT SELECT ON TABLE VALIDATION_LOG TO ROLE DATA_MANAGER;
 
+-- Every app role writes its own activity (batched by the app, see activity_log.py)
+GRANT USAGE ON SCHEMA AUDIT TO ROLE PRINCIPAL_INVESTIGATOR;
+GRANT USAGE ON SCHEMA AUDIT TO ROLE RESEARCHER;
+GRANT USAGE ON SCHEMA AUDIT TO ROLE DATA_MANAGER;
+GRANT USAGE ON SCHEMA AUDIT TO ROLE RESEARCH_VIEWER;
+GRANT INSERT ON TABLE USER_ACTIVITY_LOG TO ROLE PRINCIPAL_INVESTIGATOR;
+GRANT INSERT ON TABLE USER_ACTIVITY_LOG TO ROLE RESEARCHER;
+GRANT INSERT ON TABLE USER_ACTIVITY_LOG TO ROLE DATA_MANAGER;
+GRANT INSERT ON TABLE USER_ACTIVITY_LOG TO ROLE RESEARCH_VIEWER;
+
 -- ============================================================================
 -- Summary
 -- ============================================================================
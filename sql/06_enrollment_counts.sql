@@ -0,0 +1,47 @@
+-- ============================================================================
+-- Clinical Research Data Capture - Derived Enrollment Counts
+-- ============================================================================
+-- Enrollment per study is derived from PARTICIPANTS instead of being kept
+-- in STUDIES.current_enrollment by an UPDATE on every enrollment. The
+-- dynamic table is refreshed incrementally, so enrollment drives no longer
+-- serialize on one STUDIES row and withdrawals or failed inserts can no
+-- longer make the count drift.
+--
+-- Execute as: ACCOUNTADMIN role (after 02_create_tables.sql)
+-- ============================================================================
+
+USE ROLE ACCOUNTADMIN;
+USE WAREHOUSE RESEARCH_WH;
+USE DATABASE CLINICAL_RESEARCH;
+USE SCHEMA RESEARCH_DATA;
+
+-- ============================================================================
+-- Enrollment per Study
+-- ============================================================================
+
+-- Enrolled = every participant not withdrawn (active or completed)
+CREATE OR REPLACE DYNAMIC TABLE STUDY_ENROLLMENT
+    TARGET_LAG = '1 minute'
+    WAREHOUSE = RESEARCH_WH
+    REFRESH_MODE = INCREMENTAL
+    COMMENT = 'Enrollment counts per study, maintained from PARTICIPANTS'
+AS
+SELECT
+    study_id,
+    COUNT_IF(UPPER(participant_status) <> 'WITHDRAWN') as enrolled_count,
+    COUNT_IF(UPPER(participant_status) = 'ACTIVE') as active_count,
+    COUNT_IF(UPPER(participant_status) = 'WITHDRAWN') as withdrawn_count,
+    MAX(enrollment_date) as last_enrollment_date
+FROM PARTICIPANTS
+GROUP BY study_id;
+
+-- ============================================================================
+-- Access
+-- ============================================================================
+
+GRANT SELECT ON DYNAMIC TABLE STUDY_ENROLLMENT TO ROLE PRINCIPAL_INVESTIGATOR;
+GRANT SELECT ON DYNAMIC TABLE STUDY_ENROLLMENT TO ROLE RESEARCHER;
+GRANT SELECT ON DYNAMIC TABLE STUDY_ENROLLMENT TO ROLE DATA_MANAGER;
+GRANT SELECT ON DYNAMIC TABLE STUDY_ENROLLMENT TO ROLE RESEARCH_VIEWER;
+
+SELECT 'Derived enrollment counts ready: SELECT * FROM STUDY_ENROLLMENT;' as status;
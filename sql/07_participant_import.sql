@@ -0,0 +1,54 @@
+-- ============================================================================
+-- Clinical Research Data Capture - Bulk Participant Import
+-- ============================================================================
+-- CSV files of participants are uploaded to STAGING.IMPORT_STAGE, loaded
+-- with one COPY INTO this table, validated with one set-based UPDATE and
+-- merged into PARTICIPANTS with one MERGE (see participant_import.py).
+-- Columns are loaded as text so a malformed date or flag becomes a
+-- rejected row with a reason instead of a failed COPY.
+--
+-- Execute as: ACCOUNTADMIN role (after 02_create_tables.sql)
+-- ============================================================================
+
+USE ROLE ACCOUNTADMIN;
+USE WAREHOUSE RESEARCH_WH;
+USE DATABASE CLINICAL_RESEARCH;
+USE SCHEMA STAGING;
+
+-- ============================================================================
+-- Participant Import Staging
+-- ============================================================================
+
+-- Rows are kept only while their import runs
+CREATE OR REPLACE TABLE PARTICIPANT_IMPORT (
+    import_id VARCHAR(50) NOT NULL,
+    file_name VARCHAR(500) NOT NULL,  -- METADATA$FILENAME
+    file_row_number NUMBER NOT NULL,  -- METADATA$FILE_ROW_NUMBER
+    participant_number VARCHAR,
+    enrollment_date VARCHAR,
+    consent_date VARCHAR,
+    consent_version VARCHAR,
+    demographic_group VARCHAR,
+    inclusion_criteria_met VARCHAR,
+    exclusion_criteria_met VARCHAR,
+    randomization_arm VARCHAR,
+    reject_reason VARCHAR(500),  -- Set by validation; NULL rows are enrolled
+    loaded_date TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
+-- ============================================================================
+-- Access
+-- ============================================================================
+
+GRANT USAGE ON SCHEMA STAGING TO ROLE RESEARCHER;
+GRANT READ, WRITE ON STAGE CLINICAL_RESEARCH.STAGING.IMPORT_STAGE TO ROLE PRINCIPAL_INVESTIGATOR;
+GRANT READ, WRITE ON STAGE CLINICAL_RESEARCH.STAGING.IMPORT_STAGE TO ROLE RESEARCHER;
+GRANT READ, WRITE ON STAGE CLINICAL_RESEARCH.STAGING.IMPORT_STAGE TO ROLE DATA_MANAGER;
+GRANT USAGE ON FILE FORMAT CLINICAL_RESEARCH.REFERENCE_DATA.CSV_FORMAT TO ROLE PRINCIPAL_INVESTIGATOR;
+GRANT USAGE ON FILE FORMAT CLINICAL_RESEARCH.REFERENCE_DATA.CSV_FORMAT TO ROLE RESEARCHER;
+GRANT USAGE ON FILE FORMAT CLINICAL_RESEARCH.REFERENCE_DATA.CSV_FORMAT TO ROLE DATA_MANAGER;
+GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE PARTICIPANT_IMPORT TO ROLE PRINCIPAL_INVESTIGATOR;
+GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE PARTICIPANT_IMPORT TO ROLE RESEARCHER;
+GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE PARTICIPANT_IMPORT TO ROLE DATA_MANAGER;
+
+SELECT 'Participant import staging ready: STAGING.PARTICIPANT_IMPORT' as status;
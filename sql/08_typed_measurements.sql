@@ -0,0 +1,67 @@
+-- ============================================================================
+-- Clinical Research Data Capture - Typed Measurement Values
+-- ============================================================================
+-- OBSERVATIONS.measurement_value is free text (VARCHAR(500)). The app now
+-- parses it once when a row is written (see measurements.py) into a FLOAT,
+-- a normalized unit and a parse status. Reports and range checks compare
+-- those native values, and the FLOAT column gets per-partition min/max
+-- metadata for pruning. This script adds the columns to an existing
+-- deployment and backfills every row that does not have them yet.
+-- The backfill only touches rows with no parse status, so it is safe to
+-- re-run. Re-run it after rolling out if older app sessions were still
+-- saving.
+--
+-- Execute as: ACCOUNTADMIN role (after 02_create_tables.sql and 03_reference_data.sql)
+-- ============================================================================
+
+USE ROLE ACCOUNTADMIN;
+USE WAREHOUSE RESEARCH_WH;
+USE DATABASE CLINICAL_RESEARCH;
+USE SCHEMA RESEARCH_DATA;
+
+-- ============================================================================
+-- Typed Columns (already present on new installs)
+-- ============================================================================
+
+ALTER TABLE OBSERVATIONS ADD COLUMN IF NOT EXISTS measurement_value_num FLOAT
+    COMMENT 'measurement_value parsed at ingestion; NULL unless a plain number';
+ALTER TABLE OBSERVATIONS ADD COLUMN IF NOT EXISTS measurement_unit_normalized VARCHAR(50)
+    COMMENT 'UNITS_OF_MEASURE abbreviation';
+ALTER TABLE OBSERVATIONS ADD COLUMN IF NOT EXISTS value_parse_status VARCHAR(20)
+    COMMENT 'NUMERIC, TEXT, MISSING';
+
+-- ============================================================================
+-- Set-Based Backfill (same rules as measurements.py)
+-- ============================================================================
+
+UPDATE OBSERVATIONS AS o
+SET measurement_value_num = t.measurement_value_num,
+    measurement_unit_normalized = t.measurement_unit_normalized,
+    value_parse_status = t.value_parse_status
+FROM (
+    SELECT
+        obs.observation_id,
+        CASE WHEN RLIKE(TRIM(obs.measurement_value), '[+-]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][+-]?[0-9]+)?')
+            THEN TRY_TO_DOUBLE(TRIM(obs.measurement_value)) END as measurement_value_num,
+        COALESCE(u.unit_abbreviation, NULLIF(TRIM(obs.measurement_unit), '')) as measurement_unit_normalized,
+        CASE
+            WHEN NULLIF(TRIM(obs.measurement_value), '') IS NULL THEN 'MISSING'
+            WHEN RLIKE(TRIM(obs.measurement_value), '[+-]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][+-]?[0-9]+)?') THEN 'NUMERIC'
+            ELSE 'TEXT'
+        END as value_parse_status
+    FROM OBSERVATIONS obs
+    LEFT JOIN (
+        SELECT UPPER(unit_abbreviation) as unit_key, unit_abbreviation
+        FROM CLINICAL_RESEARCH.REFERENCE_DATA.UNITS_OF_MEASURE WHERE is_active
+        UNION
+        SELECT UPPER(unit_name), unit_abbreviation
+        FROM CLINICAL_RESEARCH.REFERENCE_DATA.UNITS_OF_MEASURE WHERE is_active
+    ) u ON u.unit_key = UPPER(TRIM(obs.measurement_unit))
+    WHERE obs.value_parse_status IS NULL
+) t
+WHERE o.observation_id = t.observation_id;
+
+SELECT value_parse_status, COUNT(*) as observations
+FROM OBSERVATIONS
+GROUP BY value_parse_status
+ORDER BY value_parse_status;
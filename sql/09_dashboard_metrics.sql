@@ -0,0 +1,125 @@
+-- ============================================================================
+-- Clinical Research Data Capture - Incremental Dashboard Metrics
+-- ============================================================================
+-- The Dashboard reads its four counters from DASHBOARD_METRICS instead of
+-- counting STUDIES, PARTICIPANTS, RESEARCH_NOTES and FINDINGS on every
+-- refresh. A task applies the changes captured by one stream per table
+-- as +1/-1 deltas per study. Note and finding counts are kept per day, so
+-- the 7-day windows move with the calendar without rescanning the tables.
+-- A dashboard read sums a handful of rows per accessible study whatever
+-- the data volume.
+--
+-- Counts are kept per study only, and the table carries the same row
+-- access policy as the tables it counts, so every role sees the totals of
+-- its own studies.
+--
+-- The streams are this task's own. The *_CHANGES_STREAM streams belong to
+-- TASK_LOG_TABLE_CHANGES, and a stream's offset moves for every consumer
+-- when any one of them reads it. They are created with SHOW_INITIAL_ROWS,
+-- so the first run counts every existing row; re-running this script
+-- rebuilds the metrics from scratch.
+--
+-- Execute as: ACCOUNTADMIN role (after 04_security_setup.sql)
+-- ============================================================================
+
+USE ROLE ACCOUNTADMIN;
+USE WAREHOUSE RESEARCH_WH;
+USE DATABASE CLINICAL_RESEARCH;
+USE SCHEMA RESEARCH_DATA;
+
+-- ============================================================================
+-- Metrics Table
+-- ============================================================================
+
+CREATE OR REPLACE TABLE DASHBOARD_METRICS (
+    study_id VARCHAR(50) NOT NULL,
+    metric_name VARCHAR(50) NOT NULL,  -- ACTIVE_STUDIES, ACTIVE_PARTICIPANTS, NOTES, FINDINGS (DOCUMENTS, DOCUMENT_LENGTH: sql/10)
+    metric_date DATE,  -- Day of a NOTES/FINDINGS count; NULL for running totals
+    metric_value NUMBER NOT NULL,
+    updated_date TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+);
+
+-- ============================================================================
+-- Change Streams
+-- ============================================================================
+
+CREATE OR REPLACE STREAM STUDIES_METRICS_STREAM
+    ON TABLE STUDIES
+    SHOW_INITIAL_ROWS = TRUE;
+
+CREATE OR REPLACE STREAM PARTICIPANTS_METRICS_STREAM
+    ON TABLE PARTICIPANTS
+    SHOW_INITIAL_ROWS = TRUE;
+
+CREATE OR REPLACE STREAM NOTES_METRICS_STREAM
+    ON TABLE RESEARCH_NOTES
+    SHOW_INITIAL_ROWS = TRUE;
+
+CREATE OR REPLACE STREAM FINDINGS_METRICS_STREAM
+    ON TABLE FINDINGS
+    SHOW_INITIAL_ROWS = TRUE;
+
+-- ============================================================================
+-- Delta Task
+-- ============================================================================
+
+-- An update appears in a stream as a DELETE of the old row and an INSERT
+-- of the new one, so a status change moves a count down and up again.
+-- One MERGE reads all four streams, so they advance together.
+CREATE OR REPLACE TASK REFRESH_DASHBOARD_METRICS
+    WAREHOUSE = RESEARCH_WH
+    SCHEDULE = '1 MINUTE'
+    WHEN
+        SYSTEM$STREAM_HAS_DATA('STUDIES_METRICS_STREAM') OR
+        SYSTEM$STREAM_HAS_DATA('PARTICIPANTS_METRICS_STREAM') OR
+        SYSTEM$STREAM_HAS_DATA('NOTES_METRICS_STREAM') OR
+        SYSTEM$STREAM_HAS_DATA('FINDINGS_METRICS_STREAM')
+AS
+MERGE INTO DASHBOARD_METRICS t
+USING (
+    SELECT d.study_id, d.metric_name, d.metric_date, SUM(d.delta) as delta
+    FROM (
+        SELECT study_id, 'ACTIVE_STUDIES' as metric_name, CAST(NULL AS DATE) as metric_date,
+            CASE WHEN METADATA$ACTION = 'INSERT' THEN 1 ELSE -1 END as delta
+        FROM STUDIES_METRICS_STREAM
+        WHERE study_status = 'ACTIVE'
+        UNION ALL
+        SELECT study_id, 'ACTIVE_PARTICIPANTS', CAST(NULL AS DATE),
+            CASE WHEN METADATA$ACTION = 'INSERT' THEN 1 ELSE -1 END
+        FROM PARTICIPANTS_METRICS_STREAM
+        WHERE participant_status = 'ACTIVE'
+        UNION ALL
+        SELECT study_id, 'NOTES', note_date,
+            CASE WHEN METADATA$ACTION = 'INSERT' THEN 1 ELSE -1 END
+        FROM NOTES_METRICS_STREAM
+        UNION ALL
+        SELECT study_id, 'FINDINGS', TO_DATE(created_date),
+            CASE WHEN METADATA$ACTION = 'INSERT' THEN 1 ELSE -1 END
+        FROM FINDINGS_METRICS_STREAM
+    ) d
+    GROUP BY 1, 2, 3
+    HAVING SUM(d.delta) <> 0
+) s
+ON t.study_id = s.study_id AND t.metric_name = s.metric_name AND t.metric_date IS NOT DISTINCT FROM s.metric_date
+WHEN MATCHED THEN UPDATE SET metric_value = t.metric_value + s.delta, updated_date = CURRENT_TIMESTAMP()
+WHEN NOT MATCHED THEN INSERT (study_id, metric_name, metric_date, metric_value)
+VALUES (s.study_id, s.metric_name, s.metric_date, s.delta);
+
+ALTER TASK REFRESH_DASHBOARD_METRICS RESUME;
+
+-- First run now rather than at the next schedule
+EXECUTE TASK REFRESH_DASHBOARD_METRICS;
+
+-- ============================================================================
+-- Access
+-- ============================================================================
+
+-- Counts of a study are only visible to those who can see the study
+ALTER TABLE DASHBOARD_METRICS ADD ROW ACCESS POLICY STUDY_ACCESS_POLICY ON (study_id);
+
+GRANT SELECT ON TABLE DASHBOARD_METRICS TO ROLE PRINCIPAL_INVESTIGATOR;
+GRANT SELECT ON TABLE DASHBOARD_METRICS TO ROLE RESEARCHER;
+GRANT SELECT ON TABLE DASHBOARD_METRICS TO ROLE DATA_MANAGER;
+GRANT SELECT ON TABLE DASHBOARD_METRICS TO ROLE RESEARCH_VIEWER;
+
+SELECT 'Dashboard metrics ready: SELECT metric_name, SUM(metric_value) FROM DASHBOARD_METRICS GROUP BY 1;' as status;
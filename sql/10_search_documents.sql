@@ -0,0 +1,210 @@
+-- ============================================================================
+-- Clinical Research Data Capture - Unified Record Search
+-- ============================================================================
+-- One search covers the free text of notes (title and text), findings
+-- (description and action taken), observations (measurement name) and
+-- comments. SEARCH_DOCUMENTS holds one row per record with its owning
+-- study and participant, so a search is a single indexed query over one
+-- table and hits of every type are ranked together (see record_search.py).
+--
+-- A task applies the changes captured by one stream per source table,
+-- re-reading only the changed records; records deleted from a source are
+-- removed. The app also indexes the records it saves right after the save
+-- (record_search.index_statements), so they can be found at once rather
+-- than after the task's next run; changes made elsewhere (imports, direct
+-- SQL) are searchable within the task's one-minute schedule. The streams
+-- are created with SHOW_INITIAL_ROWS, so the first run indexes every
+-- existing record. FULL_TEXT search optimization on the document text
+-- lets SEARCH() read only the micro-partitions with a match. A second
+-- task keeps the number and total length of documents per study and day
+-- in DASHBOARD_METRICS (DOCUMENTS, DOCUMENT_LENGTH) for ranking;
+-- re-running 09_dashboard_metrics.sql clears them, so re-run this script
+-- after it.
+--
+-- This replaces the notes-only index of the earlier version of this
+-- script; where that ran, drop it with:
+--   ALTER TABLE RESEARCH_NOTES DROP SEARCH OPTIMIZATION ON FULL_TEXT(note_title, note_text);
+--
+-- Search optimization is an Enterprise Edition feature and is billed for
+-- index storage and maintenance.
+--
+-- Execute as: ACCOUNTADMIN role (after 04_security_setup.sql and 09_dashboard_metrics.sql)
+-- ============================================================================
+
+USE ROLE ACCOUNTADMIN;
+USE WAREHOUSE RESEARCH_WH;
+USE DATABASE CLINICAL_RESEARCH;
+USE SCHEMA RESEARCH_DATA;
+
+-- ============================================================================
+-- Search Documents
+-- ============================================================================
+
+CREATE OR REPLACE TABLE SEARCH_DOCUMENTS (
+    doc_type VARCHAR(20) NOT NULL,  -- NOTE, FINDING, OBSERVATION, COMMENT
+    record_id VARCHAR(50) NOT NULL,
+    study_id VARCHAR(50),
+    participant_id VARCHAR(50),
+    title VARCHAR(500),  -- Note title, finding type, observation type or comment type
+    body TEXT,
+    doc_date DATE,
+    doc_length NUMBER,  -- Characters of title and body, for ranking
+    indexed_date TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    PRIMARY KEY (record_id, doc_type)
+);
+
+ALTER TABLE SEARCH_DOCUMENTS CLUSTER BY (doc_date);
+
+-- ============================================================================
+-- Change Streams
+-- ============================================================================
+
+CREATE OR REPLACE STREAM NOTES_SEARCH_STREAM
+    ON TABLE RESEARCH_NOTES
+    SHOW_INITIAL_ROWS = TRUE;
+
+CREATE OR REPLACE STREAM FINDINGS_SEARCH_STREAM
+    ON TABLE FINDINGS
+    SHOW_INITIAL_ROWS = TRUE;
+
+CREATE OR REPLACE STREAM OBSERVATIONS_SEARCH_STREAM
+    ON TABLE OBSERVATIONS
+    SHOW_INITIAL_ROWS = TRUE;
+
+CREATE OR REPLACE STREAM COMMENTS_SEARCH_STREAM
+    ON TABLE COMMENTS
+    SHOW_INITIAL_ROWS = TRUE;
+
+-- ============================================================================
+-- Index Task
+-- ============================================================================
+
+-- The streams only say which records changed; the document is rebuilt from
+-- the record's current row, so any number of changes to one record between
+-- runs is a single upsert, and a record that no longer exists is deleted.
+-- A comment belongs to the study and participant of the record it is on.
+CREATE OR REPLACE TASK REFRESH_SEARCH_DOCUMENTS
+    WAREHOUSE = RESEARCH_WH
+    SCHEDULE = '1 MINUTE'
+    WHEN
+        SYSTEM$STREAM_HAS_DATA('NOTES_SEARCH_STREAM') OR
+        SYSTEM$STREAM_HAS_DATA('FINDINGS_SEARCH_STREAM') OR
+        SYSTEM$STREAM_HAS_DATA('OBSERVATIONS_SEARCH_STREAM') OR
+        SYSTEM$STREAM_HAS_DATA('COMMENTS_SEARCH_STREAM')
+AS
+MERGE INTO SEARCH_DOCUMENTS t
+USING (
+    SELECT d.*,
+        LENGTH(COALESCE(d.title, '')) + LENGTH(COALESCE(d.body, '')) as doc_length
+    FROM (
+        SELECT 'NOTE' as doc_type, k.note_id as record_id, n.note_id IS NULL as is_deleted,
+            n.study_id, n.participant_id, n.note_title as title, n.note_text as body, n.note_date as doc_date
+        FROM (SELECT DISTINCT note_id FROM NOTES_SEARCH_STREAM) k
+        LEFT JOIN RESEARCH_NOTES n ON n.note_id = k.note_id
+        UNION ALL
+        SELECT 'FINDING', k.finding_id, f.finding_id IS NULL,
+            f.study_id, f.participant_id, f.finding_type,
+            COALESCE(f.finding_description, '') || ' ' || COALESCE(f.action_taken, ''), TO_DATE(f.created_date)
+        FROM (SELECT DISTINCT finding_id FROM FINDINGS_SEARCH_STREAM) k
+        LEFT JOIN FINDINGS f ON f.finding_id = k.finding_id
+        UNION ALL
+        SELECT 'OBSERVATION', k.observation_id, o.observation_id IS NULL,
+            o.study_id, o.participant_id, o.observation_type, o.measurement_name, o.observation_date
+        FROM (SELECT DISTINCT observation_id FROM OBSERVATIONS_SEARCH_STREAM) k
+        LEFT JOIN OBSERVATIONS o ON o.observation_id = k.observation_id
+        UNION ALL
+        SELECT 'COMMENT', k.comment_id, c.comment_id IS NULL,
+            COALESCE(s.study_id, p.study_id, o.study_id, n.study_id, f.study_id),
+            COALESCE(p.participant_id, o.participant_id, n.participant_id, f.participant_id),
+            c.comment_type, c.comment_text, TO_DATE(c.created_date)
+        FROM (SELECT DISTINCT comment_id FROM COMMENTS_SEARCH_STREAM) k
+        LEFT JOIN COMMENTS c ON c.comment_id = k.comment_id
+        LEFT JOIN STUDIES s ON c.parent_type = 'STUDY' AND s.study_id = c.parent_id
+        LEFT JOIN PARTICIPANTS p ON c.parent_type = 'PARTICIPANT' AND p.participant_id = c.parent_id
+        LEFT JOIN OBSERVATIONS o ON c.parent_type = 'OBSERVATION' AND o.observation_id = c.parent_id
+        LEFT JOIN RESEARCH_NOTES n ON c.parent_type = 'NOTE' AND n.note_id = c.parent_id
+        LEFT JOIN FINDINGS f ON c.parent_type = 'FINDING' AND f.finding_id = c.parent_id
+    ) d
+) s
+ON t.doc_type = s.doc_type AND t.record_id = s.record_id
+WHEN MATCHED AND s.is_deleted THEN DELETE
+WHEN MATCHED THEN UPDATE SET
+    study_id = s.study_id, participant_id = s.participant_id, title = s.title, body = s.body,
+    doc_date = s.doc_date, doc_length = s.doc_length, indexed_date = CURRENT_TIMESTAMP()
+WHEN NOT MATCHED AND NOT s.is_deleted THEN INSERT
+    (doc_type, record_id, study_id, participant_id, title, body, doc_date, doc_length)
+VALUES (s.doc_type, s.record_id, s.study_id, s.participant_id, s.title, s.body, s.doc_date, s.doc_length);
+
+ALTER TASK REFRESH_SEARCH_DOCUMENTS RESUME;
+
+-- First run now rather than at the next schedule
+EXECUTE TASK REFRESH_SEARCH_DOCUMENTS;
+
+-- ============================================================================
+-- Ranking Statistics
+-- ============================================================================
+
+CREATE OR REPLACE STREAM SEARCH_DOCUMENTS_METRICS_STREAM
+    ON TABLE SEARCH_DOCUMENTS
+    SHOW_INITIAL_ROWS = TRUE;
+
+-- A re-indexed document appears as a DELETE of the old row and an INSERT of
+-- the new one, so its old length comes off and the new one goes on.
+-- Counts are per study like the dashboard's, so ranking uses the documents
+-- of the studies the reader can see; a comment on no record is not counted.
+CREATE OR REPLACE TASK REFRESH_SEARCH_METRICS
+    WAREHOUSE = RESEARCH_WH
+    SCHEDULE = '1 MINUTE'
+    WHEN
+        SYSTEM$STREAM_HAS_DATA('SEARCH_DOCUMENTS_METRICS_STREAM')
+AS
+MERGE INTO DASHBOARD_METRICS t
+USING (
+    SELECT d.study_id, d.metric_name, d.metric_date, SUM(d.delta) as delta
+    FROM (
+        SELECT study_id, 'DOCUMENTS' as metric_name, doc_date as metric_date,
+            CASE WHEN METADATA$ACTION = 'INSERT' THEN 1 ELSE -1 END as delta
+        FROM SEARCH_DOCUMENTS_METRICS_STREAM
+        UNION ALL
+        SELECT study_id, 'DOCUMENT_LENGTH', doc_date,
+            CASE WHEN METADATA$ACTION = 'INSERT' THEN 1 ELSE -1 END * doc_length
+        FROM SEARCH_DOCUMENTS_METRICS_STREAM
+    ) d
+    WHERE d.study_id IS NOT NULL
+    GROUP BY 1, 2, 3
+    HAVING SUM(d.delta) <> 0
+) s
+ON t.study_id = s.study_id AND t.metric_name = s.metric_name AND t.metric_date IS NOT DISTINCT FROM s.metric_date
+WHEN MATCHED THEN UPDATE SET metric_value = t.metric_value + s.delta, updated_date = CURRENT_TIMESTAMP()
+WHEN NOT MATCHED THEN INSERT (study_id, metric_name, metric_date, metric_value)
+VALUES (s.study_id, s.metric_name, s.metric_date, s.delta);
+
+ALTER TASK REFRESH_SEARCH_METRICS RESUME;
+
+EXECUTE TASK REFRESH_SEARCH_METRICS;
+
+-- ============================================================================
+-- Search Index
+-- ============================================================================
+
+ALTER TABLE SEARCH_DOCUMENTS ADD SEARCH OPTIMIZATION ON FULL_TEXT(title, body);
+
+-- Build progress; search works before it reaches 100, just without pruning
+SHOW TABLES LIKE 'SEARCH_DOCUMENTS';
+
+-- ============================================================================
+-- Access
+-- ============================================================================
+
+-- Documents copy record text, so they carry the same study access as the records
+ALTER TABLE SEARCH_DOCUMENTS ADD ROW ACCESS POLICY STUDY_ACCESS_POLICY ON (study_id);
+
+GRANT SELECT ON TABLE SEARCH_DOCUMENTS TO ROLE PRINCIPAL_INVESTIGATOR;
+GRANT SELECT ON TABLE SEARCH_DOCUMENTS TO ROLE RESEARCHER;
+-- Roles that save records index them as they save
+GRANT INSERT, UPDATE ON TABLE SEARCH_DOCUMENTS TO ROLE PRINCIPAL_INVESTIGATOR;
+GRANT INSERT, UPDATE ON TABLE SEARCH_DOCUMENTS TO ROLE RESEARCHER;
+GRANT SELECT ON TABLE SEARCH_DOCUMENTS TO ROLE DATA_MANAGER;
+GRANT SELECT ON TABLE SEARCH_DOCUMENTS TO ROLE RESEARCH_VIEWER;
+
+SELECT 'Record search ready: SEARCH((title, body), ''headache'') on SEARCH_DOCUMENTS' as status;
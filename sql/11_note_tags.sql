@@ -0,0 +1,117 @@
+-- ============================================================================
+-- Clinical Research Data Capture - Note Tag Index
+-- ============================================================================
+-- RESEARCH_NOTES.tags is an ARRAY, and ARRAY_CONTAINS over it reads the
+-- tags of every note in range. NOTE_TAGS flattens the arrays into one row
+-- per tag and note. EQUALITY search optimization on tag and note_id makes
+-- both point lookups: a tag filter reads only the rows of the selected
+-- tags, and the tag counts beside it only the rows of the matching notes
+-- (see note_tags.py). Clustering by date keeps the counts for a date
+-- window, before any tag is picked, to that window's micro-partitions.
+--
+-- A task applies the notes captured by a stream: the index rows of each
+-- changed note are rebuilt from the note's current tags, and the rows of
+-- removed tags and deleted notes are deleted. The stream is created with
+-- SHOW_INITIAL_ROWS, so the first run indexes every existing note.
+-- Notes saved in the app are also indexed right after the save (see
+-- note_tags.index_statements); the task's later run rebuilds the same rows.
+--
+-- Search optimization is an Enterprise Edition feature and is billed for
+-- index storage and maintenance.
+--
+-- Execute as: ACCOUNTADMIN role (after 04_security_setup.sql)
+-- ============================================================================
+
+USE ROLE ACCOUNTADMIN;
+USE WAREHOUSE RESEARCH_WH;
+USE DATABASE CLINICAL_RESEARCH;
+USE SCHEMA RESEARCH_DATA;
+
+-- ============================================================================
+-- Tag Index
+-- ============================================================================
+
+CREATE OR REPLACE TABLE NOTE_TAGS (
+    tag VARCHAR(50) NOT NULL,  -- Lower-case, as written by the Quick Note form
+    note_id VARCHAR(50) NOT NULL,
+    study_id VARCHAR(50),
+    note_date DATE,
+    indexed_date TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    PRIMARY KEY (tag, note_id)
+);
+
+ALTER TABLE NOTE_TAGS CLUSTER BY (note_date);
+
+-- ============================================================================
+-- Change Stream
+-- ============================================================================
+
+CREATE OR REPLACE STREAM NOTES_TAGS_STREAM
+    ON TABLE RESEARCH_NOTES
+    SHOW_INITIAL_ROWS = TRUE;
+
+-- ============================================================================
+-- Index Task
+-- ============================================================================
+
+-- The stream only says which notes changed; their current tags are
+-- upserted and the index rows of tags they no longer carry are deleted,
+-- which covers deleted notes too. Several changes to one note between runs
+-- are a single rebuild.
+CREATE OR REPLACE TASK REFRESH_NOTE_TAGS
+    WAREHOUSE = RESEARCH_WH
+    SCHEDULE = '1 MINUTE'
+    WHEN
+        SYSTEM$STREAM_HAS_DATA('NOTES_TAGS_STREAM')
+AS
+MERGE INTO NOTE_TAGS t
+USING (
+    WITH changed AS (
+        SELECT DISTINCT note_id FROM NOTES_TAGS_STREAM
+    ),
+    current_tags AS (
+        SELECT DISTINCT f.value::STRING as tag, n.note_id, n.study_id, n.note_date
+        FROM changed k
+        JOIN RESEARCH_NOTES n ON n.note_id = k.note_id,
+        LATERAL FLATTEN(input => n.tags) f
+        WHERE f.value::STRING <> ''
+    )
+    SELECT tag, note_id, study_id, note_date, FALSE as is_removed
+    FROM current_tags
+    UNION ALL
+    SELECT x.tag, x.note_id, x.study_id, x.note_date, TRUE
+    FROM NOTE_TAGS x
+    JOIN changed k ON x.note_id = k.note_id
+    WHERE NOT EXISTS (SELECT 1 FROM current_tags c WHERE c.note_id = x.note_id AND c.tag = x.tag)
+) s
+ON t.tag = s.tag AND t.note_id = s.note_id
+WHEN MATCHED AND s.is_removed THEN DELETE
+WHEN MATCHED THEN UPDATE SET
+    study_id = s.study_id, note_date = s.note_date, indexed_date = CURRENT_TIMESTAMP()
+WHEN NOT MATCHED AND NOT s.is_removed THEN INSERT (tag, note_id, study_id, note_date)
+VALUES (s.tag, s.note_id, s.study_id, s.note_date);
+
+ALTER TASK REFRESH_NOTE_TAGS RESUME;
+
+-- First run now rather than at the next schedule
+EXECUTE TASK REFRESH_NOTE_TAGS;
+
+-- ============================================================================
+-- Lookup Index
+-- ============================================================================
+
+ALTER TABLE NOTE_TAGS ADD SEARCH OPTIMIZATION ON EQUALITY(tag, note_id);
+
+-- ============================================================================
+-- Access
+-- ============================================================================
+
+-- Tag rows name the notes they index, so they carry the same study access
+ALTER TABLE NOTE_TAGS ADD ROW ACCESS POLICY STUDY_ACCESS_POLICY ON (study_id);
+
+GRANT SELECT ON TABLE NOTE_TAGS TO ROLE PRINCIPAL_INVESTIGATOR;
+GRANT SELECT ON TABLE NOTE_TAGS TO ROLE RESEARCHER;
+GRANT SELECT ON TABLE NOTE_TAGS TO ROLE DATA_MANAGER;
+GRANT SELECT ON TABLE NOTE_TAGS TO ROLE RESEARCH_VIEWER;
+
+SELECT 'Note tag index ready: SELECT tag, COUNT(*) FROM NOTE_TAGS GROUP BY tag;' as status;
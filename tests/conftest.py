@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import local_backend  # noqa: E402
+
+
+@pytest.fixture
+def session():
+    """A fresh local database loaded from sql/*.sql"""
+    session = local_backend.LocalSession.from_scripts()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def execute(session):
+    return lambda query, params=None: session.sql(query, params=params).collect()
+
+
+@pytest.fixture
+def items(execute):
+    """Scratch table RESEARCH_DATA.ITEMS (item_id, name NOT NULL, details VARIANT)"""
+    execute("CREATE TABLE CLINICAL_RESEARCH.RESEARCH_DATA.ITEMS"
+            " (item_id VARCHAR(50) PRIMARY KEY, name VARCHAR(100) NOT NULL, details VARIANT)")
+    return lambda: execute("SELECT item_id, name, details FROM RESEARCH_DATA.ITEMS ORDER BY item_id")
@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+
+import pytest
+
+import batch_writes
+
+COLUMNS = ["item_id", "name"]
+
+
+def test_merge_statements_collapse_repeated_keys_last_wins():
+    rows = [{"item_id": "a", "name": "first"}, {"item_id": "b", "name": "b"}, {"item_id": "a", "name": "last"}]
+    statements = list(batch_writes.merge_statements("RESEARCH_DATA.ITEMS", COLUMNS, rows, key_columns=["item_id"]))
+    assert len(statements) == 1
+    query, params = statements[0]
+    assert params == ["a", "last", "b", "b"]
+    assert query.count("(?, ?)") == 2
+    assert "WHEN MATCHED THEN UPDATE SET name = s.name" in query
+
+
+def test_merge_statements_chunk_after_collapsing():
+    rows = [{"item_id": str(i % 3), "name": str(i)} for i in range(9)]
+    statements = list(batch_writes.merge_statements("RESEARCH_DATA.ITEMS", COLUMNS, rows, ["item_id"], chunk_size=2))
+    assert [params for _, params in statements] == [["0", "6", "1", "7"], ["2", "8"]]
+
+
+def test_insert_only_merge_has_no_update_clause():
+    (query, _), = batch_writes.merge_statements(
+        "RESEARCH_DATA.ITEMS", COLUMNS, [{"item_id": "a", "name": "x"}], ["item_id"], update_columns=())
+    assert "WHEN MATCHED" not in query
+    assert "WHEN NOT MATCHED THEN INSERT" in query
+
+
+def test_upsert_rows_inserts_then_updates(execute, items):
+    rows = [{"item_id": "a", "name": "x"}, {"item_id": "b", "name": "y"}]
+    assert batch_writes.upsert_rows(execute, "RESEARCH_DATA.ITEMS", COLUMNS, rows, ["item_id"]) == (2, 0)
+    rows = [{"item_id": "a", "name": "x2"}, {"item_id": "c", "name": "z"}]
+    assert batch_writes.upsert_rows(execute, "RESEARCH_DATA.ITEMS", COLUMNS, rows, ["item_id"]) == (1, 1)
+    assert items() == [("a", "x2", None), ("b", "y", None), ("c", "z", None)]
+
+
+def test_insert_only_upsert_keeps_existing_rows(execute, items):
+    batch_writes.upsert_rows(execute, "RESEARCH_DATA.ITEMS", COLUMNS, [{"item_id": "a", "name": "x"}], ["item_id"])
+    rows = [{"item_id": "a", "name": "changed"}, {"item_id": "b", "name": "y"}]
+    assert batch_writes.upsert_rows(execute, "RESEARCH_DATA.ITEMS", COLUMNS, rows, ["item_id"],
+                                    update_columns=()) == (1, 0)
+    assert items() == [("a", "x", None), ("b", "y", None)]
+
+
+def test_upsert_rows_json_columns(execute, items):
+    rows = [{"item_id": "a", "name": "x", "details": '{"unit": "bpm"}'}]
+    batch_writes.upsert_rows(execute, "RESEARCH_DATA.ITEMS", COLUMNS + ["details"], rows, ["item_id"],
+                             json_columns=["details"])
+    assert json.loads(items()[0][2]) == {"unit": "bpm"}
+
+
+def test_upsert_rows_rolls_back_every_chunk_on_failure(execute, items):
+    batch_writes.upsert_rows(execute, "RESEARCH_DATA.ITEMS", COLUMNS, [{"item_id": "a", "name": "x"}], ["item_id"])
+    rows = [{"item_id": "a", "name": "x2"}, {"item_id": "b", "name": "y"}, {"item_id": "c", "name": None}]
+    with pytest.raises(Exception):
+        batch_writes.upsert_rows(execute, "RESEARCH_DATA.ITEMS", COLUMNS, rows, ["item_id"], chunk_size=2)
+    assert items() == [("a", "x", None)]
+
+
+def test_rollback_leaves_other_threads_writes(execute, items):
+    in_transaction = threading.Event()
+
+    def pause_after_first_chunk(query, params=None):
+        result = execute(query, params)
+        if query.startswith("MERGE") and not in_transaction.is_set():
+            in_transaction.set()
+            time.sleep(0.2)
+        return result
+
+    def other_writer():
+        in_transaction.wait()
+        batch_writes.upsert_rows(execute, "RESEARCH_DATA.ITEMS", COLUMNS, [{"item_id": "z", "name": "other"}],
+                                 ["item_id"])
+
+    writer = threading.Thread(target=other_writer)
+    writer.start()
+    rows = [{"item_id": "a", "name": "x"}, {"item_id": "b", "name": "y"}, {"item_id": "c", "name": None}]
+    with pytest.raises(Exception):
+        batch_writes.upsert_rows(pause_after_first_chunk, "RESEARCH_DATA.ITEMS", COLUMNS, rows, ["item_id"],
+                                 chunk_size=2)
+    writer.join()
+    assert items() == [("z", "other", None)]
+
+
+def test_transaction_is_held_from_begin_to_commit(execute, items):
+    held = []
+
+    class Transaction:
+        def __enter__(self):
+            held.append("enter")
+
+        def __exit__(self, *exc):
+            held.append("exit")
+
+    def record(query, params=None):
+        held.append(query.split()[0])
+        return execute(query, params)
+
+    rows = [{"item_id": str(i), "name": "x"} for i in range(3)]
+    batch_writes.upsert_rows(record, "RESEARCH_DATA.ITEMS", COLUMNS, rows, ["item_id"], chunk_size=2,
+                             transaction=Transaction)
+    assert held == ["enter", "BEGIN", "MERGE", "MERGE", "COMMIT", "exit"]
+    held.clear()
+    batch_writes.insert_rows(record, "RESEARCH_DATA.ITEMS", COLUMNS, [{"item_id": "new", "name": "x"}],
+                             transaction=Transaction)
+    assert held == ["INSERT"]
+
+
+def test_insert_rows_rolls_back_every_chunk_on_failure(execute, items):
+    rows = [{"item_id": "a", "name": "x"}, {"item_id": "b", "name": "y"}, {"item_id": "c", "name": None}]
+    with pytest.raises(Exception):
+        batch_writes.insert_rows(execute, "RESEARCH_DATA.ITEMS", COLUMNS, rows, chunk_size=2)
+    assert items() == []
+
+
+def test_insert_rows_statement_count(execute, items):
+    rows = [{"item_id": str(i), "name": "x"} for i in range(5)]
+    assert batch_writes.insert_rows(execute, "RESEARCH_DATA.ITEMS", COLUMNS, rows, chunk_size=2) == 3
+    assert len(items()) == 5
@@ -0,0 +1,46 @@
+import re
+import threading
+
+import id_generator
+from id_generator import content_id, new_id
+
+ID = re.compile(r"^OBS_[0-9A-HJKMNP-TV-Z]{26}$")
+
+
+def test_new_id_format():
+    assert ID.match(new_id("OBS"))
+
+
+def test_ids_increase_within_one_millisecond():
+    generator = id_generator.IdGenerator()
+    ids = [generator.ulid() for _ in range(10_000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_ids_are_unique_across_threads():
+    ids = []
+
+    def draw():
+        ids.extend(new_id("OBS") for _ in range(2000))
+
+    threads = [threading.Thread(target=draw) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(ids)) == len(ids) == 16_000
+
+
+def test_ids_stay_ordered_when_the_clock_steps_back(monkeypatch):
+    generator = id_generator.IdGenerator()
+    first = generator.ulid()
+    monkeypatch.setattr(id_generator.time, "time_ns", lambda: 0)
+    assert generator.ulid() > first
+
+
+def test_content_id_depends_only_on_content():
+    assert ID.match(content_id("OBS", "STD_1", "Sheet1", "PART_1", 72))
+    assert content_id("OBS", "STD_1", "Sheet1", "PART_1", 72) == content_id("OBS", "STD_1", "Sheet1", "PART_1", 72)
+    assert content_id("OBS", "STD_1", "Sheet1", "PART_1", 72) != content_id("OBS", "STD_2", "Sheet1", "PART_1", 72)
+    assert content_id("OBS", "STD_1", None, "a") != content_id("OBS", "STD_1", "a", None)
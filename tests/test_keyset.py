@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+import keyset
+
+KEYS = ("score", "visit_date", "record_id")
+
+QUERY = "SELECT record_id, score, visit_date FROM RESEARCH_DATA.RANKED"
+
+
+@pytest.fixture
+def ranked(execute):
+    """RESEARCH_DATA.RANKED rows with many NULL and repeated score and visit_date values"""
+    rng = random.Random(7)
+    rows = [(f"R{i:03d}", rng.choice([None, None, 1, 2, 2, 3]),
+             rng.choice([None, "2024-01-01", "2024-01-02", "2024-01-02"])) for i in range(97)]
+    execute("CREATE TABLE CLINICAL_RESEARCH.RESEARCH_DATA.RANKED"
+            " (record_id VARCHAR(50) PRIMARY KEY, score INTEGER, visit_date DATE)")
+    for row in rows:
+        execute("INSERT INTO CLINICAL_RESEARCH.RESEARCH_DATA.RANKED VALUES (?, ?, ?)", list(row))
+    return rows
+
+
+def expected_order(rows):
+    """record_ids ordered by every key descending, NULLs last"""
+    # Stable sorts, least significant key first: record_id, visit_date, score
+    for position in (0, 2, 1):
+        rows = sorted(rows, key=lambda row: (False,) if row[position] is None else (True, row[position]),
+                      reverse=True)
+    return [row[0] for row in rows]
+
+
+def test_expected_order_sorts_nulls_last():
+    rows = [("A", None, None), ("B", 1, None), ("C", 1, "2024-01-02"), ("D", 2, "2024-01-01"), ("E", 1, "2024-01-02")]
+    assert expected_order(rows) == ["D", "E", "C", "B", "A"]
+
+
+def test_seek_without_cursor_reads_everything():
+    assert keyset.seek(KEYS, None) == ("", [])
+
+
+def test_seek_skips_ranges_after_null_keys():
+    where, params = keyset.seek(KEYS, (None, "2024-01-01", "R005"))
+    assert where == ("WHERE (score IS NULL AND (visit_date < ? OR visit_date IS NULL))"
+                     " OR (score IS NULL AND visit_date = ? AND (record_id < ? OR record_id IS NULL))")
+    assert params == ["2024-01-01", "2024-01-01", "R005"]
+
+
+@pytest.mark.parametrize("rows_per_page", [1, 2, 5, 13, 200])
+def test_pages_cover_every_row_once(session, ranked, rows_per_page):
+    seen, cursor = [], None
+    while True:
+        query, params = keyset.page_query(QUERY, KEYS, cursor, rows_per_page)
+        page = session.sql(query, params=params).to_pandas()
+        seen += list(page["RECORD_ID"])
+        if len(page) < rows_per_page:
+            break
+        cursor = keyset.cursor_after(page, KEYS)
+    assert seen == expected_order(ranked)
+
+
+@pytest.mark.parametrize("rows_per_page", [1, 3, 10])
+def test_chunked_pages_cover_every_row_once(session, ranked, rows_per_page):
+    """Walk pages as the app does: chunks of PAGES_PER_CHUNK pages plus one row, from the visited cursors"""
+    seen, cursors, page_number = [], [None], 0
+    while True:
+        query, params = keyset.page_query(QUERY, KEYS, keyset.chunk_cursor(cursors, page_number),
+                                          keyset.chunk_size(rows_per_page))
+        chunk = session.sql(query, params=params).to_pandas()
+        page, has_next = keyset.page_of(chunk, page_number, rows_per_page)
+        seen += list(page["RECORD_ID"])
+        if not has_next:
+            break
+        cursors.append(keyset.cursor_after(page, KEYS))
+        page_number += 1
+    assert seen == expected_order(ranked)
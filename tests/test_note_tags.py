@@ -0,0 +1,123 @@
+import json
+from datetime import date, timedelta
+
+import pytest
+
+import batch_writes
+import keyset
+import note_tags
+
+TODAY = date.today()
+WINDOW = TODAY - timedelta(days=30)
+
+NOTE_COLUMNS = ["note_id", "study_id", "note_title", "note_text", "note_date", "tags"]
+
+
+@pytest.fixture
+def save_note(execute):
+    """Write a note as the Quick Note form does, tags as a JSON array"""
+    def save_note(note_id, tags, note_date=TODAY):
+        note = {"note_id": note_id, "study_id": "STD_1", "note_title": note_id, "note_text": "text",
+                "note_date": note_date.isoformat(), "tags": json.dumps(tags) if tags else None}
+        batch_writes.upsert_rows(execute, "RESEARCH_DATA.RESEARCH_NOTES", NOTE_COLUMNS, [note], ["note_id"],
+                                 json_columns=["tags"])
+    return save_note
+
+
+@pytest.fixture
+def tagged(save_note):
+    save_note("NOTE_1", ["ae", "sae"])
+    save_note("NOTE_2", ["ae"])
+    save_note("NOTE_3", ["sae", "dose-change"])
+    save_note("NOTE_4", ["ae", "sae", "dose-change"])
+    save_note("NOTE_5", None)
+
+
+def tagged_notes(session, tags, date_from=WINDOW):
+    query, seek_params = keyset.page_query(note_tags.TAGGED_NOTES_QUERY, note_tags.KEYS, None, 100)
+    rows = session.sql(query, params=note_tags.tagged_notes_params(tags, date_from) + seek_params).collect()
+    return sorted(row["NOTE_ID"] for row in rows)
+
+
+def facets(session, tags, date_from=WINDOW):
+    query, params = note_tags.facet_query(tags, date_from)
+    return {row["TAG"]: row["NOTE_COUNT"] for row in session.sql(query, params=params).collect()}
+
+
+@pytest.mark.parametrize("text, tag", [
+    ("Dose Change", "dose-change"),
+    ("  dose-change ", "dose-change"),
+    ("SAE!!", "sae"),
+    ("--follow up / week 2--", "follow-up-week-2"),
+    ("lab_result", "lab_result"),
+    ("!!!", ""),
+    (None, ""),
+])
+def test_normalize_tag(text, tag):
+    assert note_tags.normalize_tag(text) == tag
+
+
+def test_normalize_tag_truncates():
+    assert note_tags.normalize_tag("x" * 80) == "x" * note_tags.MAX_TAG_LENGTH
+
+
+def test_parse_tags_keeps_first_of_each_tag():
+    assert note_tags.parse_tags("Dose Change, AE,, dose-change ,!!, sae, ae") == ["dose-change", "ae", "sae"]
+    assert note_tags.parse_tags("") == note_tags.parse_tags(None) == []
+
+
+def test_parse_tags_is_capped():
+    text = ", ".join(f"tag{i}" for i in range(30))
+    assert note_tags.parse_tags(text) == [f"tag{i}" for i in range(note_tags.MAX_TAGS_PER_NOTE)]
+
+
+def test_params_fill_every_slot():
+    for tags in (["ae"], ["ae", "sae", "dose-change", "b", "c"]):
+        params = note_tags.tagged_notes_params(tags, WINDOW)
+        assert len(params) == note_tags.TAGGED_NOTES_QUERY.count("?")
+        assert params[-1] == len(tags)
+        query, params = note_tags.facet_query(tags, WINDOW)
+        assert query is note_tags.FACET_QUERY and len(params) == query.count("?")
+    assert note_tags.facet_query([], WINDOW) == (note_tags.ALL_FACETS_QUERY, [WINDOW.isoformat()])
+
+
+def test_filter_needs_every_selected_tag(session, tagged):
+    assert tagged_notes(session, ["ae"]) == ["NOTE_1", "NOTE_2", "NOTE_4"]
+    assert tagged_notes(session, ["ae", "sae"]) == ["NOTE_1", "NOTE_4"]
+    assert tagged_notes(session, ["sae", "dose-change", "ae"]) == ["NOTE_4"]
+    assert tagged_notes(session, ["ae", "unknown"]) == []
+
+
+def test_facets_count_the_tags_of_matching_notes(session, tagged):
+    assert facets(session, []) == {"ae": 3, "sae": 3, "dose-change": 2}
+    assert facets(session, ["ae"]) == {"ae": 3, "sae": 2, "dose-change": 1}
+    assert facets(session, ["ae", "dose-change"]) == {"ae": 1, "sae": 1, "dose-change": 1}
+
+
+def test_index_follows_tag_changes(session, tagged, save_note, execute):
+    execute("ALTER TASK CLINICAL_RESEARCH.RESEARCH_DATA.REFRESH_NOTE_TAGS SUSPEND")
+    save_note("NOTE_1", ["ae"])
+    save_note("NOTE_6", ["new"])
+    assert tagged_notes(session, ["ae", "sae"]) == ["NOTE_1", "NOTE_4"]
+    assert tagged_notes(session, ["new"]) == []
+    batch_writes.run_in_transaction(execute, note_tags.index_statements(["NOTE_1", "NOTE_6"]))
+    assert tagged_notes(session, ["ae", "sae"]) == ["NOTE_4"]
+    assert tagged_notes(session, ["new"]) == ["NOTE_6"]
+    execute("DELETE FROM CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES WHERE note_id = ?", ["NOTE_4"])
+    batch_writes.run_in_transaction(execute, note_tags.index_statements(["NOTE_4"]))
+    assert tagged_notes(session, ["ae"]) == ["NOTE_1", "NOTE_2"]
+    assert facets(session, []) == {"ae": 2, "sae": 1, "dose-change": 1, "new": 1}
+
+
+def test_index_statements_are_chunked():
+    statements = list(note_tags.index_statements([f"NOTE_{i}" for i in range(2500)]))
+    assert [query.split()[0] for query, _ in statements] == ["DELETE", "INSERT"] * 3
+    assert [len(params) for _, params in statements] == [1000, 1000, 1000, 1000, 500, 500]
+
+
+def test_filter_and_facets_keep_to_the_date_window(session, tagged, save_note):
+    save_note("NOTE_OLD", ["ae", "sae"], note_date=TODAY - timedelta(days=90))
+    assert tagged_notes(session, ["ae", "sae"]) == ["NOTE_1", "NOTE_4"]
+    assert tagged_notes(session, ["ae", "sae"], date_from=TODAY - timedelta(days=100)) == [
+        "NOTE_1", "NOTE_4", "NOTE_OLD"]
+    assert facets(session, [])["ae"] == 3
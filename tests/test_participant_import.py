@@ -0,0 +1,23 @@
+import pytest
+
+import participant_import
+from id_generator import new_id
+
+
+def test_copy_statement_reads_the_import_folder():
+    import_id = new_id("IMP")
+    query = participant_import.copy_statement(import_id)
+    assert f"SELECT '{import_id}'," in query
+    assert f"FROM {participant_import.STAGE}/{import_id}/\n" in query
+
+
+@pytest.mark.parametrize("import_id", [
+    "IMP_01JA2B3C4D5E6F7G8H9J0KMNP",
+    "IMP_01JA2B3C4D5E6F7G8H9J0KMNPI",
+    "PART_01JA2B3C4D5E6F7G8H9J0KMNPQ",
+    "IMP_01JA2B3C4D5E6F7G8H9J0KMNPQ' OR '1'='1",
+    "IMP_01JA2B3C4D5E6F7G8H9J0KMNPQ/../",
+])
+def test_copy_statement_rejects_other_text(import_id):
+    with pytest.raises(ValueError):
+        participant_import.copy_statement(import_id)
@@ -0,0 +1,119 @@
+import math
+import re
+from datetime import date, timedelta
+
+import pytest
+
+import keyset
+import record_search
+
+TODAY = date.today()
+WINDOW = TODAY - timedelta(days=30)
+
+NOTES = {
+    "NOTE_A": ("Visit summary", "Mild headache reported after the second dose, resolved without treatment by day three"),
+    "NOTE_B": ("Headache", "headache again"),
+    "NOTE_C": ("Nausea", "nausea in the morning"),
+    "NOTE_D": ("Follow up", "headache with nausea"),
+}
+
+
+@pytest.fixture
+def add_note(execute):
+    def add_note(note_id, title, text, study_id="STD_1", note_date=TODAY):
+        execute("INSERT INTO CLINICAL_RESEARCH.RESEARCH_DATA.RESEARCH_NOTES"
+                " (note_id, study_id, note_title, note_text, note_date) VALUES (?, ?, ?, ?, ?)",
+                [note_id, study_id, title, text, note_date.isoformat()])
+    return add_note
+
+
+@pytest.fixture
+def notes(add_note):
+    for note_id, (title, text) in NOTES.items():
+        add_note(note_id, title, text)
+    return NOTES
+
+
+def search(session, text, date_from=WINDOW, doc_types=None):
+    query, seek_params = keyset.page_query(record_search.SEARCH_QUERY, record_search.KEYS, None, 100)
+    params = record_search.search_params(record_search.search_terms(text), date_from, doc_types) + seek_params
+    return session.sql(query, params=params).to_pandas()
+
+
+def bm25(terms, documents):
+    """Scores of documents ({id: (title, body)}) for terms, by the formula in record_search"""
+    tokens = {key: re.findall(r"[a-z0-9]+", f"{title} {body}".lower()) for key, (title, body) in documents.items()}
+    lengths = {key: len(title) + len(body) for key, (title, body) in documents.items()}
+    average_length = sum(lengths.values()) / len(documents)
+    scores = {}
+    for term in terms:
+        matching = [key for key in documents if term in tokens[key]]
+        idf = math.log(1 + (len(documents) - len(matching) + 0.5) / (len(matching) + 0.5))
+        for key in matching:
+            tf = tokens[key].count(term)
+            norm = record_search.K1 * (1 - record_search.B + record_search.B * lengths[key] / average_length)
+            scores[key] = scores.get(key, 0) + idf * tf * (record_search.K1 + 1) / (tf + norm)
+    return scores
+
+
+def test_search_terms_are_distinct_lower_case_tokens():
+    assert record_search.search_terms("Headache, HEADACHE and nausea!") == ["headache", "and", "nausea"]
+    assert record_search.search_terms("BP-120/80") == ["bp", "120", "80"]
+    assert record_search.search_terms("") == record_search.search_terms(None) == []
+
+
+def test_search_terms_are_capped():
+    text = " ".join(f"term{i}" for i in range(20))
+    assert record_search.search_terms(text) == [f"term{i}" for i in range(record_search.MAX_TERMS)]
+
+
+def test_search_params_fill_every_slot():
+    params = record_search.search_params(["headache", "nausea"], WINDOW, ["NOTE"])
+    assert len(params) == record_search.SEARCH_QUERY.count("?")
+    assert params[:2] == [WINDOW.isoformat()] * 2
+    assert params[2:6] == ["NOTE", None, None, None]
+    assert params[6] == "headache nausea"
+    assert params[7:] == ["headache", "nausea"] + [None] * (record_search.MAX_TERMS - 2)
+
+
+def test_latest_params_fill_every_slot():
+    params = record_search.latest_params(WINDOW)
+    assert len(params) == record_search.LATEST_QUERY.count("?")
+    assert params[1:] == list(record_search.DOC_TYPES)
+
+
+def test_ranking_matches_bm25(session, notes):
+    for text in ("headache", "headache nausea", "nausea morning"):
+        results = search(session, text)
+        expected = bm25(record_search.search_terms(text), notes)
+        assert dict(zip(results["RECORD_ID"], results["RELEVANCE"])) == pytest.approx(
+            {key: round(score, 3) for key, score in expected.items()}, abs=1e-3)
+        assert list(results["RECORD_ID"]) == sorted(expected, key=expected.get, reverse=True)
+
+
+def test_documents_with_more_matching_terms_rank_first(session, notes):
+    assert list(search(session, "headache nausea")["RECORD_ID"])[0] == "NOTE_D"
+    # A repeated term in a short note outranks one mention in a long note
+    assert list(search(session, "headache")["RECORD_ID"])[:2] == ["NOTE_B", "NOTE_D"]
+
+
+def test_search_filters_by_date_window_and_type(session, notes, add_note):
+    add_note("NOTE_OLD", "Headache", "headache headache", note_date=TODAY - timedelta(days=90))
+    assert "NOTE_OLD" not in set(search(session, "headache")["RECORD_ID"])
+    assert "NOTE_OLD" in set(search(session, "headache", date_from=TODAY - timedelta(days=100))["RECORD_ID"])
+    assert search(session, "headache", doc_types=["FINDING"]).empty
+
+
+def test_index_statements_make_saved_records_searchable_at_once(session, execute, add_note):
+    execute("ALTER TASK CLINICAL_RESEARCH.RESEARCH_DATA.REFRESH_SEARCH_DOCUMENTS SUSPEND")
+    add_note("NOTE_NEW", "Rash", "rash on the forearm")
+    assert search(session, "rash").empty
+    for query, params in record_search.index_statements("RESEARCH_NOTES", ["NOTE_NEW"]):
+        execute(query, params)
+    assert list(search(session, "forearm")["RECORD_ID"]) == ["NOTE_NEW"]
+
+
+def test_index_statements_skip_tables_without_documents():
+    assert list(record_search.index_statements("PARTICIPANTS", ["PART_1"])) == []
+    statements = list(record_search.index_statements("FINDINGS", [f"FND_{i}" for i in range(2500)]))
+    assert [len(params) for _, params in statements] == [1000, 1000, 500]
@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+
+import pytest
+
+import write_behind
+
+COLUMNS = ["item_id", "name"]
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return write_behind.WriteJournal(str(tmp_path / "journal.db"))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controls the time write_behind sees for backoff; advance with clock.now += seconds"""
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(write_behind, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_enqueue_is_idempotent_on_the_record_key(journal):
+    rows = [{"item_id": "a", "name": "x"}]
+    assert journal.enqueue("RESEARCH_DATA.ITEMS", COLUMNS, rows) == ["a"]
+    journal.enqueue("RESEARCH_DATA.ITEMS", COLUMNS, rows)
+    assert journal.pending_count() == 1
+
+
+def test_flush_writes_and_confirms(journal, execute, items, clock):
+    journal.enqueue("RESEARCH_DATA.ITEMS", COLUMNS, [{"item_id": "a", "name": "x"}, {"item_id": "b", "name": "y"}],
+                    study_id="STD_1")
+    flushed = []
+    flusher = write_behind.Flusher(journal, execute, on_flushed=lambda *args: flushed.append(args))
+    assert flusher.flush() == 2
+    assert items() == [("a", "x", None), ("b", "y", None)]
+    assert [e.status for e in journal.status(["a", "b"])] == [write_behind.CONFIRMED] * 2
+    assert flushed == [("RESEARCH_DATA.ITEMS", {"STD_1"}, ["a", "b"])]
+
+
+def test_replay_after_lost_acknowledgement_writes_once(journal, execute, items, clock):
+    journal.enqueue("RESEARCH_DATA.ITEMS", COLUMNS, [{"item_id": "a", "name": "x"}])
+    acknowledged = []
+
+    def lossy(query, params=None):
+        result = execute(query, params)
+        if not acknowledged:
+            acknowledged.append(query)
+            raise ConnectionError("acknowledgement lost")
+        return result
+
+    flusher = write_behind.Flusher(journal, lossy)
+    assert flusher.flush() == 0
+    entry, = journal.status(["a"])
+    assert (entry.status, entry.attempts, entry.last_error) == (write_behind.PENDING, 1, "acknowledgement lost")
+    assert items() == [("a", "x", None)]
+
+    # Not due again until the backoff has passed
+    assert flusher.flush() == 0
+    clock.now += write_behind.MAX_BACKOFF_SECONDS
+    assert flusher.flush() == 1
+    assert items() == [("a", "x", None)]
+    assert journal.status(["a"])[0].status == write_behind.CONFIRMED
+
+
+def test_backoff_doubles_up_to_the_limit(journal, clock):
+    journal.enqueue("RESEARCH_DATA.ITEMS", COLUMNS, [{"item_id": "a", "name": "x"}])
+    waits = []
+    for _ in range(8):
+        journal.mark_failed(["a"], "down")
+        for wait in range(0, write_behind.MAX_BACKOFF_SECONDS + 1):
+            clock.now += 1
+            if journal.due(10):
+                waits.append(wait + 1)
+                break
+    assert waits == [1, 2, 4, 8, 16, 32, 60, 60]
+
+
+def test_flush_prunes_confirmed_entries_after_retention(journal, execute, items, clock):
+    journal.enqueue("RESEARCH_DATA.ITEMS", COLUMNS, [{"item_id": "a", "name": "x"}])
+    write_behind.Flusher(journal, execute).flush()
+    journal.enqueue("RESEARCH_DATA.ITEMS", COLUMNS, [{"item_id": "b", "name": "y"}])
+    write_behind.Flusher(journal, execute, retention=-1).flush()
+    assert journal.status(["a", "b"]) == []
+    assert items() == [("a", "x", None), ("b", "y", None)]
+
+
+def test_entries_are_confirmed_after_the_transaction_ends(journal, execute, items, clock):
+    journal.enqueue("RESEARCH_DATA.ITEMS", COLUMNS, [{"item_id": "a", "name": "x"}])
+    seen = []
+
+    class Transaction:
+        def __enter__(self):
+            seen.append(("enter", journal.status(["a"])[0].status))
+
+        def __exit__(self, *exc):
+            seen.append(("exit", journal.status(["a"])[0].status))
+
+    assert write_behind.Flusher(journal, execute, transaction=Transaction).flush() == 1
+    assert seen == [("enter", write_behind.PENDING), ("exit", write_behind.PENDING)]
+    assert journal.status(["a"])[0].status == write_behind.CONFIRMED
+
+
+def test_failed_batch_is_retried_row_by_row(journal, execute, items, clock):
+    rows = [{"item_id": "a", "name": "x"}, {"item_id": "b", "name": None}, {"item_id": "c", "name": "z"}]
+    journal.enqueue("RESEARCH_DATA.ITEMS", COLUMNS, rows)
+    assert write_behind.Flusher(journal, execute).flush() == 2
+    assert items() == [("a", "x", None), ("c", "z", None)]
+    assert [(e.entry_id, e.status, e.attempts) for e in journal.status(["a", "b", "c"])] == [
+        ("a", write_behind.CONFIRMED, 0), ("b", write_behind.PENDING, 1), ("c", write_behind.CONFIRMED, 0)]
+
+
+def test_entry_fails_after_max_attempts(journal, execute, items, clock):
+    journal.enqueue("RESEARCH_DATA.ITEMS", COLUMNS, [{"item_id": "b", "name": None}])
+    flusher = write_behind.Flusher(journal, execute, max_attempts=3)
+    for _ in range(3):
+        assert flusher.flush() == 0
+        clock.now += write_behind.MAX_BACKOFF_SECONDS
+    entry, = journal.status(["b"])
+    assert (entry.status, entry.attempts) == (write_behind.FAILED, 3)
+    assert entry.last_error
+    assert (journal.pending_count(), journal.failed_count()) == (0, 1)
+    assert journal.due(10) == []
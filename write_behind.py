@@ -0,0 +1,234 @@
+"""
+Write-behind queue for data-entry saves
+
+With write-behind on, a save appends its rows to a local SQLite journal
+(WAL, synchronous=FULL) and returns at once; the coordinator does not wait
+for a warehouse that may be resuming. A background Flusher drains the
+journal in batches, one insert-only MERGE per batch. Every journal entry
+is keyed by the record's own primary key, which doubles as the idempotency
+key, so a retry after a lost acknowledgement never writes a row twice.
+A batch that fails is retried one row at a time, so one bad row does not
+hold back the rest. A row that fails stays PENDING and is retried with
+exponential backoff; after MAX_ATTEMPTS attempts it is set aside as
+FAILED with its last error, shown on the Data Entry page, instead of
+being retried forever.
+CONFIRMED entries are kept for CONFIRMED_RETENTION_SECONDS, so the Data
+Entry page can show them as saved, and then deleted by the flusher.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+import batch_writes
+
+DEFAULT_JOURNAL_PATH = os.path.join(os.path.expanduser("~"), ".clinical_research_journal.db")
+
+PENDING = "PENDING"
+CONFIRMED = "CONFIRMED"
+FAILED = "FAILED"
+
+MAX_BACKOFF_SECONDS = 60
+
+# About a quarter of an hour of retries at the backoff cap
+MAX_ATTEMPTS = 20
+
+CONFIRMED_RETENTION_SECONDS = 24 * 60 * 60
+
+JournalEntry = namedtuple("JournalEntry", [
+    "entry_id", "table_name", "columns", "json_columns", "row", "study_id", "status",
+    "attempts", "last_error", "created_at", "confirmed_at",
+])
+
+
+class WriteJournal:
+    """Durable local journal of rows waiting to be written"""
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                entry_id TEXT NOT NULL UNIQUE,
+                table_name TEXT NOT NULL,
+                columns TEXT NOT NULL,
+                json_columns TEXT NOT NULL,
+                row TEXT NOT NULL,
+                study_id TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                confirmed_at TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS journal_pending ON journal (status, next_attempt)")
+
+    def enqueue(self, table, columns, rows, study_id=None, json_columns=()):
+        """Journal rows (dicts keyed by column); the first column is the record key. Returns the keys"""
+        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        entries = [
+            (row[columns[0]], table, json.dumps(list(columns)), json.dumps(list(json_columns)),
+             json.dumps({column: row[column] for column in columns}), study_id, PENDING, created_at)
+            for row in rows
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO journal (entry_id, table_name, columns, json_columns, row,"
+                " study_id, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                entries,
+            )
+            self._conn.execute("COMMIT")
+        return [entry[0] for entry in entries]
+
+    def _entries(self, where, params=()):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT entry_id, table_name, columns, json_columns, row, study_id, status, attempts,"
+                f" last_error, created_at, confirmed_at FROM journal WHERE {where}",
+                params,
+            ).fetchall()
+        return [
+            JournalEntry(r[0], r[1], tuple(json.loads(r[2])), tuple(json.loads(r[3])), json.loads(r[4]), *r[5:])
+            for r in rows
+        ]
+
+    def due(self, limit):
+        """Pending entries whose next attempt is due, oldest first"""
+        return self._entries("status = ? AND next_attempt <= ? ORDER BY seq LIMIT ?",
+                             (PENDING, time.time(), limit))
+
+    def status(self, entry_ids):
+        """Journal entries for the given keys, in the order given"""
+        if not entry_ids:
+            return []
+        by_id = {e.entry_id: e for e in self._entries(
+            f"entry_id IN ({', '.join('?' for _ in entry_ids)})", list(entry_ids))}
+        return [by_id[entry_id] for entry_id in entry_ids if entry_id in by_id]
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM journal WHERE status = ?", (PENDING,)).fetchone()[0]
+
+    def failed_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM journal WHERE status = ?", (FAILED,)).fetchone()[0]
+
+    def mark_confirmed(self, entry_ids):
+        confirmed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE journal SET status = ?, confirmed_at = ?, last_error = NULL WHERE entry_id = ?",
+                [(CONFIRMED, confirmed_at, entry_id) for entry_id in entry_ids],
+            )
+
+    def prune_confirmed(self, retention_seconds):
+        """Delete entries confirmed more than retention_seconds ago; returns the number deleted"""
+        cutoff = (datetime.now() - timedelta(seconds=retention_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM journal WHERE status = ? AND confirmed_at < ?", (CONFIRMED, cutoff)
+            ).rowcount
+
+    def mark_failed(self, entry_ids, error, max_attempts=MAX_ATTEMPTS):
+        """Record a failed attempt and back off before the next one, or set the entry aside as FAILED"""
+        with self._lock:
+            for entry_id in entry_ids:
+                self._conn.execute(
+                    "UPDATE journal SET attempts = attempts + 1, last_error = ?,"
+                    " next_attempt = ? + MIN(?, 1 << MIN(attempts, 16)),"
+                    " status = CASE WHEN attempts + 1 >= ? THEN ? ELSE status END WHERE entry_id = ?",
+                    (error, time.time(), MAX_BACKOFF_SECONDS, max_attempts, FAILED, entry_id),
+                )
+
+
+class Flusher(threading.Thread):
+    """Background thread draining a WriteJournal into the warehouse
+
+    execute(query, params) runs one statement and returns its rows;
+    on_flushed(table, study_ids, record_ids) is called after each confirmed batch;
+    entries confirmed more than retention seconds ago are deleted after a flush.
+    transaction() holds the session for the write of a batch, so no other
+    thread's ROLLBACK can undo it once it is confirmed (see batch_writes).
+    Entries failing max_attempts times are set aside as FAILED.
+    """
+
+    def __init__(self, journal, execute, on_flushed=None, interval=1.0, batch_size=batch_writes.MAX_ROWS_PER_INSERT,
+                 retention=CONFIRMED_RETENTION_SECONDS, transaction=None, max_attempts=MAX_ATTEMPTS):
+        super().__init__(name="write-behind-flusher", daemon=True)
+        self.journal = journal
+        self.execute = execute
+        self.on_flushed = on_flushed
+        self.interval = interval
+        self.batch_size = batch_size
+        self.retention = retention
+        self.transaction = transaction
+        self.max_attempts = max_attempts
+        self._wake = threading.Event()
+
+    def wake(self):
+        """Flush now instead of at the next interval"""
+        self._wake.set()
+
+    def run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Journal trouble must not kill the thread; entries stay pending
+                pass
+
+    def _write(self, table, columns, json_columns, entries):
+        # Insert-only on the key: rows a previous, unacknowledged attempt wrote are skipped.
+        # Confirmed only once the transaction has ended, committed
+        with (self.transaction or nullcontext)():
+            batch_writes.upsert_rows(self.execute, table, list(columns), [entry.row for entry in entries],
+                                     key_columns=columns[:1], update_columns=(), json_columns=json_columns,
+                                     transaction=self.transaction)
+
+    def flush(self):
+        """Write every due entry; returns the number confirmed"""
+        groups = {}
+        for entry in self.journal.due(self.batch_size):
+            groups.setdefault((entry.table_name, entry.columns, entry.json_columns), []).append(entry)
+        confirmed = 0
+        for (table, columns, json_columns), entries in groups.items():
+            try:
+                self._write(table, columns, json_columns, entries)
+                written = entries
+            except Exception as e:
+                if len(entries) == 1:
+                    self.journal.mark_failed([entries[0].entry_id], str(e), self.max_attempts)
+                    continue
+                # Find the rows that fail; the others are written on their own
+                written = []
+                for entry in entries:
+                    try:
+                        self._write(table, columns, json_columns, [entry])
+                    except Exception as e:
+                        self.journal.mark_failed([entry.entry_id], str(e), self.max_attempts)
+                    else:
+                        written.append(entry)
+                if not written:
+                    continue
+            entry_ids = [entry.entry_id for entry in written]
+            self.journal.mark_confirmed(entry_ids)
+            confirmed += len(entry_ids)
+            if self.on_flushed:
+                self.on_flushed(table, {entry.study_id for entry in written}, entry_ids)
+        if confirmed:
+            self.journal.prune_confirmed(self.retention)
+        return confirmed